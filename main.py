@@ -20,6 +20,8 @@ try:
     from src import trader
     from src import audit_trades
     from src import weekly_update
+    from src import security_master
+    from src import universe
 except ImportError as e:
     print(f"❌ 关键模块导入失败: {e}")
     print("请确保 src/ 目录下包含所有必要的脚本文件。")
@@ -45,6 +47,8 @@ def print_menu():
     print(" [4]  📉  策略回测 (激进版 + 风控)")
     print(" [5]  🕵️  审计回测记录 (查ST/涨跌停)")
     print(" [6]  🚀  实盘选股 (输出今日 Buy List)")
+    print(" [7]  📸  收盘快照更新 (日常增量，一次请求)")
+    print(" [8]  📦  数据归档 (导出/导入，新机器冷启动)")
     print("-" * 30)
     print(" [9]  🤖  一键周度更新 (自动化流水线)")
     print(" [0]  🚪  退出系统")
@@ -54,9 +58,12 @@ def print_menu():
 def task_init_data():
     print("\n>>> 正在启动数据初始化流程...")
     # 1. 下载
-    data_loader.download_all_stock_history(start_date="2014-01-01")
-    # 2. 筛选
+    data_loader.download_all_stock_history(start_date="2014-01-01", workers=data_loader.DEFAULT_WORKERS)
+    # 2. 证券主数据（名称 / ST / 退市历史，回测与实盘离线使用）
+    security_master.refresh_security_master()
+    # 3. 筛选（今天的股票池 + 历史每日的时点股票池）
     selection.filter_stock_pool()
+    universe.build_universe()
     input("\n✅ 数据初始化完成！按回车键返回菜单...")
 
 def task_feature_eng():
@@ -92,6 +99,28 @@ def task_live_trade():
     
     input("✅ 扫描完成！按回车键返回菜单...")
 
+def task_daily_snapshot():
+    print("\n>>> 正在执行收盘快照更新...")
+    from src import data_loader_akshare
+    data_loader_akshare.update_from_daily_snapshot()
+    input("\n✅ 快照更新完成！按回车键返回菜单...")
+
+def task_data_archive():
+    from src import data_archive
+    print("\n>>> 数据归档")
+    action = input("导出(e) / 校验(v) / 导入(i): ").strip().lower()
+    path = input(f"归档路径 (回车默认 {data_archive.DEFAULT_ARCHIVE}): ").strip() or data_archive.DEFAULT_ARCHIVE
+    if action == 'e':
+        data_archive.export_archive(path)
+    elif action == 'v':
+        data_archive.verify_archive(path)
+    elif action == 'i':
+        force = input("本地已有数据时覆盖？(y/N): ").strip().lower() == 'y'
+        data_archive.import_archive(path, force=force)
+    else:
+        print("❌ 无效操作")
+    input("\n按回车键返回菜单...")
+
 def task_weekly_auto():
     print("\n>>> 启动周度自动化任务...")
     weekly_update.run_weekly_routine()
@@ -118,6 +147,10 @@ def main():
             task_audit()
         elif choice == '6':
             task_live_trade()
+        elif choice == '7':
+            task_daily_snapshot()
+        elif choice == '8':
+            task_data_archive()
         elif choice == '9':
             task_weekly_auto()
         elif choice == '0':
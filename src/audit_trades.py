@@ -2,8 +2,18 @@ import pandas as pd
 import numpy as np
 import xgboost as xgb
 import os
+import sys
 import joblib
 
+# --- 引入原始数据存储层 & 交易日历 ---
+try:
+    from src import raw_store
+    from src import trade_calendar
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import trade_calendar
+
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
@@ -30,6 +40,9 @@ def audit_backtest_trades():
     # 验证集 (最后 10%)
     split_index = int(len(df) * 0.90)
     test_df = df.iloc[split_index:].copy()
+    # 只保留调仓日（每周最后一个交易日），推理量减少约 4/5
+    rebalance_dates = trade_calendar.rebalance_dates(test_df['date'].min(), test_df['date'].max())
+    test_df = test_df[test_df['date'].isin(rebalance_dates)].copy()
     
     # 2. 推理
     print("正在加载模型进行推理...")
@@ -41,8 +54,7 @@ def audit_backtest_trades():
     test_df['pred_proba'] = model.predict_proba(X_test)[:, 1]
     
     # 3. 模拟选股并打印
-    all_dates = sorted(test_df['date'].unique())
-    rebalance_dates = all_dates[::5]
+    rebalance_dates = sorted(test_df['date'].unique())
     
     print(f"\n{'日期':<12} | {'代码':<10} | {'预测概率':<8} | {'收盘价':<8} | {'备注'}")
     print("-" * 75)
@@ -61,20 +73,16 @@ def audit_backtest_trades():
             close_price = row['close']
             prob = row['pred_proba']
             
-            # --- ✅ 修复核心：从原始 CSV 获取开盘价 ---
+            # --- ✅ 修复核心：从原始数据获取开盘价 ---
             limit_tag = ""
-            raw_file_path = os.path.join(RAW_DATA_DIR, f"{code}.csv")
             
             try:
-                # 为了不报错，我们去读原始文件查这一天的 Open
+                # 为了不报错，我们去读原始数据查这一天的 Open
                 # 这种方式比重跑 feature_eng 要快得多
-                if os.path.exists(raw_file_path):
-                    # 只读取需要的列，加速
-                    raw_df = pd.read_csv(raw_file_path, usecols=['date', 'open', 'high', 'close'])
-                    raw_df['date'] = pd.to_datetime(raw_df['date'])
-                    
-                    # 找到当天的记录
-                    day_record = raw_df[raw_df['date'] == date]
+                if raw_store.has_code(code):
+                    # 只读取需要的列与当天区间（parquet 后端只打开当年分区）
+                    day_record = raw_store.read_bars(code, columns=['date', 'open', 'high', 'close'],
+                                                     start=date, end=date)
                     
                     if not day_record.empty:
                         open_p = day_record.iloc[0]['open']
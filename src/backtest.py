@@ -5,8 +5,18 @@ import os
 import joblib
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import baostock as bs
-import datetime
+import sys
+
+# --- 引入交易日历 & 证券主数据 & 面板 ---
+try:
+    from src import trade_calendar
+    from src import security_master
+    from src import panel
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import trade_calendar
+    from src import security_master
+    from src import panel
 
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,29 +24,11 @@ PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
 MODELS_DIR = os.path.join(PROJECT_ROOT, 'models')
 PLOTS_DIR = os.path.join(PROJECT_ROOT, 'plots')
+PRICE_LOOKBACK_DAYS = 370  # 回测区间前多读的日历天数，首个调仓日也能找到上一根 K 线（含长期停牌）
 
 # ==========================================
-# 0. 辅助函数：获取名称 & 验证逻辑
+# 0. 辅助函数：验证逻辑
 # ==========================================
-def get_stock_names_map():
-    """联网获取最新股票名称表，用于剔除 ST"""
-    print("正在联网获取股票名称表 (Baostock)...")
-    bs.login()
-    name_map = {}
-    # 尝试查询最近 5 天，找到有数据的一天
-    for i in range(5):
-        date_chk = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime("%Y-%m-%d")
-        rs = bs.query_all_stock(day=date_chk)
-        data_list = []
-        while rs.error_code == '0' and rs.next():
-            data_list.append(rs.get_row_data())
-        if data_list:
-            df = pd.DataFrame(data_list, columns=rs.fields)
-            name_map = dict(zip(df['code'], df['code_name']))
-            break
-    bs.logout()
-    return name_map
-
 def is_valid_candidate_backtest(row, stock_name=""):
     """
     回测专用过滤器：必须返回 True 才能买
@@ -80,27 +72,41 @@ def run_backtest():
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').reset_index(drop=True)
     
-    # 2. 补充计算 pctChg (用于过滤涨跌停)
-    print("正在重算历史涨跌幅 (用于风控)...")
-    df['prev_close'] = df.groupby('code')['close'].shift(1)
-    df['pctChg'] = (df['close'] / df['prev_close'] - 1) * 100
-    df['pctChg'] = df['pctChg'].fillna(0) 
-
-    # 3. 划分验证集 (最后 10%)
+    # 2. 划分验证集 (最后 10%)
     split_index = int(len(df) * 0.90)
     test_df = df.iloc[split_index:].copy()
     
     print(f"回测区间: {test_df['date'].min().date()} 到 {test_df['date'].max().date()}")
 
-    # 4. 获取名称表 (用于过滤 ST)
-    name_map = get_stock_names_map()
+    # 3. 收盘价面板（日期 × 代码）：从 raw_store 读完整日线，不用数据集里的 close。
+    #    数据集只保留当日在股票池内的行，拿它取上一根 / 下一调仓日的收盘价，会漏掉刚入池当天的涨跌停、
+    #    丢掉一周内出池或停牌的持仓（前视 + 幸存者偏差）；股票池只用来圈定调仓日的候选
+    print("正在读取候选股票的完整日线 (涨跌幅风控 + 持仓收益)...")
+    close_panel = panel.load_panel(test_df['code'].unique(), fields=['close'],
+                                   start=test_df['date'].min() - pd.Timedelta(days=PRICE_LOOKBACK_DAYS),
+                                   dtype=np.float64)
+    if close_panel is None:
+        print("错误：本地没有行情数据！")
+        return
 
-    # 5. 预计算真实收益 (T+5)
+    # 4. 预计算真实收益：调仓日 = 每周最后一个交易日，持有到下一调仓日收盘（当天停牌 / 已退市取此前最后收盘价）
     print("正在计算每周持仓收益...")
-    test_df['close_t5'] = test_df.groupby('code')['close'].shift(-5)
-    test_df['real_weekly_return'] = test_df['close_t5'] / test_df['close'] - 1.0
+    rebalance_dates = trade_calendar.rebalance_dates(test_df['date'].min(), test_df['date'].max())
+    test_df = test_df[test_df['date'].isin(rebalance_dates)].copy()
+    test_df['next_date'] = test_df['date'].map(trade_calendar.next_rebalance_map(rebalance_dates))
+    test_df['close_now'] = close_panel.lookup(close_panel['close'], test_df['code'], test_df['date'])
+    test_df['prev_close'] = close_panel.lookup(close_panel.shift('close', 1), test_df['code'], test_df['date'])
+    test_df['pctChg'] = (test_df['close_now'] / test_df['prev_close'] - 1) * 100
+    test_df['pctChg'] = test_df['pctChg'].fillna(0)
+    test_df['close_next'] = close_panel.lookup(close_panel.ffill('close'), test_df['code'], test_df['next_date'])
+    test_df['real_weekly_return'] = test_df['close_next'] / test_df['close_now'] - 1.0
     test_df = test_df.dropna(subset=['real_weekly_return'])
 
+    # 5. 时点名称 (用于过滤 ST)：取每个调仓日当时的名称，纯本地查询
+    if security_master.load_master()['history'].empty:
+        print("⚠️ 警告：本地没有证券主数据，ST 过滤失效！请先运行 security_master 刷新。")
+    test_df['stock_name'] = security_master.lookup_flags(test_df['code'], test_df['date'])['name'].values
+
     # 6. 模型推理
     print("正在执行模型推理...")
     model = xgb.XGBClassifier()
@@ -113,8 +119,7 @@ def run_backtest():
     # ==========================================
     # 7. 激进轮动循环
     # ==========================================
-    all_dates = sorted(test_df['date'].unique())
-    rebalance_dates = all_dates[::5] # 每周调仓
+    rebalance_dates = sorted(test_df['date'].unique()) # 每周调仓（交易日历）
     
     strategy_capital = 1.0
     benchmark_capital = 1.0
@@ -144,8 +149,7 @@ def run_backtest():
             if len(picks_list) >= 3:
                 break # 凑够了，收工
             
-            code = row['code']
-            name = name_map.get(code, "") # 查名字
+            name = row['stock_name'] # 当时的名称
             
             # ⚠️ 关键点：这里必须通过检查才能入选
             if is_valid_candidate_backtest(row, name):
@@ -0,0 +1,397 @@
+# src/bs_replay.py
+"""
+离线 baostock 替身：录制 / 回放 + 故障注入，用于在无网络机器上压测 data_loader。
+
+- ReplayBaostock：按录制的 fixtures 提供 bs.login / logout / query_all_stock /
+  query_history_k_data_plus 接口（历史行按请求区间切片返回，自适应切片、断点续传都能走到），
+  可配置请求延迟、rs.next() 中途断线、错误码注入；
+- RecordingBaostock：包装真实 baostock 模块，透传请求的同时把结果写入 fixtures；
+- benchmark_loader：在临时目录里用替身跑 download_all_stock_history，
+  对比不同 worker 数 / 故障率下 _with_retry、_fetch_history、进程池路径的吞吐。
+
+fixtures 目录结构：
+    stock_list/{day}.json             query_all_stock 结果
+    history/{code}_{adjustflag}.json  全部已录制的日线行（按日期合并去重）
+    factors/{code}.json               query_adjust_factor 结果（按除权日合并去重，回放按区间切片）
+    misc/{method}_{hash}.json         其他 query_* 接口，按参数精确匹配
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import shutil
+import tempfile
+import contextlib
+import pandas as pd
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+FIXTURE_DIR = os.path.join(PROJECT_ROOT, 'data', 'bs_fixtures')
+
+FACTOR_FIELDS = ['code', 'dividOperateDate', 'foreAdjustFactor', 'backAdjustFactor', 'adjustFactor']
+
+
+# ==========================================
+# 1. 结果集 / 登录结果替身
+# ==========================================
+class ReplayResultSet:
+    """模仿 baostock ResultData：error_code / error_msg / fields / next() / get_row_data()。"""
+
+    def __init__(self, rows, fields, error_code='0', error_msg='success', disconnect_at=None):
+        self.data = rows
+        self.fields = list(fields)
+        self.error_code = error_code
+        self.error_msg = error_msg
+        self._disconnect_at = disconnect_at
+        self._cursor = -1
+
+    def next(self):
+        self._cursor += 1
+        if self._disconnect_at is not None and self._cursor == self._disconnect_at:
+            raise ConnectionResetError("[WinError 10054] Connection reset by peer (injected)")
+        return self._cursor < len(self.data)
+
+    def get_row_data(self):
+        return list(self.data[self._cursor])
+
+
+class _LoginResult:
+    def __init__(self, error_code='0', error_msg='success'):
+        self.error_code = error_code
+        self.error_msg = error_msg
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_json(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _misc_key(method, kwargs):
+    raw = json.dumps([method, sorted(kwargs.items())], ensure_ascii=False, default=str)
+    return f"{method}_{hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]}"
+
+
+# ==========================================
+# 2. 回放替身
+# ==========================================
+class ReplayBaostock:
+    """
+    :param latency: 每次查询的固定延迟（秒）；latency_jitter 为额外均匀抖动上限
+    :param disconnect_rate: 每次查询在 rs.next() 中途断线的概率（断点随机）
+    :param error_rate: 每次查询直接返回错误码的概率
+    :param throttle_rate: 每次查询抛出“请稍后再试”异常的概率（触发重登录 + 限流降速）
+    """
+
+    def __init__(self, fixture_dir=FIXTURE_DIR, latency=0.0, latency_jitter=0.0,
+                 disconnect_rate=0.0, error_rate=0.0, throttle_rate=0.0,
+                 error_code='10002007', seed=None):
+        self.fixture_dir = fixture_dir
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.disconnect_rate = disconnect_rate
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.error_code = error_code
+        self._rng = random.Random(seed)
+        self._history_cache = {}
+        self.calls = {}
+
+    # --- 会话 ---
+    def login(self, *args, **kwargs):
+        self._count('login')
+        return _LoginResult()
+
+    def logout(self, *args, **kwargs):
+        self._count('logout')
+        return _LoginResult()
+
+    # --- 查询 ---
+    def query_all_stock(self, day=None):
+        self._count('query_all_stock')
+        fault = self._inject()
+        if fault is not None:
+            return fault
+        list_dir = os.path.join(self.fixture_dir, 'stock_list')
+        days = sorted(fn[:-5] for fn in os.listdir(list_dir)) if os.path.isdir(list_dir) else []
+        # 取不晚于 day 的最近一份录制；day 早于全部录制时返回空结果（与非交易日一致）
+        usable = [d for d in days if day is None or d <= day]
+        if not usable:
+            return ReplayResultSet([], ['code', 'tradeStatus', 'code_name'])
+        obj = _read_json(os.path.join(list_dir, f"{usable[-1]}.json"))
+        return ReplayResultSet(obj['rows'], obj['fields'], disconnect_at=self._disconnect_point(len(obj['rows'])))
+
+    def query_history_k_data_plus(self, code, fields, start_date=None, end_date=None,
+                                  frequency='d', adjustflag='3'):
+        self._count('query_history_k_data_plus')
+        fault = self._inject()
+        if fault is not None:
+            return fault
+        req_fields = [f.strip() for f in fields.split(',')]
+        stored = self._load_history(code, adjustflag)
+        if stored is None:
+            return ReplayResultSet([], req_fields)
+        stored_fields, rows = stored
+        idx = [stored_fields.index(f) for f in req_fields]
+        d_idx = stored_fields.index('date')
+        lo, hi = start_date or '0000-00-00', end_date or '9999-99-99'
+        out = [[r[i] for i in idx] for r in rows if lo <= r[d_idx] <= hi]
+        return ReplayResultSet(out, req_fields, disconnect_at=self._disconnect_point(len(out)))
+
+    def query_adjust_factor(self, code, start_date=None, end_date=None):
+        self._count('query_adjust_factor')
+        fault = self._inject()
+        if fault is not None:
+            return fault
+        path = os.path.join(self.fixture_dir, 'factors', f"{code}.json")
+        if not os.path.exists(path):
+            return ReplayResultSet([], FACTOR_FIELDS)
+        obj = _read_json(path)
+        d_idx = obj['fields'].index('dividOperateDate')
+        lo, hi = start_date or '0000-00-00', end_date or '9999-99-99'
+        return ReplayResultSet([r for r in obj['rows'] if lo <= r[d_idx] <= hi], obj['fields'])
+
+    def __getattr__(self, name):
+        # 其他 query_* 接口：按参数精确匹配录制结果
+        if not name.startswith('query_'):
+            raise AttributeError(name)
+
+        def _query(**kwargs):
+            self._count(name)
+            fault = self._inject()
+            if fault is not None:
+                return fault
+            path = os.path.join(self.fixture_dir, 'misc', _misc_key(name, kwargs) + '.json')
+            if not os.path.exists(path):
+                return ReplayResultSet([], [], error_code='10004011', error_msg='no fixture recorded')
+            obj = _read_json(path)
+            return ReplayResultSet(obj['rows'], obj['fields'])
+        return _query
+
+    # --- 内部 ---
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _load_history(self, code, adjustflag):
+        key = (code, str(adjustflag))
+        if key not in self._history_cache:
+            path = os.path.join(self.fixture_dir, 'history', f"{code}_{adjustflag}.json")
+            if not os.path.exists(path):
+                self._history_cache[key] = None
+            else:
+                obj = _read_json(path)
+                self._history_cache[key] = (obj['fields'], obj['rows'])
+        return self._history_cache[key]
+
+    def _inject(self):
+        delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.throttle_rate and self._rng.random() < self.throttle_rate:
+            raise RuntimeError("接收数据异常，请稍后再试 (injected)")
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return ReplayResultSet([], [], error_code=self.error_code, error_msg='网络接收错误 (injected)')
+        return None
+
+    def _disconnect_point(self, n_rows):
+        if n_rows and self.disconnect_rate and self._rng.random() < self.disconnect_rate:
+            return self._rng.randrange(n_rows)
+        return None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_history_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+# ==========================================
+# 3. 录制包装
+# ==========================================
+class RecordingBaostock:
+    """包装真实 baostock：请求照常发出，结果完整读出后落盘，再以回放结果集返回给调用方。"""
+
+    def __init__(self, real_bs, fixture_dir=FIXTURE_DIR):
+        self._bs = real_bs
+        self.fixture_dir = fixture_dir
+
+    def login(self, *args, **kwargs):
+        return self._bs.login(*args, **kwargs)
+
+    def logout(self, *args, **kwargs):
+        return self._bs.logout(*args, **kwargs)
+
+    def query_all_stock(self, day=None):
+        rs = self._bs.query_all_stock(day=day)
+        rows = self._drain(rs)
+        if rows:
+            _write_json({'fields': rs.fields, 'rows': rows},
+                        os.path.join(self.fixture_dir, 'stock_list', f"{day}.json"))
+        return ReplayResultSet(rows, rs.fields, rs.error_code, rs.error_msg)
+
+    def query_history_k_data_plus(self, code, fields, start_date=None, end_date=None,
+                                  frequency='d', adjustflag='3'):
+        rs = self._bs.query_history_k_data_plus(code, fields, start_date=start_date, end_date=end_date,
+                                                frequency=frequency, adjustflag=adjustflag)
+        rows = self._drain(rs)
+        if rows:
+            self._merge_history(code, adjustflag, rs.fields, rows)
+        return ReplayResultSet(rows, rs.fields, rs.error_code, rs.error_msg)
+
+    def query_adjust_factor(self, code, start_date=None, end_date=None):
+        rs = self._bs.query_adjust_factor(code=code, start_date=start_date, end_date=end_date)
+        rows = self._drain(rs)
+        if rs.error_code == '0':
+            self._merge_rows(os.path.join(self.fixture_dir, 'factors', f"{code}.json"),
+                             rs.fields, rows, 'dividOperateDate')
+        return ReplayResultSet(rows, rs.fields, rs.error_code, rs.error_msg)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not name.startswith('query_'):
+            return getattr(self._bs, name)
+
+        def _query(**kwargs):
+            rs = getattr(self._bs, name)(**kwargs)
+            rows = self._drain(rs)
+            if rs.error_code == '0':
+                _write_json({'fields': rs.fields, 'rows': rows},
+                            os.path.join(self.fixture_dir, 'misc', _misc_key(name, kwargs) + '.json'))
+            return ReplayResultSet(rows, rs.fields, rs.error_code, rs.error_msg)
+        return _query
+
+    @staticmethod
+    def _drain(rs):
+        rows = []
+        while rs.error_code == '0' and rs.next():
+            rows.append(rs.get_row_data())
+        return rows
+
+    def _merge_history(self, code, adjustflag, fields, rows):
+        path = os.path.join(self.fixture_dir, 'history', f"{code}_{adjustflag}.json")
+        self._merge_rows(path, fields, rows, 'date')
+
+    @staticmethod
+    def _merge_rows(path, fields, rows, date_field):
+        fields = list(fields)
+        merged = {}
+        if os.path.exists(path):
+            old = _read_json(path)
+            # 字段集合不同则以本次为准（避免列错位）
+            if old['fields'] == fields:
+                merged = {r[fields.index(date_field)]: r for r in old['rows']}
+        d_idx = fields.index(date_field)
+        for r in rows:
+            merged[r[d_idx]] = r
+        _write_json({'fields': fields, 'rows': [merged[k] for k in sorted(merged)]}, path)
+
+
+# ==========================================
+# 4. 安装 / 录制 / 基准测试
+# ==========================================
+def _loader():
+    try:
+        from src import data_loader
+    except ImportError:
+        sys.path.append(PROJECT_ROOT)
+        from src import data_loader
+    return data_loader
+
+
+@contextlib.contextmanager
+def use_api(api):
+    """临时把 data_loader 使用的 bs 替换为替身（进程池 worker 经 initargs 同步替换）。"""
+    data_loader = _loader()
+    saved = data_loader.bs
+    data_loader.bs = api
+    try:
+        yield api
+    finally:
+        data_loader.bs = saved
+
+
+def record_fixtures(codes, start_date="2014-01-01", end_date=None, fixture_dir=FIXTURE_DIR):
+    """联网录制：对指定代码跑一遍 _fetch_history 与复权因子查询，并录制当日股票列表。"""
+    import baostock as real_bs
+    data_loader = _loader()
+    end_date = end_date or pd.Timestamp.now().strftime('%Y-%m-%d')
+    recorder = RecordingBaostock(real_bs, fixture_dir)
+    with use_api(recorder):
+        recorder.login()
+        try:
+            day = data_loader.trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
+            recorder.query_all_stock(day=day)
+            for code in codes:
+                df = data_loader._fetch_history(code, start_date, end_date)
+                factors = data_loader._fetch_adjust_factors(code, end_date)
+                print(f"录制 {code}: {len(df)} 行，除权记录 {len(factors)} 条")
+        finally:
+            recorder.logout()
+    print(f"✅ fixtures 已保存至: {fixture_dir}")
+
+
+def benchmark_loader(codes=None, workers_list=(1, 2, 4), fixture_dir=FIXTURE_DIR,
+                     start_date="2014-01-01", repeat=1, **fault_kwargs):
+    """
+    离线吞吐基准：每轮在全新的临时 raw 目录里用 ReplayBaostock 做全量下载。
+    fault_kwargs 透传给 ReplayBaostock（latency / disconnect_rate / error_rate / throttle_rate / seed）。
+    """
+    data_loader = _loader()
+    raw_store = data_loader.raw_store
+    if codes is None:
+        hist_dir = os.path.join(fixture_dir, 'history')
+        codes = sorted({fn.rsplit('_', 1)[0] for fn in os.listdir(hist_dir)}) if os.path.isdir(hist_dir) else []
+    if not codes:
+        print("❌ 没有可用的 fixtures，请先 record_fixtures()。")
+        return None
+
+    saved_config = raw_store.get_config()
+    results = []
+    try:
+        for workers in workers_list:
+            for r in range(repeat):
+                tmp_root = tempfile.mkdtemp(prefix="bs_replay_")
+                raw_store.apply_config({'RAW_DATA_DIR': os.path.join(tmp_root, 'raw'),
+                                        'PARQUET_DIR': os.path.join(tmp_root, 'raw_parquet'),
+                                        'BACKEND': saved_config['BACKEND']})
+                api = ReplayBaostock(fixture_dir, **fault_kwargs)
+                try:
+                    with use_api(api):
+                        # 离线基准只压 baostock 路径，不对冲到联网的 akshare
+                        summary = data_loader.download_all_stock_history(
+                            start_date=start_date, codes=codes, workers=workers, hedge=False)
+                finally:
+                    shutil.rmtree(tmp_root, ignore_errors=True)
+                if summary:
+                    summary.update(workers=workers, round=r + 1,
+                                   codes_per_sec=summary['codes'] / max(summary['elapsed'], 1e-9),
+                                   queries_per_code=summary['queries'] / max(summary['codes'], 1))
+                    results.append(summary)
+    finally:
+        raw_store.apply_config(saved_config)
+
+    df = pd.DataFrame(results)
+    if not df.empty:
+        print("\n" + "=" * 60)
+        print(f"📊 离线下载基准 ({len(codes)} 只, 故障参数={fault_kwargs or '无'})")
+        print("=" * 60)
+        print(df[['workers', 'round', 'updated', 'failed', 'queries_per_code',
+                  'elapsed', 'codes_per_sec']].to_string(index=False))
+    return df
+
+
+if __name__ == "__main__":
+    benchmark_loader(workers_list=(1, 2, 4), latency=0.05, disconnect_rate=0.05, seed=42)
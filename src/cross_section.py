@@ -0,0 +1,127 @@
+# src/cross_section.py
+"""
+截面标准化：按日期对选定特征做截面名次 / 缩尾 / z-score，让模型看到“当天在全市场的相对位置”，
+不必自己学不同行情阶段的整体水平漂移。
+
+- 输出列：{特征}_cs_rank（截面百分位名次，并列取平均，同 groupby.rank(pct=True)）、
+  {特征}_cs_win（按当日 WINSOR_LIMITS 分位数缩尾，分位数线性插值，同 quantile）、
+  {特征}_cs_z（缩尾后的 z-score，ddof=1；截面内不足两个有效值或取值全相同为 NaN）；
+- 每个特征先按取值排序、再按日期段号稳定排序（段号为 uint16 时 numpy 走基数排序）得到段内有序值，
+  名次 / 分位数 / 均值方差都是按段的 bincount / 下标运算，不对每个日期跑 Python（不用 groupby('date').transform）；
+- 训练集在 feature_eng 写出前对时点股票池内的样本做一遍；实盘 trader 对当日快照整体做一遍（by=None），
+  模型用到哪些截面列由特征名后缀解析（parse_columns）。
+"""
+import numpy as np
+import pandas as pd
+
+SUFFIXES = {'rank': '_cs_rank', 'winsor': '_cs_win', 'zscore': '_cs_z'}
+METHODS = tuple(SUFFIXES)
+WINSOR_LIMITS = (0.01, 0.99)
+
+
+# ==========================================
+# 1. 列名
+# ==========================================
+def output_columns(features, methods=METHODS) -> list:
+    return [f + SUFFIXES[m] for f in features for m in methods]
+
+
+def parse_columns(columns) -> tuple:
+    """从特征名里找出截面列，返回 (原始特征列表, 方法列表)；没有截面列返回 ([], [])。"""
+    features, methods = [], []
+    for col in columns:
+        for method, suffix in SUFFIXES.items():
+            if col.endswith(suffix):
+                base = col[:-len(suffix)]
+                if base not in features:
+                    features.append(base)
+                if method not in methods:
+                    methods.append(method)
+    return features, [m for m in METHODS if m in methods]
+
+
+# ==========================================
+# 2. 分段计算
+# ==========================================
+def _segment_ids(df: pd.DataFrame, by):
+    """(每行的段号, 段数)；by=None 时整表为一段（实盘快照）。"""
+    if by is None:
+        return np.zeros(len(df), dtype=np.int64), 1
+    seg, uniques = pd.factorize(df[by], sort=True)
+    return seg.astype(np.int64), len(uniques)
+
+
+def _sorted_quantile(s: np.ndarray, start: np.ndarray, count: np.ndarray, q: float) -> np.ndarray:
+    """各段有序有效值 s[start : start+count] 的 q 分位数（线性插值）；空段为 NaN。"""
+    pos = q * np.maximum(count - 1, 0)
+    lo, frac = np.floor(pos).astype(np.int64), pos - np.floor(pos)
+    hi = np.minimum(lo + 1, np.maximum(count - 1, 0))
+    ok = count > 0
+    base = np.where(ok, start, 0)
+    out = s[base + lo] + (s[base + hi] - s[base + lo]) * frac if len(s) else np.zeros(len(count))
+    return np.where(ok, out, np.nan)
+
+
+def _one_feature(x: np.ndarray, seg: np.ndarray, n_seg: int, methods, limits) -> dict:
+    valid = ~np.isnan(x)
+    count = np.bincount(seg, weights=valid, minlength=n_seg).astype(np.int64)
+    size = np.bincount(seg, minlength=n_seg)
+    start = np.concatenate([[0], np.cumsum(size)[:-1]])
+
+    # 段内按取值升序、NaN 排在段尾：先按值排，再按段号稳定排序（比 lexsort 快数倍）
+    by_value = np.argsort(x)
+    seg_key = seg.astype(np.uint16) if n_seg <= np.iinfo(np.uint16).max else seg
+    order = by_value[np.argsort(seg_key[by_value], kind='stable')]
+    s, s_seg = x[order], seg[order]
+    out = {}
+
+    if 'rank' in methods:
+        pos = np.arange(len(x)) - start[s_seg]
+        new = np.ones(len(x), dtype=bool)
+        new[1:] = (s[1:] != s[:-1]) | (s_seg[1:] != s_seg[:-1])
+        gid = np.cumsum(new) - 1
+        first = pos[new]
+        last = pos[np.r_[new[1:], True]]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ranked = ((first[gid] + last[gid]) / 2 + 1) / count[s_seg]
+        rank = np.empty(len(x))
+        rank[order] = ranked
+        rank[~valid] = np.nan
+        out['rank'] = rank
+
+    if 'winsor' in methods or 'zscore' in methods:
+        q_lo = _sorted_quantile(s, start, count, limits[0])
+        q_hi = _sorted_quantile(s, start, count, limits[1])
+        win = np.clip(x, q_lo[seg], q_hi[seg])
+        if 'winsor' in methods:
+            out['winsor'] = win
+        if 'zscore' in methods:
+            w0 = np.where(valid, win, 0.0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.bincount(seg, weights=w0, minlength=n_seg) / count
+                dev = np.where(valid, win - mean[seg], 0.0)
+                std = np.sqrt(np.bincount(seg, weights=dev * dev, minlength=n_seg) / (count - 1))
+                std[(count < 2) | (std == 0)] = np.nan
+                out['zscore'] = (win - mean[seg]) / std[seg]
+    return out
+
+
+def transform(df: pd.DataFrame, features, methods=METHODS, by='date', limits=WINSOR_LIMITS,
+              dtype=np.float32) -> pd.DataFrame:
+    """
+    在 df 上添加 features × methods 的截面列（原地添加并返回 df）；by 为分段列，None 表示整表一个截面。
+    行序不变，特征缺失的行结果为 NaN。
+    """
+    features = list(features)
+    methods = [m for m in METHODS if m in methods]
+    if not features or not methods or df.empty:
+        return df
+    seg, n_seg = _segment_ids(df, by)
+    new_cols = {}
+    for feat in features:
+        x = pd.to_numeric(df[feat], errors='coerce').to_numpy(dtype=float)
+        for method, values in _one_feature(x, seg, n_seg, methods, limits).items():
+            new_cols[feat + SUFFIXES[method]] = values.astype(dtype)
+    for col, values in new_cols.items():
+        df[col] = values
+    return df
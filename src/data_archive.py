@@ -0,0 +1,366 @@
+# src/data_archive.py
+"""
+数据归档：把原始行情库 + 基准指数 + 处理后数据集打包成一个带校验的归档文件，新机器冷启动直接导入，
+无需再跑一整天限流的 download_all_stock_history。
+
+归档格式（外层为不压缩的 tar）：
+    MANIFEST.json          格式版本、每个分片与每个文件的 sha256 / 大小
+    shard-000.tar.gz ...   按文件大小均衡切分的 gzip 分片，导出 / 导入时各分片并行压缩 / 解压
+
+可复现：文件按路径排序、分片切分确定、tar 头的 mtime/uid/gid/权限统一、gzip 头不写时间戳，
+同一份数据两次导出得到逐字节相同的归档。
+导入：先校验分片 sha256，再并行解压到临时目录并逐文件校验，全部通过后才整体替换到 data/ 下。
+
+用法：
+    python src/data_archive.py export data/archive/quant_data.tar
+    python src/data_archive.py verify data/archive/quant_data.tar
+    python src/data_archive.py import data/archive/quant_data.tar [--force]
+"""
+import os
+import io
+import sys
+import json
+import gzip
+import shutil
+import tarfile
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+try:
+    from src import raw_store
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+DEFAULT_ARCHIVE = os.path.join(ARCHIVE_DIR, 'quant_data.tar')
+
+# 除原始行情库外随归档一起带走的目录（相对 data/）：处理后数据集、交易日历、证券主数据、基本面截面
+EXTRA_DIRS = ['processed', 'calendar', 'security_master', 'raw_fundamental']
+BENCHMARK_PATTERN = 'benchmark_'          # data/raw 下的基准指数文件前缀
+EXCLUDE_SUFFIXES = ('.tmp', '.lock')
+# 不进归档的子目录（相对 data/）：特征缓存 / 分片按本地原始文件 mtime 寻址，换机器解压后全部失效，只会撑大归档
+EXCLUDE_DIRS = ['processed/feature_cache', 'processed/feature_shards']
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'MANIFEST.json'
+DEFAULT_SHARDS = 16
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+COMPRESS_LEVEL = 6
+READ_BLOCK = 1 << 20
+
+
+# ==========================================
+# 1. 工具
+# ==========================================
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(path, PROJECT_ROOT).replace(os.sep, '/')
+
+
+def _walk(root: str) -> list:
+    out = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in sorted(filenames):
+            if not fn.endswith(EXCLUDE_SUFFIXES):
+                out.append(os.path.join(dirpath, fn))
+    return out
+
+
+def _collect_files() -> tuple:
+    """返回 (归档根目录列表, 文件绝对路径列表)。根目录即导入时整体替换的单位。"""
+    roots, files = [], []
+    store_root = raw_store.PARQUET_DIR if raw_store.active_backend() == "parquet" else raw_store.RAW_DATA_DIR
+    if os.path.isdir(store_root):
+        roots.append(store_root)
+        files += _walk(store_root)
+    # parquet 后端时 data/raw 只带基准指数（旧 CSV 是迁移备份，不进归档）
+    if store_root != raw_store.RAW_DATA_DIR and os.path.isdir(raw_store.RAW_DATA_DIR):
+        bench = [os.path.join(raw_store.RAW_DATA_DIR, fn) for fn in sorted(os.listdir(raw_store.RAW_DATA_DIR))
+                 if fn.startswith(BENCHMARK_PATTERN) and fn.endswith('.csv')]
+        files += bench
+    skip = tuple(os.path.join(DATA_DIR, *d.split('/')) + os.sep for d in EXCLUDE_DIRS)
+    for name in EXTRA_DIRS:
+        path = os.path.join(DATA_DIR, name)
+        if os.path.isdir(path):
+            roots.append(path)
+            files += [f for f in _walk(path) if not f.startswith(skip)]
+    return roots, sorted(set(files), key=_rel)
+
+
+def _split_shards(files: list, sizes: dict, n_shards: int) -> list:
+    """按路径顺序切成大小尽量均衡的连续分片（同一只股票的分区落在同一分片里）。"""
+    total = sum(sizes.values())
+    target = max(total / max(n_shards, 1), 1)
+    shards, cur, cur_size = [], [], 0
+    for path in files:
+        cur.append(path)
+        cur_size += sizes[path]
+        if cur_size >= target and len(shards) < n_shards - 1:
+            shards.append(cur)
+            cur, cur_size = [], 0
+    if cur:
+        shards.append(cur)
+    return shards
+
+
+def _tarinfo(name: str, size: int) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = 0
+    info.mode = 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    return info
+
+
+class _SliceReader(io.RawIOBase):
+    """外层 tar 中某个成员的只读窗口，供各线程独立打开、并行解压。"""
+
+    def __init__(self, path: str, offset: int, size: int):
+        self._f = open(path, 'rb')
+        self._f.seek(offset)
+        self._left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._left)
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        b[:len(data)] = data
+        self._left -= len(data)
+        return len(data)
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+# ==========================================
+# 2. 导出
+# ==========================================
+def _build_shard(files: list, out_path: str) -> None:
+    with open(out_path, 'wb') as raw_f:
+        # filename='' + mtime=0：gzip 头不含文件名和时间戳，保证可复现
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw_f, compresslevel=COMPRESS_LEVEL, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                for path in files:
+                    with open(path, 'rb') as f:
+                        tar.addfile(_tarinfo(_rel(path), os.path.getsize(path)), f)
+
+
+def export_archive(out_path: str = DEFAULT_ARCHIVE, n_shards: int = DEFAULT_SHARDS,
+                   workers: int = DEFAULT_WORKERS) -> dict:
+    """打包当前数据为单个归档文件，返回 manifest。"""
+    roots, files = _collect_files()
+    if not files:
+        print("❌ 没有可导出的数据。")
+        return None
+    sizes = {p: os.path.getsize(p) for p in files}
+    print(f"导出 {len(files)} 个文件（{sum(sizes.values()) / 1e6:.1f} MB），分片={n_shards}，并发={workers}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        file_hashes = dict(zip(files, tqdm(pool.map(_sha256_file, files), total=len(files), desc="计算校验和")))
+
+    shards = _split_shards(files, sizes, n_shards)
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='archive_', dir=out_dir)
+    try:
+        shard_paths = [os.path.join(tmp_dir, f"shard-{i:03d}.tar.gz") for i in range(len(shards))]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(tqdm(pool.map(_build_shard, shards, shard_paths), total=len(shards), desc="压缩分片"))
+
+        manifest = {
+            'format': FORMAT_VERSION,
+            'roots': [_rel(r) for r in roots],
+            'shards': [{'name': os.path.basename(sp), 'sha256': _sha256_file(sp), 'size': os.path.getsize(sp),
+                        'files': [{'path': _rel(p), 'sha256': file_hashes[p], 'size': sizes[p]} for p in part]}
+                       for sp, part in zip(shard_paths, shards)],
+        }
+        manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True).encode('utf-8')
+
+        tmp_out = out_path + '.tmp'
+        with tarfile.open(tmp_out, mode='w', format=tarfile.PAX_FORMAT) as tar:
+            tar.addfile(_tarinfo(MANIFEST_NAME, len(manifest_bytes)), io.BytesIO(manifest_bytes))
+            for sp in shard_paths:
+                with open(sp, 'rb') as f:
+                    tar.addfile(_tarinfo(os.path.basename(sp), os.path.getsize(sp)), f)
+        os.replace(tmp_out, out_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"✅ 归档已导出: {out_path}（{os.path.getsize(out_path) / 1e6:.1f} MB，sha256={_sha256_file(out_path)[:16]}…）")
+    return manifest
+
+
+# ==========================================
+# 3. 校验 / 导入
+# ==========================================
+def _open_archive(path: str) -> tuple:
+    """读取外层 tar：返回 (manifest, {分片名: (数据偏移, 大小)})。"""
+    with tarfile.open(path, mode='r:') as tar:
+        members = {m.name: m for m in tar.getmembers()}
+        if MANIFEST_NAME not in members:
+            raise ValueError("归档缺少 MANIFEST.json")
+        manifest = json.loads(tar.extractfile(members[MANIFEST_NAME]).read().decode('utf-8'))
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"不支持的归档版本: {manifest.get('format')}")
+    # 只接受 data/ 下的相对路径，防止清单被篡改后写到项目之外
+    for rel in manifest['roots'] + [f['path'] for s in manifest['shards'] for f in s['files']]:
+        parts = rel.split('/')
+        if os.path.isabs(rel) or '..' in parts or parts[0] != 'data':
+            raise ValueError(f"归档包含非法路径: {rel}")
+    offsets = {name: (m.offset_data, m.size) for name, m in members.items() if name != MANIFEST_NAME}
+    return manifest, offsets
+
+
+def _check_shard(archive_path: str, shard: dict, offsets: dict) -> str:
+    if shard['name'] not in offsets:
+        return f"{shard['name']}: 缺失"
+    offset, size = offsets[shard['name']]
+    h = hashlib.sha256()
+    with _SliceReader(archive_path, offset, size) as r:
+        for block in iter(lambda: r.read(READ_BLOCK), b''):
+            h.update(block)
+    return None if h.hexdigest() == shard['sha256'] else f"{shard['name']}: sha256 不匹配"
+
+
+def verify_archive(archive_path: str = DEFAULT_ARCHIVE, workers: int = DEFAULT_WORKERS) -> bool:
+    """并行校验全部分片的 sha256（不解压）。"""
+    manifest, offsets = _open_archive(archive_path)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        errors = [e for e in pool.map(lambda s: _check_shard(archive_path, s, offsets), manifest['shards']) if e]
+    n_files = sum(len(s['files']) for s in manifest['shards'])
+    if errors:
+        print(f"❌ 归档校验失败（{len(errors)} 个分片）:")
+        for msg in errors[:10]:
+            print(f"   {msg}")
+        return False
+    print(f"✅ 归档校验通过：{len(manifest['shards'])} 个分片，{n_files} 个文件")
+    return True
+
+
+def _extract_shard(archive_path: str, shard: dict, offsets: dict, dest: str) -> list:
+    """解压单个分片到 dest，并逐文件校验 sha256；返回错误列表。"""
+    err = _check_shard(archive_path, shard, offsets)
+    if err:
+        return [err]
+    expected = {f['path']: f['sha256'] for f in shard['files']}
+    offset, size = offsets[shard['name']]
+    errors, seen = [], set()
+    with _SliceReader(archive_path, offset, size) as r:
+        with tarfile.open(fileobj=io.BufferedReader(r, READ_BLOCK), mode='r|gz') as tar:
+            for member in tar:
+                name = member.name
+                if name not in expected or not member.isfile():
+                    errors.append(f"{name}: 不在清单中")
+                    continue
+                target = os.path.join(dest, *name.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                h = hashlib.sha256()
+                with tar.extractfile(member) as src, open(target, 'wb') as out:
+                    for block in iter(lambda: src.read(READ_BLOCK), b''):
+                        h.update(block)
+                        out.write(block)
+                if h.hexdigest() != expected[name]:
+                    errors.append(f"{name}: sha256 不匹配")
+                seen.add(name)
+    errors += [f"{p}: 分片中缺失" for p in expected if p not in seen]
+    return errors
+
+
+def import_archive(archive_path: str = DEFAULT_ARCHIVE, force: bool = False,
+                   workers: int = DEFAULT_WORKERS) -> bool:
+    """
+    并行解压 + 逐文件校验到临时目录，全部通过后把各根目录整体替换到项目下。
+    本地已有同名目录时需 force=True（旧目录被替换）。
+    """
+    manifest, offsets = _open_archive(archive_path)
+    roots = manifest['roots']
+    loose = sorted({f['path'] for s in manifest['shards'] for f in s['files']
+                    if not any(f['path'].startswith(r + '/') for r in roots)})
+    existing = [p for p in roots + loose if os.path.exists(os.path.join(PROJECT_ROOT, p))]
+    if existing and not force:
+        print(f"❌ 本地已存在 {existing[:5]}，如需覆盖请使用 force=True / --force")
+        return False
+
+    n_files = sum(len(s['files']) for s in manifest['shards'])
+    print(f"导入 {len(manifest['shards'])} 个分片 / {n_files} 个文件（并发={workers}）...")
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.importing_', dir=DATA_DIR)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(tqdm(pool.map(lambda s: _extract_shard(archive_path, s, offsets, tmp_dir),
+                                         manifest['shards']),
+                                total=len(manifest['shards']), desc="解压校验"))
+        errors = [e for r in results for e in r]
+        if errors:
+            print(f"❌ 校验失败，未做任何替换（{len(errors)} 处）:")
+            for msg in errors[:10]:
+                print(f"   {msg}")
+            return False
+
+        # 全部校验通过后才替换：根目录整体替换，散落文件（基准指数）逐个替换
+        for rel in roots:
+            src, dst = os.path.join(tmp_dir, *rel.split('/')), os.path.join(PROJECT_ROOT, *rel.split('/'))
+            if not os.path.isdir(src):
+                os.makedirs(src, exist_ok=True)
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+        for rel in loose:
+            dst = os.path.join(PROJECT_ROOT, *rel.split('/'))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(os.path.join(tmp_dir, *rel.split('/')), dst)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # manifest 里的路径在新机器上同样有效，只需清掉进程内缓存
+    raw_store.apply_config(raw_store.get_config())
+    print(f"✅ 导入完成：{', '.join(roots + loose[:3])}{' …' if len(loose) > 3 else ''}")
+    return True
+
+
+# ==========================================
+# 4. 命令行
+# ==========================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="原始数据归档导出 / 校验 / 导入")
+    parser.add_argument('command', choices=['export', 'verify', 'import'])
+    parser.add_argument('path', nargs='?', default=DEFAULT_ARCHIVE, help="归档文件路径")
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help="导出分片数")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="并行压缩 / 解压线程数")
+    parser.add_argument('--force', action='store_true', help="导入时覆盖本地已有数据")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        ok = export_archive(args.path, n_shards=args.shards, workers=args.workers) is not None
+    elif args.command == 'verify':
+        ok = verify_archive(args.path, workers=args.workers)
+    else:
+        ok = import_archive(args.path, force=args.force, workers=args.workers)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,28 @@
 import baostock as bs
 import pandas as pd
+import numpy as np
 import os
-import datetime
+import sys
 import time
 import socket
+import types
+import multiprocessing as mp
 from typing import List, Tuple
 from tqdm import tqdm
 
+# --- 引入全局限流器 & 原始数据存储层 & 对冲拉取层 ---
+try:
+    from src.rate_limiter import get_limiter, set_limiter, make_shared_limiter, is_throttle_error
+    from src import raw_store
+    from src import trade_calendar
+    from src import hedged_fetch
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src.rate_limiter import get_limiter, set_limiter, make_shared_limiter, is_throttle_error
+    from src import raw_store
+    from src import trade_calendar
+    from src import hedged_fetch
+
 # 全局网络超时（秒）
 socket.setdefaulttimeout(20)
 
@@ -15,6 +31,22 @@ CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
 
+# --- 并发配置 ---
+# 每个 worker 进程独立持有一个 baostock 会话；服务端对单 IP 并发较敏感，设置硬上限
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 8
+
+# --- 拉取模式 ---
+# fixed：固定 30 天切片（旧逻辑）；adaptive：先整段请求，连续失败才缩小切片，成功后再放大
+FETCH_MODE = "adaptive"
+ADAPTIVE_MIN_SPAN_DAYS = 30     # 自适应切片的最小跨度
+ADAPTIVE_SHRINK_AFTER = 2       # 连续失败达到该次数才开始缩小切片
+
+HISTORY_FIELDS = "date,code,open,high,low,close,preclose,volume,amount,turn,pctChg"
+# 存储不复权价格（adjustflag=3），复权因子单独拉取；preclose 只用于识别除权除息，不落盘
+ADJUST_FLAG = "3"
+FACTOR_START_DATE = "1990-01-01"
+
 
 # --- 通用重试工具 ---
 def _sleep_backoff(attempt: int, base: float = 1.0, factor: float = 1.6, jitter: float = 0.3) -> None:
@@ -35,18 +67,27 @@ def _need_relogin(exc: Exception) -> bool:
 
 
 def _with_retry(call, max_retries: int = 5, op_name: str = ""):
+    """
+    统一重试入口：每次调用前向 baostock 限流器取令牌，成功则加性提速，
+    遇到限流/重置类错误则乘性降速（节奏由限流器统一控制，不再各处硬编码 sleep）。
+    """
+    limiter = get_limiter('baostock')
     last_exc = None
     for attempt in range(max_retries):
+        limiter.acquire()
         try:
-            return call()
+            result = call()
+            limiter.on_success()
+            return result
         except Exception as e:
             last_exc = e
+            if is_throttle_error(e):
+                limiter.on_throttle()
             if _need_relogin(e):
                 try:
                     bs.logout()
                 except Exception:
                     pass
-                _sleep_backoff(attempt)
                 lg = bs.login()
                 if getattr(lg, "error_code", "0") != '0':
                     _sleep_backoff(attempt)
@@ -57,39 +98,6 @@ def _with_retry(call, max_retries: int = 5, op_name: str = ""):
     raise last_exc if last_exc else RuntimeError(f"{op_name} failed")
 
 
-def _nearest_trading_day(max_back_days: int = 10) -> str:
-    """向后回溯找到最近可用的交易日字符串。"""
-    check_date = datetime.datetime.now()
-    for i in range(max_back_days):
-        date_str = check_date.strftime("%Y-%m-%d")
-
-        def _query():
-            return bs.query_all_stock(day=date_str)
-
-        try:
-            rs = _with_retry(_query, op_name="query_all_stock")
-        except Exception:
-            check_date -= datetime.timedelta(days=1)
-            continue
-
-        has_any = (rs.error_code == '0')
-        ok = False
-        try:
-            while has_any and rs.next():
-                if rs.get_row_data():
-                    ok = True
-                    break
-        except Exception:
-            # 本次失败则回退一天重试
-            ok = False
-
-        if ok:
-            return date_str
-        check_date -= datetime.timedelta(days=1)
-    # 兜底：今天
-    return datetime.datetime.now().strftime("%Y-%m-%d")
-
-
 def _daterange_chunks(start_date: str, end_date: str, chunk_days: int = 90) -> List[Tuple[str, str]]:
     start = pd.to_datetime(start_date)
     end = pd.to_datetime(end_date)
@@ -104,16 +112,40 @@ def _daterange_chunks(start_date: str, end_date: str, chunk_days: int = 90) -> L
     return spans
 
 
-def _fetch_history(code: str, start_date: str, end_date: str) -> pd.DataFrame:
+def _empty_history() -> pd.DataFrame:
+    return pd.DataFrame(columns=HISTORY_FIELDS.split(','))
+
+
+def _count_query(stats: dict | None) -> None:
+    """统计实际发出的 query_history_k_data_plus 次数（含 _with_retry 内部重试）。"""
+    if stats is not None:
+        stats['queries'] = stats.get('queries', 0) + 1
+
+
+def _frames_to_history(frames: list) -> pd.DataFrame:
+    if not frames:
+        return _empty_history()
+
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    if df.empty:
+        return df
+
+    # 类型转换
+    numeric_cols = ['open', 'high', 'low', 'close', 'preclose', 'volume', 'amount', 'turn', 'pctChg']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df = df.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last').sort_values('date')
+    return df
+
+
+def _fetch_history_fixed(code: str, start_date: str, end_date: str, stats: dict | None = None) -> pd.DataFrame:
     """
-    稳健拉取：将区间按90天切片；对每个切片，若在 rs.next() 中途断线，
+    稳健拉取：将区间按30天切片；对每个切片，若在 rs.next() 中途断线，
     自动以“最后成功日期+1天”为新起点继续补齐该切片剩余数据。
     """
-    if pd.to_datetime(start_date) > pd.to_datetime(end_date):
-        return pd.DataFrame(columns=[
-            'date','code','open','high','low','close','volume','amount','turn','pctChg'
-        ])
-
     segments = _daterange_chunks(start_date, end_date, chunk_days=30)
     frames = []
 
@@ -125,13 +157,14 @@ def _fetch_history(code: str, start_date: str, end_date: str) -> pd.DataFrame:
 
         while pd.to_datetime(cur_start) <= pd.to_datetime(seg_end):
             def _query():
+                _count_query(stats)
                 return bs.query_history_k_data_plus(
                     code,
-                    "date,code,open,high,low,close,volume,amount,turn,pctChg",
+                    HISTORY_FIELDS,
                     start_date=cur_start,
                     end_date=seg_end,
                     frequency="d",
-                    adjustflag="2",
+                    adjustflag=ADJUST_FLAG,
                 )
 
             try:
@@ -158,6 +191,8 @@ def _fetch_history(code: str, start_date: str, end_date: str) -> pd.DataFrame:
                     # Baostock fields 次序与 rs.fields 对齐，date 在索引 0
                     last_ok_date = row[0]
             except Exception as e:
+                if is_throttle_error(e):
+                    get_limiter('baostock').on_throttle()
                 # 迭代中途失败：从 last_ok_date+1 继续补
                 if last_ok_date:
                     cur_start = (pd.to_datetime(last_ok_date) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
@@ -177,99 +212,213 @@ def _fetch_history(code: str, start_date: str, end_date: str) -> pd.DataFrame:
             df = pd.DataFrame(seg_rows, columns=rs.fields)
             frames.append(df)
 
-        # 轻微节流，避免过快触发服务端限流
-        time.sleep(0.25)
+    return _frames_to_history(frames)
 
-    if not frames:
-        return pd.DataFrame(columns=[
-            'date','code','open','high','low','close','volume','amount','turn','pctChg'
-        ])
 
-    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
-    if df.empty:
-        return df
+def _fetch_history_adaptive(code: str, start_date: str, end_date: str, stats: dict | None = None) -> pd.DataFrame:
+    """
+    自适应拉取：先对整个区间发一次请求；rs.next() 中途断线时沿用“最后成功日期+1天”续传。
+    只有连续失败达到 ADAPTIVE_SHRINK_AFTER 次才把切片减半（不低于 ADAPTIVE_MIN_SPAN_DAYS），
+    每成功一段就把切片翻倍，直至覆盖剩余全区间。
+    """
+    start = pd.to_datetime(start_date)
+    end = pd.to_datetime(end_date)
+    full_days = (end - start).days + 1
+    span_days = full_days
+    min_span = min(ADAPTIVE_MIN_SPAN_DAYS, full_days)
+
+    cur_start = start
+    rows, fields = [], None
+    consecutive_failures = 0
+    guard_attempts = 0
+
+    def _on_failure():
+        nonlocal consecutive_failures, span_days
+        consecutive_failures += 1
+        if consecutive_failures >= ADAPTIVE_SHRINK_AFTER:
+            span_days = max(span_days // 2, min_span)
+
+    while cur_start <= end:
+        seg_end = min(cur_start + pd.Timedelta(days=span_days - 1), end)
+        q_start, q_end = cur_start.strftime('%Y-%m-%d'), seg_end.strftime('%Y-%m-%d')
+
+        def _query():
+            _count_query(stats)
+            return bs.query_history_k_data_plus(
+                code,
+                HISTORY_FIELDS,
+                start_date=q_start,
+                end_date=q_end,
+                frequency="d",
+                adjustflag=ADJUST_FLAG,
+            )
+
+        last_ok_date = None
+        try:
+            rs = _with_retry(_query, op_name="query_history_k_data_plus")
+            if getattr(rs, "error_code", "0") != '0':
+                raise RuntimeError(getattr(rs, "error_msg", "query error"))
+            fields = rs.fields
+            while rs.next():
+                row = rs.get_row_data()
+                if not row:
+                    continue
+                rows.append(row)
+                last_ok_date = row[0]
+        except Exception as e:
+            if is_throttle_error(e):
+                get_limiter('baostock').on_throttle()
+            _on_failure()
+            if last_ok_date:
+                # 断点续传：已拿到的行保留，从下一天继续
+                cur_start = pd.to_datetime(last_ok_date) + pd.Timedelta(days=1)
+                continue
+            guard_attempts += 1
+            if guard_attempts >= 6 and span_days <= min_span:
+                # 最小切片仍然反复失败：放弃该段，避免死循环（与 fixed 模式一致）
+                cur_start = seg_end + pd.Timedelta(days=1)
+                guard_attempts = 0
+                continue
+            _sleep_backoff(guard_attempts)
+            continue
+
+        # 本段完整跑完：重置失败计数并放大切片
+        consecutive_failures = 0
+        guard_attempts = 0
+        span_days = min(span_days * 2, full_days)
+        cur_start = seg_end + pd.Timedelta(days=1)
+
+    if not rows:
+        return _empty_history()
+    return _frames_to_history([pd.DataFrame(rows, columns=fields)])
+
+
+def _fetch_history(code: str, start_date: str, end_date: str, stats: dict | None = None) -> pd.DataFrame:
+    """按 FETCH_MODE 分派到固定切片或自适应切片实现。stats['queries'] 累加查询次数。"""
+    if pd.to_datetime(start_date) > pd.to_datetime(end_date):
+        return _empty_history()
+    if FETCH_MODE == "adaptive":
+        return _fetch_history_adaptive(code, start_date, end_date, stats)
+    return _fetch_history_fixed(code, start_date, end_date, stats)
+
+
+def _fetch_adjust_factors(code: str, end_date: str, stats: dict | None = None) -> pd.DataFrame:
+    """
+    全部除权除息记录 -> 因子表 (date, fore, back)；没有除权记录返回空表。
+    请求失败抛异常（调用方据此放弃本次写入，避免不复权价格配上过期因子）。
+    """
+    def _query():
+        _count_query(stats)
+        return bs.query_adjust_factor(code=code, start_date=FACTOR_START_DATE, end_date=end_date)
+
+    rs = _with_retry(_query, op_name="query_adjust_factor")
+    if getattr(rs, "error_code", "0") != '0':
+        raise RuntimeError(getattr(rs, "error_msg", "query_adjust_factor error"))
+    rows = []
+    while rs.next():
+        rows.append(rs.get_row_data())
+    if not rows:
+        return pd.DataFrame(columns=raw_store.FACTOR_COLUMNS)
+    df = pd.DataFrame(rows, columns=rs.fields).rename(columns={
+        'dividOperateDate': 'date', 'foreAdjustFactor': 'fore', 'backAdjustFactor': 'back'})
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    for col in ['fore', 'back']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.dropna(subset=['date', 'back'])[raw_store.FACTOR_COLUMNS]
 
-    # 类型转换
-    numeric_cols = ['open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg']
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-    if 'date' in df.columns:
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df = df.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last').sort_values('date')
-    return df
 
+def _strip_preclose(df: pd.DataFrame) -> pd.DataFrame:
+    return df.drop(columns=['preclose'], errors='ignore')
 
-def _atomic_write_csv(df: pd.DataFrame, file_path: str) -> None:
-    tmp_path = file_path + ".tmp"
-    df.to_csv(tmp_path, index=False)
-    os.replace(tmp_path, file_path)  # 原子替换，避免中途失败损坏文件
 
+def _fetch_history_hedged(code: str, start_date: str, end_date: str, stats: dict | None,
+                          deadline_at: float, hedge: bool) -> pd.DataFrame:
+    """baostock 拉取放到会话线程上执行，超过其 p95 延迟仍未返回则对冲 akshare，到截止时间抛 DeadlineExceeded。"""
+    return hedged_fetch.hedged_history(lambda: _fetch_history(code, start_date, end_date, stats),
+                                       code, start_date, end_date, deadline_at, hedge=hedge, stats=stats)
 
-def _update_or_download_single(code: str, start_date_default: str, end_date_str: str) -> bool:
-    file_path = os.path.join(RAW_DATA_DIR, f"{code}.csv")
+
+def _download_full(code: str, start_date_default: str, end_date_str: str, stats: dict | None,
+                   deadline_at: float, hedge: bool) -> bool:
+    """全量下载不复权日线 + 复权因子，整只覆盖写入（新股 / 旧的前复权数据一次性转为 raw 口径）。"""
+    full_df = _fetch_history_hedged(code, start_date_default, end_date_str, stats, deadline_at, hedge)
+    if full_df.empty:
+        return False
+    factors = hedged_fetch.call_baostock(lambda: _fetch_adjust_factors(code, end_date_str, stats), deadline_at)
+    raw_store.write_bars(code, _strip_preclose(full_df), factors=factors)
+    return True
+
+
+def _update_or_download_single(code: str, start_date_default: str, end_date_str: str,
+                               stats: dict | None = None, hedge: bool = hedged_fetch.ENABLE_HEDGE) -> bool:
     end_date_dt = pd.to_datetime(end_date_str)
+    # 单只股票的硬截止时间：行情与因子请求共用
+    deadline_at = time.perf_counter() + hedged_fetch.CODE_DEADLINE
 
-    if os.path.exists(file_path) and os.path.getsize(file_path) > 100:
-        try:
-            existing = pd.read_csv(file_path)
-            if 'date' not in existing.columns:
-                return False
-            existing['date'] = pd.to_datetime(existing['date'], errors='coerce')
-            last_date = existing['date'].max()
-
-            # 如果文件没有有效日期，回退全量
-            if pd.isna(last_date):
-                start_date = start_date_default
-            else:
-                # 从下一天开始补齐
-                start_date = (last_date + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
-
-            # 如果最后日期已经覆盖到结束日期，则不更新
-            if not pd.isna(last_date) and last_date >= end_date_dt:
-                return True
-
-            # 如果起始超过结束，直接返回
-            if pd.to_datetime(start_date) > end_date_dt:
-                return True
-
-            new_df = _fetch_history(code, start_date, end_date_str)
-            if new_df.empty:
-                # 可能停牌或无新数据
-                return True
-
-            merged = pd.concat([existing, new_df], ignore_index=True)
-            if 'date' in merged.columns:
-                merged['date'] = pd.to_datetime(merged['date'], errors='coerce')
-                merged = merged.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last').sort_values('date')
-            _atomic_write_csv(merged, file_path)
+    try:
+        # 新股，或旧版前复权数据（没有因子文件）：全量下载一次
+        if not raw_store.has_code(code) or raw_store.price_mode(code) != "raw":
+            return _download_full(code, start_date_default, end_date_str, stats, deadline_at, hedge)
+
+        last_date = raw_store.last_date(code)
+
+        # 如果没有有效日期，回退全量
+        if last_date is None:
+            return _download_full(code, start_date_default, end_date_str, stats, deadline_at, hedge)
+
+        # 如果最后日期已经覆盖到结束日期，则不更新
+        if last_date >= end_date_dt:
             return True
-        except Exception:
-            return False
-    else:
-        try:
-            full_df = _fetch_history(code, start_date_default, end_date_str)
-            if full_df.empty:
-                return False
-            if 'date' in full_df.columns:
-                full_df.sort_values('date', inplace=True)
-            _atomic_write_csv(full_df, file_path)
+
+        # 从下一天开始补齐
+        start_date = (last_date + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        new_df = _fetch_history_hedged(code, start_date, end_date_str, stats, deadline_at, hedge)
+        if new_df.empty:
+            # 可能停牌或无新数据
             return True
-        except Exception:
-            return False
+
+        # 昨收与本地收盘对不上：期间除权除息，只重拉因子（一次请求），历史日线不动
+        factors = None
+        if raw_store.preclose_mismatch(code, new_df):
+            factors = hedged_fetch.call_baostock(lambda: _fetch_adjust_factors(code, end_date_str, stats),
+                                                 deadline_at)
+
+        # 只追加新行（parquet 后端仅重写当年分区）
+        raw_store.append_bars(code, _strip_preclose(new_df), factors=factors)
+        return True
+    except Exception:
+        return False
+
+
+def redownload_codes(codes: list, start_date: str = "2014-01-01") -> dict:
+    """
+    整只重新全量下载并覆盖写入（不复权日线 + 因子），用于修复截断 / 复权断裂等本地无法修好的数据。
+    返回 {'updated', 'failed'}；登录失败返回 None。
+    """
+    lg = bs.login()
+    if lg.error_code != '0':
+        print(f"登陆失败: {lg.error_msg}")
+        return None
+    updated, failed = 0, 0
+    try:
+        trade_calendar.refresh_calendar(api=bs, login=False)
+        end_date_str = trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
+        for code in tqdm(codes, desc="重新下载"):
+            deadline_at = time.perf_counter() + hedged_fetch.CODE_DEADLINE
+            try:
+                ok = _download_full(code, start_date, end_date_str, None, deadline_at, hedged_fetch.ENABLE_HEDGE)
+            except Exception:
+                ok = False
+            updated += int(ok)
+            failed += int(not ok)
+    finally:
+        bs.logout()
+    return {'updated': updated, 'failed': failed}
 
 
 def _list_local_codes() -> list:
-    """从本地 raw 目录扫描已有 CSV 推断股票代码列表。"""
-    if not os.path.isdir(RAW_DATA_DIR):
-        return []
-    codes = []
-    for fn in os.listdir(RAW_DATA_DIR):
-        if fn.endswith(".csv"):
-            codes.append(os.path.splitext(fn)[0])
-    # 过滤合法的 baostock 代码格式
-    codes = [c for c in codes if c.startswith(('sh.', 'sz.', 'bj.'))]
-    return sorted(set(codes))
+    """从本地原始数据存储（csv / parquet）推断股票代码列表。"""
+    return raw_store.list_codes()
 
 
 def _list_market_codes(end_date_str: str) -> list:
@@ -300,30 +449,144 @@ def _list_market_codes(end_date_str: str) -> list:
     return target
 
 
+# --- 多进程 worker ---
+def _worker_init(limiter=None, api=None, store_config=None) -> None:
+    """
+    worker 进程初始化：安装共享限流器，并各自登录一个独立的 baostock 会话。
+    api 不为空时（如离线回放用的 bs_replay 替身）替换本进程的 bs；
+    store_config 让子进程与主进程使用同一份 raw_store 配置。
+    """
+    global bs
+    if api is not None:
+        bs = api
+    if store_config is not None:
+        raw_store.apply_config(store_config)
+    if limiter is not None:
+        set_limiter('baostock', limiter)
+    lg = bs.login()
+    if getattr(lg, "error_code", "0") != '0':
+        # 登录失败不致命，_with_retry 在遇到断线类错误时会重新登录
+        _sleep_backoff(1)
+        bs.login()
+
+
+def _worker_task(args: Tuple[str, str, str, float | None, bool]) -> Tuple[str, bool | None, dict, list]:
+    """
+    返回 (code, ok, stats, latency_samples)；ok=None 表示整轮时间预算已用完、未处理。
+    run_deadline 为 time.time() 时刻（跨进程可比）。
+    """
+    code, start_date_default, end_date_str, run_deadline, hedge = args
+    stats = {'queries': 0, 'hedged': 0, 'hedge_wins': 0}
+    if run_deadline is not None and time.time() >= run_deadline:
+        return code, None, stats, []
+    try:
+        ok = _update_or_download_single(code, start_date_default, end_date_str, stats, hedge)
+    except Exception:
+        ok = False
+    return code, ok, stats, hedged_fetch.TRACKER.take_new()
+
+
+def _new_totals() -> dict:
+    return {'updated': 0, 'failed': 0, 'skipped': 0, 'queries': 0, 'hedged': 0, 'hedge_wins': 0}
+
+
+def _accumulate(totals: dict, ok, stats: dict) -> None:
+    key = 'skipped' if ok is None else ('updated' if ok else 'failed')
+    totals[key] += 1
+    for k in ('queries', 'hedged', 'hedge_wins'):
+        totals[k] += stats.get(k, 0)
+
+
+def _iter_serial(tasks: list):
+    for task in tqdm(tasks, desc="更新进度"):
+        # 本进程内拉取，延迟样本已直接记入 hedged_fetch.TRACKER
+        code, ok, stats, _ = _worker_task(task)
+        yield code, ok, stats
+
+
+def _iter_pool(tasks: list, workers: int, start_method: str | None = None):
+    """
+    进程池模式：N 个 worker 各自登录，从共享任务队列中逐只领取代码（chunksize=1，大致按任务顺序开工），
+    单只股票的写入经 raw_store 原子替换，互不干扰；各 worker 的延迟样本回传后并入主进程统计。
+    每只完成即产出 (code, ok, stats)。start_method 为进程启动方式（None 为平台默认）。
+    """
+    ctx = mp.get_context(start_method)
+    # 所有 worker 共用一个跨进程速率预算
+    limiter = make_shared_limiter('baostock', ctx)
+    # 真实 baostock 是模块对象（不可 pickle），子进程自行 import；替身对象则随 initargs 传入
+    api = None if isinstance(bs, types.ModuleType) else bs
+    initargs = (limiter, api, raw_store.get_config())
+    with ctx.Pool(processes=workers, initializer=_worker_init, initargs=initargs) as pool:
+        for code, ok, stats, samples in tqdm(pool.imap_unordered(_worker_task, tasks, chunksize=1),
+                                             total=len(tasks), desc=f"更新进度(x{workers})"):
+            hedged_fetch.TRACKER.merge(samples)
+            yield code, ok, stats
+
+
+def _run_tasks(results, on_code_done=None) -> dict:
+    totals = _new_totals()
+    for code, ok, stats in results:
+        _accumulate(totals, ok, stats)
+        if on_code_done is not None:
+            on_code_done(code, ok)
+    return totals
+
+
+def _prioritize(codes: list) -> list:
+    """按 manifest 最近 20 日平均成交额从高到低排序（流动性好的先下载），无记录的新股排在最后。"""
+    manifest = raw_store.load_manifest()
+    if manifest.empty or 'avg_amount_20' not in manifest.columns:
+        return list(codes)
+    amount = pd.to_numeric(manifest['avg_amount_20'].reindex(codes), errors='coerce').fillna(-1.0)
+    order = np.argsort(-amount.to_numpy(dtype=float), kind='stable')
+    return [codes[i] for i in order]
+
+
 def download_all_stock_history(
     start_date: str = "2014-01-01",
     codes: list | None = None,
     prefer_local: bool = True,
-    include_new: bool = True
+    include_new: bool = True,
+    workers: int = 1,
+    time_budget: float | None = None,
+    hedge: bool = hedged_fetch.ENABLE_HEDGE,
+    on_code_done=None,
+    start_method: str | None = None,
 ):
     """
     稳健增量下载/更新：
-    - prefer_local=True：优先根据本地已有 CSV 增量更新；
+    - prefer_local=True：优先根据本地已有数据增量更新；
     - include_new=True：在本地基础上补充市场新股；
-    - codes 指定则仅更新该列表。
+    - codes 指定则仅更新该列表；
+    - workers>1：启用多进程模式（每进程独立 baostock 会话），上限 MAX_WORKERS；
+    - 每只股票硬超时 hedged_fetch.CODE_DEADLINE 秒；hedge=True 时 baostock 慢于其 p95 延迟即对冲 akshare；
+    - time_budget（秒）：整轮时间预算，用完后剩余代码不再处理（记为 skipped，下次增量补齐）；
+    - 按流动性（manifest 最近 20 日平均成交额）从高到低下载；on_code_done(code, ok) 在主进程中
+      每完成一只回调一次（ok=None 为时间预算用完未处理），供 pipeline 边下边算；
+    - start_method：进程池启动方式（None 为平台默认）；在非主线程里调用时应传 'forkserver' / 'spawn'，
+      避免带着其他线程 fork。
+    返回汇总字典 {'codes', 'updated', 'failed', 'skipped', 'queries', 'hedged', 'hedge_wins',
+    'latency', 'elapsed'}；登录失败等提前退出时返回 None。
     """
+    t0 = time.perf_counter()
+    run_deadline = time.time() + time_budget if time_budget else None
     # 目录
-    if not os.path.exists(RAW_DATA_DIR):
-        os.makedirs(RAW_DATA_DIR)
-        print(f"创建数据目录: {RAW_DATA_DIR}")
+    raw_dir = raw_store.RAW_DATA_DIR
+    if not os.path.exists(raw_dir):
+        os.makedirs(raw_dir)
+        print(f"创建数据目录: {raw_dir}")
+    store_dir = raw_store.PARQUET_DIR if raw_store.active_backend() == "parquet" else raw_dir
+    # 预先加载（必要时重建）manifest，worker 之后直接按索引取最后日期
+    raw_store.load_manifest()
 
     lg = bs.login()
     if lg.error_code != '0':
         print(f"登陆失败: {lg.error_msg}")
         return
 
-    # 使用最近交易日作为结束日期
-    end_date_str = _nearest_trading_day()
+    # 使用最近交易日作为结束日期（本地交易日历，已登录会话下顺带增量刷新一次）
+    trade_calendar.refresh_calendar(api=bs, login=False)
+    end_date_str = trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
 
     # 决定待处理代码列表
     final_codes = []
@@ -356,24 +619,173 @@ def download_all_stock_history(
         bs.logout()
         return
 
-    print(f"结束日期: {end_date_str}，开始更新/下载...")
-    updated, failed = 0, 0
-    for code in tqdm(final_codes, desc="更新进度"):
-        ok = _update_or_download_single(code, start_date, end_date_str)
-        if ok:
-            updated += 1
-        else:
-            failed += 1
+    final_codes = _prioritize(final_codes)
+    workers = max(1, min(int(workers or 1), MAX_WORKERS, len(final_codes)))
+    print(f"结束日期: {end_date_str}，开始更新/下载（并发={workers}，对冲={hedge}）...")
+    tasks = [(code, start_date, end_date_str, run_deadline, hedge) for code in final_codes]
+    if workers > 1:
+        # 主进程会话只用于列代码/找交易日，下载期间先释放
+        bs.logout()
+        totals = _run_tasks(_iter_pool(tasks, workers, start_method), on_code_done)
+    else:
+        totals = _run_tasks(_iter_serial(tasks), on_code_done)
+        bs.logout()
+    queries = totals['queries']
+    latency = hedged_fetch.TRACKER.summary()
 
-    bs.logout()
     print("\n" + "="*30)
     print("任务完成！")
-    print(f"成功写入(包含全量/增量): {updated}")
-    print(f"失败或未写入: {failed}")
-    print(f"存储位置: {RAW_DATA_DIR}")
+    print(f"成功写入(包含全量/增量): {totals['updated']}")
+    print(f"失败或未写入: {totals['failed']}")
+    if totals['skipped']:
+        print(f"时间预算用完未处理: {totals['skipped']}")
+    print(f"历史查询次数: {queries}（平均每只 {queries / max(len(final_codes), 1):.2f} 次，模式={FETCH_MODE}）")
+    print(f"对冲请求: {totals['hedged']}（akshare 胜出 {totals['hedge_wins']}）")
+    print(f"拉取延迟: {hedged_fetch.format_summary(latency)}")
+    print(f"限流器收敛速率: {get_limiter('baostock').rate:.1f} req/s")
+    print(f"存储位置: {store_dir}（{raw_store.active_backend()}）")
     print("="*30)
+    return dict(codes=len(final_codes), latency=latency, elapsed=time.perf_counter() - t0, **totals)
+
+
+# --- 基准指数（本地缓存 + 增量更新） ---
+BENCHMARK_INDICES = {'sh.000905': '中证500', 'sh.000300': '沪深300', 'sh.000852': '中证1000'}
+DEFAULT_BENCHMARK = 'sh.000905'
+BENCHMARK_FIELDS = "date,open,high,low,close,volume,amount,pctChg"
+BENCHMARK_START_DATE = "2005-01-01"   # 缓存统一从这里开始，调用方按需截取
+
+
+def benchmark_path(code: str) -> str:
+    """data/raw/benchmark_sh000905.csv（与旧文件同名，数据归档按 benchmark_ 前缀打包）。"""
+    return os.path.join(raw_store.RAW_DATA_DIR, f"benchmark_{code.replace('.', '')}.csv")
+
+
+def _read_benchmark_cache(code: str):
+    path = benchmark_path(code)
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_csv(path)
+        df['date'] = pd.to_datetime(df['date'])
+    except Exception:
+        return None
+    # 旧版只存了 date,close：视为无缓存，整段重下一次
+    if any(col not in df.columns for col in BENCHMARK_FIELDS.split(',')) or df.empty:
+        return None
+    return df.sort_values('date').reset_index(drop=True)
+
+
+def _fetch_benchmark(code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    def _query():
+        rs = bs.query_history_k_data_plus(code, BENCHMARK_FIELDS, start_date=start_date, end_date=end_date,
+                                          frequency="d")
+        if getattr(rs, "error_code", "0") != '0':
+            raise RuntimeError(getattr(rs, "error_msg", "query_history_k_data_plus error"))
+        rows = []
+        while rs.next():
+            rows.append(rs.get_row_data())
+        return rows
+
+    rows = _with_retry(_query, op_name=f"benchmark({code})")
+    df = pd.DataFrame(rows, columns=BENCHMARK_FIELDS.split(','))
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    for col in BENCHMARK_FIELDS.split(',')[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.dropna(subset=['date', 'close']).sort_values('date').reset_index(drop=True)
+
+
+def _update_benchmark(code: str, end_date_str: str) -> int:
+    """
+    单个指数增量更新（需已登录）：从缓存最后一天起拉取（含该天用于核对），
+    重叠日收盘价对不上（缓存损坏 / 口径变化）则整段重下。返回新增行数。
+    """
+    cached = _read_benchmark_cache(code)
+    if cached is not None and cached['date'].iloc[-1] >= pd.Timestamp(end_date_str):
+        return 0
+    if cached is None:
+        merged = _fetch_benchmark(code, BENCHMARK_START_DATE, end_date_str)
+        added = len(merged)
+    else:
+        last = cached['date'].iloc[-1]
+        new = _fetch_benchmark(code, last.strftime('%Y-%m-%d'), end_date_str)
+        overlap = new[new['date'] == last]
+        if not overlap.empty and not np.isclose(overlap['close'].iloc[0], cached['close'].iloc[-1], rtol=1e-6):
+            print(f"⚠️ {code} 缓存与最新数据在 {last.date()} 不一致，整段重新下载。")
+            merged = _fetch_benchmark(code, BENCHMARK_START_DATE, end_date_str)
+            added = len(merged)
+        else:
+            new = new[new['date'] > last]
+            merged = pd.concat([cached, new], ignore_index=True)
+            added = len(new)
+    if merged.empty:
+        raise ValueError(f"{code} 没有返回任何指数数据")
+    path = benchmark_path(code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    out = merged.copy()
+    out['date'] = out['date'].dt.strftime('%Y-%m-%d')
+    out.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return added
+
+
+def update_benchmarks(codes=None, login: bool = True) -> dict:
+    """
+    增量更新本地基准指数缓存（默认 BENCHMARK_INDICES 全部）；缓存已到最近交易日的不发请求，
+    全部最新时连登录都省掉。返回 {code: 新增行数}，失败的为 None。
+    """
+    codes = list(codes or BENCHMARK_INDICES)
+    end_date_str = trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
+    stale = []
+    for code in codes:
+        cached = _read_benchmark_cache(code)
+        if cached is None or cached['date'].iloc[-1] < pd.Timestamp(end_date_str):
+            stale.append(code)
+    result = {c: 0 for c in codes}
+    if not stale:
+        return result
+    if login:
+        lg = bs.login()
+        if lg.error_code != '0':
+            print(f"登陆失败: {lg.error_msg}")
+            result.update({c: None for c in stale})
+            return result
+    try:
+        if login:
+            # 本地交易日历可能落后，登录后顺带增量刷新再定结束日
+            trade_calendar.refresh_calendar(api=bs, login=False)
+            end_date_str = trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
+        for code in stale:
+            try:
+                result[code] = _update_benchmark(code, end_date_str)
+            except Exception as e:
+                print(f"⚠️ 指数 {code} 更新失败: {e}")
+                result[code] = None
+    finally:
+        if login:
+            bs.logout()
+    print("基准指数: " + " | ".join(
+        f"{BENCHMARK_INDICES.get(c, c)} +{n}" if n is not None else f"{BENCHMARK_INDICES.get(c, c)} 失败"
+        for c, n in result.items()))
+    return result
+
+
+def load_benchmark(code: str = DEFAULT_BENCHMARK, start_date: str | None = None, update: bool = True):
+    """
+    基准指数日线的统一入口（date 为 Timestamp，按日期升序）。
+    update=True 先增量更新本地缓存；联网失败时退回本地缓存。本地也没有返回 None。
+    """
+    if update:
+        update_benchmarks([code])
+    df = _read_benchmark_cache(code)
+    if df is None:
+        return None
+    if start_date:
+        df = df[df['date'] >= pd.Timestamp(start_date)].reset_index(drop=True)
+    return df
 
 
 if __name__ == "__main__":
     # 示例：仅增量更新本地已有，并自动补充新股
-    download_all_stock_history(start_date="2014-01-01", prefer_local=True, include_new=True)
\ No newline at end of file
+    download_all_stock_history(start_date="2014-01-01", prefer_local=True, include_new=True,
+                               workers=DEFAULT_WORKERS)
\ No newline at end of file
@@ -1,22 +1,46 @@
 import akshare as ak
 import pandas as pd
 import os
+import sys
 import datetime
 from tqdm import tqdm
 import re
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# --- 引入全局限流器 & 原始数据存储层 & 交易日历 & 基本面存储 ---
+try:
+    from src.rate_limiter import get_limiter, is_throttle_error
+    from src import raw_store
+    from src import trade_calendar
+    from src import fundamentals_store
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src.rate_limiter import get_limiter, is_throttle_error
+    from src import raw_store
+    from src import trade_calendar
+    from src import fundamentals_store
 
 def safe_request(func, max_retries=5, sleep_min=0.5, sleep_max=1.5, **kwargs):
     """
     Akshare 接口安全调用：自动重试 + 限流
+    节奏由 akshare 全局限流器控制（成功提速、限流降速）；
+    非限流类错误才做一次短暂随机退避。
     """
+    limiter = get_limiter('akshare')
     for attempt in range(max_retries):
+        limiter.acquire()
         try:
-            return func(**kwargs)
+            result = func(**kwargs)
+            limiter.on_success()
+            return result
         except Exception as e:
             print(f"⚠️ 调用 Akshare 接口失败 ({func.__name__}), 重试 {attempt+1}/{max_retries} 次: {e}")
-            time.sleep(random.uniform(sleep_min, sleep_max))
+            if is_throttle_error(e):
+                limiter.on_throttle()
+            else:
+                time.sleep(random.uniform(sleep_min, sleep_max))
     print(f"❌ 最终失败：{func.__name__}")
     return None
 
@@ -28,6 +52,17 @@ RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
 # 🎯 新增目录用于存放基本面数据
 FUNDAMENTAL_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw_fundamental')
 
+# --- 并发配置 ---
+# akshare 走 HTTP，线程即可；总请求速率由 akshare 全局限流器统一控制
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 8
+
+HIST_COLUMNS = {
+    '日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high',
+    '最低': 'low', '成交量': 'volume', '成交额': 'amount',
+    '换手率': 'turn', '涨跌幅': 'pctChg',
+}
+
 
 def format_code(code: str) -> str:
     """将 Akshare 的纯数字代码格式化为项目代码 sh.600000 或 sz.000001"""
@@ -68,13 +103,86 @@ def get_target_stock_list():
     
     return target_stocks
 
-def download_all_stock_history(start_date="2014-01-01"):
+def hist_to_bars(df_kline: pd.DataFrame, full_code: str) -> pd.DataFrame:
+    """把 stock_zh_a_hist 的返回转换为与 raw_store 一致的日线行。"""
+    df = df_kline.rename(columns=HIST_COLUMNS)
+    df = df[[c for c in HIST_COLUMNS.values() if c in df.columns]].copy()
+    df.insert(1, 'code', full_code)
+    for col in ['open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    # 东财成交量单位为“手”，统一为 baostock 的“股”，与 baostock 数据混合追加时口径一致
+    df['volume'] = df['volume'] * 100
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+    return df[[c for c in raw_store.BAR_COLUMNS if c in df.columns]].reset_index(drop=True)
+
+
+def _update_or_download_single(full_code: str, start_date_default: str, end_date_str: str) -> str:
     """
-    下载A股历史 K 线数据和最新的基本面指标 (Akshare版)。
-    :param start_date: 数据起始日期 (格式: YYYY-MM-DD)
+    单只股票增量更新：起始日期取本地最后日期的下一天，只追加新行；本地没有则全量下载。
+    raw 口径（不复权 + 因子）的股票拉不复权行情，用 昨收 = 收盘 - 涨跌额 识别除权除息；
+    东财接口不提供因子，发生除权的返回 'refactor'，交给 baostock 补因子。
+    返回状态：'updated' / 'uptodate' / 'nodata' / 'refactor' / 'failed'。
     """
-    start_date_ak = start_date.replace('-', '')
-    end_date_ak = datetime.datetime.now().strftime("%Y%m%d")
+    end_dt = pd.to_datetime(end_date_str)
+    last_date = raw_store.last_date(full_code) if raw_store.has_code(full_code) else None
+    if last_date is not None and last_date >= end_dt:
+        return 'uptodate'
+    start_dt = last_date + pd.Timedelta(days=1) if last_date is not None else pd.to_datetime(start_date_default)
+    raw_mode = last_date is not None and raw_store.price_mode(full_code) == "raw"
+
+    df_kline = safe_request(
+        ak.stock_zh_a_hist,
+        symbol=full_code.split('.')[-1],
+        period="daily",
+        start_date=start_dt.strftime('%Y%m%d'),
+        end_date=end_dt.strftime('%Y%m%d'),
+        adjust="" if raw_mode else "qfq"
+    )
+    if df_kline is None:
+        return 'failed'
+    if df_kline.empty:
+        # 停牌或区间内无新数据
+        return 'nodata'
+
+    bars = hist_to_bars(df_kline, full_code)
+    if last_date is not None:
+        keep = (pd.to_datetime(bars['date']) > last_date).values
+        bars = bars[keep]
+        if bars.empty:
+            return 'nodata'
+        if raw_mode:
+            preclose = (pd.to_numeric(df_kline['收盘'], errors='coerce')
+                        - pd.to_numeric(df_kline['涨跌额'], errors='coerce')).values[keep]
+            if raw_store.preclose_mismatch(full_code, bars.assign(preclose=preclose)):
+                return 'refactor'
+        raw_store.append_bars(full_code, bars)
+    else:
+        raw_store.write_bars(full_code, bars)
+    return 'updated'
+
+
+def _load_baostock_loader():
+    try:
+        from src import data_loader
+    except ImportError:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from src import data_loader
+    return data_loader
+
+
+def download_all_stock_history(start_date="2014-01-01", codes=None, include_new=True,
+                               workers=DEFAULT_WORKERS):
+    """
+    增量下载/更新 A 股历史 K 线数据和最新的基本面指标 (Akshare版)。
+    - 本地已有的股票从最后日期的下一天开始补齐并追加；没有的全量下载；
+    - codes 指定则仅更新该列表，否则为本地已有 +（include_new=True 时）市场新股；
+    - workers 个线程并发，上限 MAX_WORKERS。
+    :param start_date: 新股的数据起始日期 (格式: YYYY-MM-DD)
+    返回汇总字典 {'codes', 'updated', 'uptodate', 'nodata', 'failed', 'elapsed'}。
+    """
+    t0 = time.perf_counter()
+    end_date_str = trade_calendar.latest_trading_day().strftime('%Y-%m-%d')
 
     # 1. 确保保存目录存在
     if not os.path.exists(RAW_DATA_DIR):
@@ -85,57 +193,46 @@ def download_all_stock_history(start_date="2014-01-01"):
         os.makedirs(FUNDAMENTAL_DATA_DIR)
         print(f"创建基本面数据目录: {FUNDAMENTAL_DATA_DIR}")
 
-    target_stocks = get_target_stock_list()
+    # 预先加载（必要时重建）manifest，各线程之后直接按索引取最后日期
+    raw_store.load_manifest()
+
+    if codes:
+        target_stocks = sorted(set(codes))
+        market_stocks = target_stocks
+    else:
+        target_stocks = raw_store.list_codes()
+        market_stocks = get_target_stock_list() if (include_new or not target_stocks) else []
+        s = set(target_stocks)
+        target_stocks += [c for c in market_stocks if c not in s]
 
     if not target_stocks:
         print("❌ 无法获取股票列表，下载任务终止。")
         return
 
-    print(f"共筛选出 {len(target_stocks)} 只股票，开始下载 {start_date} 至 {end_date_ak} 的K线数据...")
+    workers = max(1, min(int(workers or 1), MAX_WORKERS, len(target_stocks)))
+    print(f"共 {len(target_stocks)} 只股票，增量更新至 {end_date_str}（并发={workers}）...")
 
-    # --- 循环下载 K 线数据 (跳过已下载的文件，保持不变) ---
-    skipped_count = 0
-    success_count = 0
-    
-    for full_code in tqdm(target_stocks, desc="下载 K 线进度"):
-        code = full_code.split('.')[-1]
-        file_path = os.path.join(RAW_DATA_DIR, f"{full_code}.csv")
-        
-        # 断点续传逻辑
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 100:
-            skipped_count += 1
-            continue
+    # --- 并发增量下载 K 线数据 ---
+    counts = {'updated': 0, 'uptodate': 0, 'nodata': 0, 'refactor': 0, 'failed': 0}
+    refactor_codes = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_update_or_download_single, code, start_date, end_date_str): code
+                   for code in target_stocks}
+        for fut in tqdm(as_completed(futures), total=len(futures), desc=f"下载 K 线进度(x{workers})"):
+            try:
+                status = fut.result()
+            except Exception:
+                status = 'failed'
+            counts[status] += 1
+            if status == 'refactor':
+                refactor_codes.append(futures[fut])
 
-        try:
-            # Akshare 接口：获取前复权日 K 线数据
-            df_kline = safe_request(
-                ak.stock_zh_a_hist,
-                symbol=code,
-                period="daily",
-                start_date=start_date_ak,
-                end_date=end_date_ak,
-                adjust="qfq"
-            )
-
-
-            if not df_kline.empty:
-                df_kline.rename(columns={
-                    '日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', 
-                    '最低': 'low', '成交量': 'volume', '成交额': 'amount', 
-                    '换手率': 'turn', '涨跌幅': 'pctChg',
-                }, inplace=True)
-                
-                df_kline.insert(1, 'code', full_code)
-                required_cols = ['date', 'code', 'open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg']
-                df_kline = df_kline[[c for c in required_cols if c in df_kline.columns]]
-                
-                df_kline['date'] = pd.to_datetime(df_kline['date']).dt.strftime('%Y-%m-%d')
-                
-                df_kline.to_csv(file_path, index=False)
-                success_count += 1
-                
-        except Exception:
-            continue
+    # 除权除息的股票：baostock 增量补行情并重拉因子（历史不复权日线不动）
+    if refactor_codes:
+        print(f">>> {len(refactor_codes)} 只期间除权除息，回退 baostock 更新复权因子...")
+        data_loader = _load_baostock_loader()
+        data_loader.download_all_stock_history(start_date=start_date, codes=refactor_codes,
+                                               workers=data_loader.DEFAULT_WORKERS)
 
     # ==========================================
     # 🎯 额外步骤：下载基本的截面基本面数据 (PE, PB, 总市值等)
@@ -146,30 +243,13 @@ def download_all_stock_history(start_date="2014-01-01"):
         # ✅ 最终修正接口：使用东方财富 A 股实时行情，它通常包含估值信息
         df_spot = safe_request(ak.stock_zh_a_spot_em)
 
-        # 确定包含我们所需信息的列
-        # 字段名可能为：'市盈率-动态', '市净率', '总市值'
-        df_spot.rename(columns={
-            '代码': 'code', 
-            '市盈率-动态': 'PE', 
-            '市净率': 'PB',
-            '总市值': 'TotalMarketCap' # 单位：元 (需要确认单位，这里按 Akshare 常见输出)
-        }, inplace=True)
-        
-        # 仅保留所需列
-        df_fundamental = df_spot[['code', 'PE', 'PB', 'TotalMarketCap']].copy()
-        
-        # 补充 date 列 (假设为当前日期)
-        today_date_str = datetime.datetime.now().strftime('%Y-%m-%d')
-        df_fundamental['date'] = today_date_str
-        
-        # 格式化 code
-        df_fundamental['code'] = df_fundamental['code'].apply(lambda x: format_code(str(x)))
+        df_fundamental = spot_to_fundamentals(df_spot)
         
         # 筛选与 K 线数据匹配的股票
         df_fundamental = df_fundamental[df_fundamental['code'].isin(target_stocks)].copy()
         
-        fundamental_path = os.path.join(FUNDAMENTAL_DATA_DIR, 'latest_fundamental_indicators.csv')
-        df_fundamental.to_csv(fundamental_path, index=False)
+        # 按所属交易日追加到日期分区（同日重复抓取覆盖，历史保留）
+        fundamental_path = fundamentals_store.append_snapshot(df_fundamental)
         print(f"✅ 基本面指标已下载并保存至: {fundamental_path}")
         
     except Exception as e:
@@ -178,10 +258,124 @@ def download_all_stock_history(start_date="2014-01-01"):
         
     print("\n" + "="*30)
     print(f"任务完成！")
-    print(f"成功下载/更新 K 线数据: {success_count}")
-    print(f"跳过已有: {skipped_count}")
+    print(f"成功下载/更新 K 线数据: {counts['updated']}")
+    print(f"已是最新: {counts['uptodate']} | 无新数据(停牌等): {counts['nodata']} | "
+          f"除权回退 baostock: {counts['refactor']} | 失败: {counts['failed']}")
+    print(f"限流器收敛速率: {get_limiter('akshare').rate:.1f} req/s")
     print(f"K 线存储位置: {RAW_DATA_DIR}")
     print("="*30)
+    return dict(codes=len(target_stocks), elapsed=time.perf_counter() - t0, **counts)
+
+# ==========================================
+# 收盘截面快照：一次请求补齐全市场当日 K 线
+# ==========================================
+SNAPSHOT_COLUMNS = {
+    '代码': 'code', '今开': 'open', '最高': 'high', '最低': 'low', '最新价': 'close',
+    '成交量': 'volume', '成交额': 'amount', '换手率': 'turn', '涨跌幅': 'pctChg',
+    '昨收': 'preclose',
+}
+MARKET_CLOSE_TIME = datetime.time(15, 5)  # 收盘后才能把快照当作日线
+
+
+FUNDAMENTAL_COLUMNS = {
+    '代码': 'code', '市盈率-动态': 'PE', '市净率': 'PB',
+    '总市值': 'TotalMarketCap',  # 单位：元 (按 Akshare 常见输出)
+}
+
+
+def spot_to_fundamentals(df_spot: pd.DataFrame) -> pd.DataFrame:
+    """从 stock_zh_a_spot_em 截面中提取 PE / PB / 总市值，代码转为项目格式。"""
+    df = df_spot.rename(columns=FUNDAMENTAL_COLUMNS)
+    df = df[[c for c in FUNDAMENTAL_COLUMNS.values() if c in df.columns]].copy()
+    df['code'] = df['code'].apply(lambda x: format_code(str(x)))
+    for col in fundamentals_store.FIELDS:
+        df[col] = pd.to_numeric(df[col], errors='coerce') if col in df.columns else float('nan')
+    return df[['code'] + fundamentals_store.FIELDS].reset_index(drop=True)
+
+
+def snapshot_to_bars(df_spot: pd.DataFrame, trade_date) -> pd.DataFrame:
+    """把 stock_zh_a_spot_em 的截面行情转换为与 raw_store 一致的日线行（附带 preclose 供除权识别）。"""
+    df = df_spot.rename(columns=SNAPSHOT_COLUMNS)
+    df = df[[c for c in SNAPSHOT_COLUMNS.values() if c in df.columns]].copy()
+    df['code'] = df['code'].apply(lambda x: format_code(str(x)))
+    for col in ['open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg', 'preclose']:
+        df[col] = pd.to_numeric(df[col], errors='coerce') if col in df.columns else float('nan')
+    # 东财成交量单位为“手”，统一为 baostock 的“股”
+    df['volume'] = df['volume'] * 100
+    # 停牌 / 无成交：没有有效价格，不写入
+    df = df[(df['close'] > 0) & (df['volume'] > 0)]
+    df.insert(0, 'date', pd.Timestamp(trade_date).strftime('%Y-%m-%d'))
+    return df[raw_store.BAR_COLUMNS + ['preclose']].reset_index(drop=True)
+
+
+def update_from_daily_snapshot(trade_date=None, start_date="2014-01-01"):
+    """
+    日常收盘增量（快照模式）：
+    - 一次 stock_zh_a_spot_em 请求拿到全市场当日 OHLCV/成交额/换手/涨跌幅；
+    - 本地最后日期恰好是上一交易日的股票，直接把快照行追加到历史；
+    - 缺口超过一个交易日（或停牌后复牌）的股票，以及昨收与本地最后收盘对不上（当日除权除息）的股票，
+      才回退到 baostock 逐只历史查询（后者顺带重拉复权因子）。
+    """
+    now = datetime.datetime.now()
+    trade_dt = pd.Timestamp(trade_date or now.date()).normalize()
+    if not trade_calendar.is_trading_day(trade_dt):
+        print(f"{trade_dt.date()} 不是交易日，无需快照更新。")
+        return
+    if trade_dt.date() == now.date() and now.time() < MARKET_CLOSE_TIME:
+        print("⚠️ 尚未收盘，截面行情不是最终日线，已取消快照更新。")
+        return
+
+    manifest = raw_store.load_manifest()
+    if manifest.empty:
+        print("❌ 本地没有历史数据，请先执行全量下载。")
+        return
+
+    # 上一交易日（交易日历，节假日后也能正确走快照追加）
+    prev_day = trade_calendar.shift_trading_days(trade_dt, -1)
+    last_dates = manifest['last_date']
+    up_to_date = last_dates.index[last_dates >= trade_dt].tolist()
+    one_bar = last_dates.index[last_dates == prev_day].tolist()
+    gap_codes = last_dates.index[last_dates < prev_day].tolist()
+
+    print(f"快照日期: {trade_dt.date()} | 已最新 {len(up_to_date)} | 缺 1 根 {len(one_bar)} | 缺口更大 {len(gap_codes)}")
+
+    appended = 0
+    if one_bar:
+        print(">>> 正在获取全市场收盘截面 (1 次请求)...")
+        df_spot = safe_request(ak.stock_zh_a_spot_em)
+        if df_spot is None or df_spot.empty:
+            print("❌ 截面行情获取失败，全部回退逐只查询。")
+            gap_codes += one_bar
+        else:
+            # 同一份截面顺带存一份当日基本面
+            fundamentals_store.append_snapshot(spot_to_fundamentals(df_spot), trade_dt)
+            bars = snapshot_to_bars(df_spot, trade_dt)
+            bars = bars[bars['code'].isin(one_bar)]
+            # 向量化比对昨收与索引里的最后收盘：不一致说明当日除权除息，需要 baostock 补因子；
+            # 任一边缺失时无从核对，同样回退（否则除权日会把未复权价格接在旧因子后面）
+            last_close = bars['code'].map(manifest['last_close']).astype('float64')
+            ex_rights = (last_close.isna() | bars['preclose'].isna()
+                         | ((bars['preclose'] - last_close).abs() > raw_store.PRECLOSE_TOLERANCE))
+            if ex_rights.any():
+                gap_codes += bars.loc[ex_rights, 'code'].tolist()
+                print(f"当日除权除息 / 昨收无法核对: {int(ex_rights.sum())} 只，回退逐只查询")
+            bars = bars[~ex_rights].drop(columns=['preclose'])
+            frames = {code: part for code, part in bars.groupby('code')}
+            appended = raw_store.append_many(frames)
+            # 快照里没有有效行的（停牌等）留给下次逐只补齐
+            print(f"快照追加: {appended} 只；无有效行情（停牌等）: {len(one_bar) - len(frames) - int(ex_rights.sum())} 只")
+
+    if gap_codes:
+        print(f">>> 回退逐只历史查询: {len(gap_codes)} 只")
+        data_loader = _load_baostock_loader()
+        data_loader.download_all_stock_history(start_date=start_date, codes=gap_codes,
+                                               workers=data_loader.DEFAULT_WORKERS)
+
+    print("\n" + "="*30)
+    print("快照更新完成！")
+    print(f"快照追加: {appended} | 逐只回退: {len(gap_codes)}")
+    print("="*30)
+
 
 if __name__ == "__main__":
     download_all_stock_history(start_date="2014-01-01")
\ No newline at end of file
@@ -0,0 +1,355 @@
+# src/data_quality.py
+"""
+原始日线数据质量扫描（多进程并行，逐只输出机器可读报告 data/processed/data_quality_report.csv）。
+
+逐只检查：
+- 文件不可读 / 截断（CSV 末行不完整、关键列解析失败）、与 manifest 行数 / 末日不一致；
+- 日期重复、存储顺序乱序、相对交易日历的缺失交易日（最长缺口）；
+- 非正 / 缺失价格、OHLC 不自洽、连续零成交量；
+- 复权断裂：复权后相邻收盘涨跌幅与 pctChg 对不上（漏了除权因子或新旧口径混拼）。
+
+severity：error（下游应跳过或修复）/ warn（长期停牌等，仅提示）/ ok。
+repair：local（去重排序、剔除坏行即可，本地重写）/ refetch（需要整只重新下载）。
+下游（feature_eng / trader）通过 apply_policy 选择 ignore / skip / repair。
+"""
+import os
+import sys
+import datetime
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+try:
+    from src import raw_store
+    from src import trade_calendar
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import trade_calendar
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+REPORT_PATH = os.path.join(PROCESSED_DIR, 'data_quality_report.csv')
+
+# --- 阈值 ---
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+GAP_WARN_DAYS = 20              # 连续缺失交易日超过该值提示（长期停牌）
+ZERO_VOLUME_STREAK = 5          # 连续零成交量达到该天数提示
+ADJ_BREAK_TOL = 0.005           # 复权涨跌幅与 pctChg 的容差（另加一个价格最小变动单位的相对误差）
+PRICE_TICK = 0.01
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+REPORT_COLUMNS = ['code', 'severity', 'repair', 'issues', 'price_mode', 'rows', 'first_date', 'last_date',
+                  'unreadable', 'truncated', 'manifest_mismatch', 'dup_dates', 'unsorted',
+                  'missing_days', 'max_gap', 'bad_price_rows', 'ohlc_violations',
+                  'max_zero_volume_streak', 'adj_breaks', 'checked_at']
+
+ERROR_CHECKS = {   # 字段 -> (问题名, 修复方式)
+    'unreadable': ('unreadable', 'refetch'),
+    'truncated': ('truncated', 'refetch'),
+    'adj_breaks': ('adjustment_break', 'refetch'),
+    'dup_dates': ('duplicate_dates', 'local'),
+    'unsorted': ('unsorted_dates', 'local'),
+    'bad_price_rows': ('non_positive_price', 'local'),
+    'manifest_mismatch': ('manifest_mismatch', 'local'),
+}
+
+_WORKER = {'days': None}
+
+
+# ==========================================
+# 1. 单只检查（纯函数，可在子进程中运行）
+# ==========================================
+def _longest_run(mask: np.ndarray) -> int:
+    if not mask.any():
+        return 0
+    edges = np.diff(np.concatenate([[0], mask.astype(np.int8), [0]]))
+    return int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+
+
+def _csv_truncated(code: str) -> bool:
+    """CSV 末尾不是换行：最后一行写到一半。"""
+    files = raw_store.data_files(code)
+    if raw_store.active_backend() == "parquet" or not files:
+        return False
+    with open(files[0], 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b'\n'
+
+
+def _gap_stats(dates: np.ndarray, days: np.ndarray) -> tuple:
+    """相对交易日历的缺失交易日总数与最长连续缺口。"""
+    if len(dates) < 2 or days is None or not len(days):
+        return 0, 0
+    idx = np.searchsorted(days, dates)
+    gaps = np.diff(idx) - 1
+    gaps = gaps[gaps > 0]
+    return (int(gaps.sum()), int(gaps.max())) if len(gaps) else (0, 0)
+
+
+def _adjustment_breaks(df: pd.DataFrame, factors) -> int:
+    """复权后相邻收盘涨跌幅与 pctChg 不一致的行数。"""
+    if 'pctChg' not in df.columns or len(df) < 2:
+        return 0
+    adj = raw_store.adjust_prices(df[['date', 'close']], factors, "qfq") if factors is not None else df
+    close = adj['close'].values.astype('float64')
+    prev = close[:-1]
+    ret = close[1:] / prev - 1.0
+    pct = df['pctChg'].values[1:].astype('float64') / 100.0
+    tol = ADJ_BREAK_TOL + PRICE_TICK / np.abs(prev) + PRICE_TICK / np.abs(close[1:])
+    valid = np.isfinite(ret) & np.isfinite(pct) & (prev > 0)
+    return int(np.sum(np.abs(ret - pct)[valid] > tol[valid]))
+
+
+def check_code(code: str) -> dict:
+    """检查单只股票，返回报告行（dict）。"""
+    rec = {c: 0 for c in REPORT_COLUMNS}
+    rec.update(code=code, price_mode=raw_store.price_mode(code), first_date='', last_date='',
+               unreadable=False, truncated=False, manifest_mismatch=False, unsorted=False,
+               checked_at=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    try:
+        stored = raw_store.read_stored(code)
+        if stored is None or 'date' not in stored.columns:
+            raise ValueError("no data")
+    except Exception:
+        rec['unreadable'] = True
+        return _classify(rec)
+
+    rec['rows'] = int(len(stored))
+    dates = pd.to_datetime(stored['date'], errors='coerce')
+    prices = stored.reindex(columns=PRICE_COLUMNS).apply(pd.to_numeric, errors='coerce')
+    # 截断：末尾没有换行，或末行日期 / 收盘解析失败
+    rec['truncated'] = bool(_csv_truncated(code) or len(stored) == 0
+                            or pd.isna(dates.iloc[-1]) or pd.isna(prices['close'].iloc[-1]))
+
+    valid_dates = dates.dropna()
+    d = valid_dates.values.astype('datetime64[ns]')
+    rec['dup_dates'] = int(valid_dates.duplicated().sum())
+    rec['unsorted'] = bool(len(d) > 1 and np.any(np.diff(d) < np.timedelta64(0)))
+
+    df = raw_store._normalize(stored)
+    if len(df):
+        rec['first_date'] = df['date'].iloc[0].strftime('%Y-%m-%d')
+        rec['last_date'] = df['date'].iloc[-1].strftime('%Y-%m-%d')
+    day_index = np.asarray(df['date'].values, dtype='datetime64[D]')
+    rec['missing_days'], rec['max_gap'] = _gap_stats(day_index, _WORKER['days'])
+
+    px = df.reindex(columns=PRICE_COLUMNS).values.astype('float64')
+    rec['bad_price_rows'] = int(np.sum(~(px > 0).all(axis=1)))
+    o, h, l, c = px.T
+    with np.errstate(invalid='ignore'):
+        rec['ohlc_violations'] = int(np.sum((h < l) | (c > h) | (c < l) | (o > h) | (o < l)))
+    if 'volume' in df.columns:
+        rec['max_zero_volume_streak'] = _longest_run(df['volume'].fillna(0).values == 0)
+
+    good = df[(px > 0).all(axis=1)] if len(df) else df
+    rec['adj_breaks'] = _adjustment_breaks(good, raw_store.read_factors(code))
+
+    entry = raw_store.manifest_entry(code)
+    if entry is not None:
+        rec['manifest_mismatch'] = bool(int(entry['rows']) != len(df)
+                                        or pd.Timestamp(entry['last_date']).strftime('%Y-%m-%d') != rec['last_date'])
+    return _classify(rec)
+
+
+def _classify(rec: dict) -> dict:
+    issues, repairs = [], set()
+    for field, (name, how) in ERROR_CHECKS.items():
+        if rec[field]:
+            issues.append(name)
+            repairs.add(how)
+    warns = []
+    if rec['max_gap'] > GAP_WARN_DAYS:
+        warns.append('calendar_gap')
+    if rec['max_zero_volume_streak'] >= ZERO_VOLUME_STREAK:
+        warns.append('zero_volume_streak')
+    if rec['ohlc_violations']:
+        warns.append('ohlc_inconsistent')
+    rec['severity'] = 'error' if issues else ('warn' if warns else 'ok')
+    rec['repair'] = 'refetch' if 'refetch' in repairs else ('local' if repairs else '')
+    rec['issues'] = ';'.join(issues + warns)
+    return rec
+
+
+# ==========================================
+# 2. 并行扫描 / 报告
+# ==========================================
+def _worker_init(store_config: dict, days: np.ndarray) -> None:
+    raw_store.apply_config(store_config)
+    _WORKER['days'] = days
+
+
+def init_checker(store_config: dict | None = None, days=None) -> None:
+    """在本进程准备 check_code_safe（其他模块的进程池 initializer 调用）；days 缺省按本地交易日历。"""
+    _worker_init(store_config or raw_store.get_config(), _calendar_days() if days is None else days)
+
+
+def check_code_safe(code: str) -> dict:
+    """check_code 的容错版本：读取出错记为 unreadable 而不是抛出。"""
+    try:
+        return check_code(code)
+    except Exception:
+        rec = {c: 0 for c in REPORT_COLUMNS}
+        rec.update(code=code, unreadable=True, truncated=False, manifest_mismatch=False, unsorted=False,
+                   price_mode='', first_date='', last_date='', checked_at='')
+        return _classify(rec)
+
+
+def _calendar_days() -> np.ndarray:
+    latest = trade_calendar.latest_trading_day()
+    return trade_calendar.trading_days(trade_calendar.CALENDAR_START, latest).values.astype('datetime64[D]')
+
+
+def scan_all(codes=None, workers: int = DEFAULT_WORKERS, write: bool = True) -> pd.DataFrame:
+    """并行检查 codes（默认本地全部），写出报告并返回。只扫描部分代码时与已有报告合并。"""
+    codes = sorted(codes) if codes is not None else raw_store.list_codes()
+    if not codes:
+        print("本地没有可检查的数据。")
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    raw_store.load_manifest()  # 必要时先在主进程重建一次索引
+    days = _calendar_days()
+    workers = max(1, min(int(workers or 1), len(codes)))
+
+    if workers > 1:
+        ctx = mp.get_context()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_worker_init,
+                                 initargs=(raw_store.get_config(), days)) as pool:
+            records = list(tqdm(pool.map(check_code_safe, codes, chunksize=32), total=len(codes),
+                                desc=f"数据质量(x{workers})"))
+    else:
+        _worker_init(raw_store.get_config(), days)
+        records = [check_code_safe(code) for code in tqdm(codes, desc="数据质量")]
+
+    report = pd.DataFrame(records, columns=REPORT_COLUMNS)
+    if write:
+        report = save_records(records)
+    _print_summary(report[report['code'].isin(codes)])
+    return report
+
+
+def save_records(records: list) -> pd.DataFrame:
+    """把一批检查记录写入报告：只覆盖了部分代码时与已有报告合并（同代码以新记录为准）。"""
+    report = pd.DataFrame(records, columns=REPORT_COLUMNS)
+    codes = set(report['code'])
+    old = load_report()
+    if old is not None and len(codes) < len(raw_store.list_codes()):
+        report = pd.concat([old[~old['code'].isin(codes)], report], ignore_index=True)
+    _write_report(report)
+    return report
+
+
+def _write_report(report: pd.DataFrame) -> None:
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+    tmp = REPORT_PATH + '.tmp'
+    report.sort_values('code').to_csv(tmp, index=False)
+    os.replace(tmp, REPORT_PATH)
+
+
+def _print_summary(report: pd.DataFrame) -> None:
+    counts = report['severity'].value_counts()
+    print(f"数据质量: ok {counts.get('ok', 0)} | warn {counts.get('warn', 0)} | error {counts.get('error', 0)}"
+          f"（报告: {REPORT_PATH}）")
+    issues = report['issues'].str.split(';').explode()
+    issues = issues[issues.notna() & (issues != '')].value_counts()
+    if len(issues):
+        print("   " + " | ".join(f"{k}: {v}" for k, v in issues.items()))
+
+
+def load_report():
+    if not os.path.exists(REPORT_PATH):
+        return None
+    return pd.read_csv(REPORT_PATH, dtype={'code': str, 'issues': str, 'repair': str},
+                       keep_default_na=False)
+
+
+def flagged_codes(severity: str = 'error') -> set:
+    """报告中达到 severity 的代码（error，或 warn 及以上）；没有报告返回空集。"""
+    report = load_report()
+    if report is None:
+        return set()
+    levels = ('error',) if severity == 'error' else ('error', 'warn')
+    return set(report.loc[report['severity'].isin(levels), 'code'])
+
+
+# ==========================================
+# 3. 修复 / 下游策略
+# ==========================================
+def repair_local(code: str) -> bool:
+    """本地修复：按日期去重排序、剔除非正 / 缺失价格行后整只重写（保留复权因子，重建索引行）。"""
+    stored = raw_store.read_stored(code)
+    if stored is None:
+        return False
+    df = raw_store._normalize(stored)
+    df = df[(df.reindex(columns=PRICE_COLUMNS) > 0).all(axis=1)]
+    if df.empty:
+        return False
+    raw_store.write_bars(code, df, factors=raw_store.read_factors(code))
+    return True
+
+
+def repair(codes=None, refetch: bool = True, start_date: str = "2014-01-01") -> dict:
+    """
+    修复报告中的 error 代码（或指定 codes）：local 类先本地重写；
+    仍有错误或需要 refetch 的，refetch=True 时整只重新下载（联网）。修复后重新检查并更新报告。
+    """
+    report = load_report()
+    if report is None:
+        print("没有数据质量报告，请先运行 scan_all()。")
+        return {'local': 0, 'refetch': 0, 'remaining': 0}
+    bad = report[report['severity'] == 'error']
+    if codes is not None:
+        bad = bad[bad['code'].isin(set(codes))]
+    if bad.empty:
+        return {'local': 0, 'refetch': 0, 'remaining': 0}
+
+    local = bad.loc[bad['repair'] == 'local', 'code'].tolist()
+    fixed = [code for code in local if repair_local(code)]
+    rescanned = scan_all(bad['code'].tolist(), workers=1) if fixed else report
+    still = rescanned[rescanned['code'].isin(bad['code']) & (rescanned['severity'] == 'error')]['code'].tolist()
+
+    refetched = 0
+    if still and refetch:
+        try:
+            from src import data_loader
+        except ImportError:
+            sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from src import data_loader
+        print(f">>> 重新下载 {len(still)} 只无法本地修复的股票...")
+        result = data_loader.redownload_codes(still, start_date=start_date) or {}
+        refetched = result.get('updated', 0)
+        rescanned = scan_all(still, workers=1)
+        still = rescanned[rescanned['code'].isin(still) & (rescanned['severity'] == 'error')]['code'].tolist()
+    print(f"修复完成：本地 {len(fixed)} 只，重新下载 {refetched} 只，仍有错误 {len(still)} 只")
+    return {'local': len(fixed), 'refetch': refetched, 'remaining': len(still)}
+
+
+def apply_policy(codes: list, policy: str = "skip") -> list:
+    """
+    下游入口：按数据质量报告过滤待处理代码。
+    - ignore：原样返回；
+    - skip：剔除 error 代码；
+    - repair：先本地修复 error 代码（不联网），仍有错误的剔除。
+    """
+    if policy == "ignore":
+        return list(codes)
+    if load_report() is None:
+        print("💡 尚无数据质量报告（data_quality.scan_all），本次不做过滤。")
+        return list(codes)
+    if policy == "repair":
+        repair(codes, refetch=False)
+    bad = flagged_codes('error')
+    kept = [c for c in codes if c not in bad]
+    if len(kept) < len(codes):
+        print(f"⚠️ 数据质量: 跳过 {len(codes) - len(kept)} 只有错误的股票（详见 {REPORT_PATH}）")
+    return kept
+
+
+if __name__ == "__main__":
+    scan_all()
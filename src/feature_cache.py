@@ -0,0 +1,162 @@
+# src/feature_cache.py
+"""
+按内容寻址的逐只特征缓存：原始数据和特征 / 标签定义都没变的代码直接读缓存，只重算“脏”代码。
+
+- 条目键 = sha1(定义指纹, 输入指纹)，文件 data/processed/feature_cache/{code}_{键}.pkl，内容为该股的已打标特征表；
+  定义指纹由调用方给出（feature_eng.definition_hash：注册表节点 + 函数源码 + 标签代码 + 列 + 版本），
+  输入指纹 = raw_store.fingerprint（行情校验和 + 复权因子）+ 各数据文件的大小 / mtime
+  （文件在 raw_store 之外被改写、manifest 没跟上时也会失效）；
+- 键即内容，不做原地失效：数据或定义改回去时旧条目还能命中，过期条目由淘汰清理；
+- LRU：命中时刷新文件 mtime，evict() 在总大小超过 CACHE_MAX_MB 时按 mtime 从旧到新删除；
+- 计数按进程累计（hits / misses / writes），worker 用 take_stats() 取走增量交回主进程，
+  主进程汇总后 report() 打印并追加一行到 _runs.csv。
+"""
+import os
+import sys
+import hashlib
+import datetime
+import pandas as pd
+
+try:
+    from src import raw_store
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+CACHE_DIR = os.path.join(PROCESSED_DIR, 'feature_cache')
+RUNS_PATH = os.path.join(CACHE_DIR, '_runs.csv')
+
+CACHE_MAX_MB = 2048  # 缓存目录上限，超出按 LRU 淘汰
+RUNS_COLUMNS = ['time', 'hits', 'misses', 'writes', 'evicted', 'evicted_mb', 'size_mb', 'entries']
+
+_STATS = {'hits': 0, 'misses': 0, 'writes': 0}
+
+
+# ==========================================
+# 1. 键
+# ==========================================
+def input_fingerprint(code: str) -> str:
+    """原始数据指纹：内容校验和 + 数据文件 (名称, 大小, mtime)；没有数据返回空串。"""
+    content = raw_store.fingerprint(code)
+    if not content:
+        return ''
+    h = hashlib.sha1(content.encode())
+    for name, size, mtime_ns in raw_store.file_stats(code):
+        h.update(f"|{name}:{size}:{mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def entry_key(code: str, definition: str) -> str:
+    """条目键；没有数据返回空串（不缓存）。"""
+    inputs = input_fingerprint(code)
+    if not inputs:
+        return ''
+    return hashlib.sha1(f"{definition}|{code}|{inputs}".encode()).hexdigest()[:24]
+
+
+def _entry_path(code: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{code}_{key}.pkl")
+
+
+# ==========================================
+# 2. 读写
+# ==========================================
+def get(code: str, key: str):
+    """命中返回缓存的 DataFrame 并刷新 LRU 时间，否则返回 None（计一次未命中）。"""
+    path = _entry_path(code, key) if key else None
+    if path is not None and os.path.exists(path):
+        try:
+            df = pd.read_pickle(path)
+        except Exception:
+            df = None  # 损坏的条目当作未命中，put 时覆盖
+        if df is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass  # 同时被另一进程淘汰
+            _STATS['hits'] += 1
+            return df
+    _STATS['misses'] += 1
+    return None
+
+
+def put(code: str, key: str, df: pd.DataFrame) -> None:
+    if not key:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _entry_path(code, key)
+    tmp = f"{path}.{os.getpid()}.tmp"  # 流水线 / 分片 worker 可能同时写同一只
+    df.to_pickle(tmp)
+    os.replace(tmp, path)
+    _STATS['writes'] += 1
+
+
+# ==========================================
+# 3. 淘汰与统计
+# ==========================================
+def _entries() -> list:
+    """[(mtime, 大小, 路径)]，不含运行记录与写到一半的临时文件。"""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    out = []
+    with os.scandir(CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.pkl'):
+                st = entry.stat()
+                out.append((st.st_mtime, st.st_size, entry.path))
+    return out
+
+
+def evict(max_mb: float = CACHE_MAX_MB) -> dict:
+    """总大小超过 max_mb 时按最近使用时间从旧到新删除条目；返回 {'evicted', 'evicted_mb', 'size_mb', 'entries'}。"""
+    entries = sorted(_entries())
+    total = sum(size for _, size, _ in entries)
+    limit = max_mb * 1024 * 1024
+    removed, freed = 0, 0
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+        freed += size
+    return {'evicted': removed, 'evicted_mb': round(freed / 1024 / 1024, 1),
+            'size_mb': round(total / 1024 / 1024, 1), 'entries': len(entries) - removed}
+
+
+def take_stats() -> dict:
+    """取走并清零本进程的计数（worker 交回主进程汇总用）。"""
+    stats = dict(_STATS)
+    for k in _STATS:
+        _STATS[k] = 0
+    return stats
+
+
+def merge_stats(total: dict, part: dict) -> dict:
+    for k, v in part.items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+
+def report(stats: dict, max_mb: float = CACHE_MAX_MB) -> dict:
+    """本轮汇总：先按 LRU 淘汰，再打印命中 / 未命中并追加到 _runs.csv。"""
+    row = dict({'hits': 0, 'misses': 0, 'writes': 0}, **stats)
+    row.update(evict(max_mb))
+    lookups = row['hits'] + row['misses']
+    if lookups == 0:
+        return row
+    print(f"特征缓存: 命中 {row['hits']} | 未命中 {row['misses']}（命中率 {row['hits'] / lookups:.1%}）"
+          f" | 写入 {row['writes']} | 淘汰 {row['evicted']} 个 ({row['evicted_mb']} MB)"
+          f" | 占用 {row['size_mb']} MB / {row['entries']} 个")
+    row['time'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    pd.DataFrame([row], columns=RUNS_COLUMNS).to_csv(RUNS_PATH, mode='a', index=False,
+                                                     header=not os.path.exists(RUNS_PATH))
+    return row
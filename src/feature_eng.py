@@ -1,218 +1,364 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+import hashlib
+import inspect
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
+# --- 引入原始数据存储层 & 基本面存储 & 数据质量 & 增量指标状态 & 特征注册表 & 特征缓存 & 截面标准化 ---
+try:
+    from src import raw_store
+    from src import fundamentals_store
+    from src import data_quality
+    from src import universe
+    from src import feature_state
+    from src import features_lib
+    from src import feature_cache
+    from src import cross_section
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import fundamentals_store
+    from src import data_quality
+    from src import universe
+    from src import feature_state
+    from src import features_lib
+    from src import feature_cache
+    from src import cross_section
+
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
 PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
 
+# 估值因子（PE / PB / 总市值）按时点 as-of 拼接；截面历史积累足够后再打开
+USE_FUNDAMENTALS = False
+# 数据质量报告中 error 代码的处理：ignore / skip / repair（本地修复后仍有错误的跳过）
+DATA_QUALITY_POLICY = "skip"
+# 训练样本按时点股票池（universe.npz）取：覆盖历史上入选过的全部股票，只保留当日在池内的行；
+# 没有 universe.npz 时退回今天的 stock_pool.csv（有幸存者偏差）
+USE_UNIVERSE = True
+# 并行模式：每 SHARD_SIZE 只股票一组，在 worker 里算完直接写成 float32 分片，最后逐片拼装；
+# 分片以（代码 + 数据指纹 + 特征版本）命名，中途崩溃后重跑会跳过已完成的分片
+FEATURE_WORKERS = min(8, os.cpu_count() or 1)
+SHARD_SIZE = 50
+SHARD_DIR = os.path.join(PROCESSED_DIR, 'feature_shards')
+FEATURE_VERSION = 1  # 特征计算之外的改动（如清洗口径）影响结果时 +1，使旧分片 / 缓存失效
+# 增量模式：按代码持久化指标状态（data/processed/feature_state），每次只对新增 K 线计算指标
+INCREMENTAL = True
+# 特征缓存：逐只已打标特征按（定义指纹, 原始数据指纹）寻址（data/processed/feature_cache），
+# 数据和定义都没变的代码直接读缓存；目录上限见 feature_cache.CACHE_MAX_MB
+USE_CACHE = True
+# 截面标准化：写出数据集前对这些特征按日期（时点股票池内）加截面名次 / 缩尾 z-score 列，模型一并使用；
+# trader 按模型特征名在当日快照上做同样的变换。空列表关闭
+CROSS_SECTION_FEATURES = ['roc_5', 'roc_20', 'bias_20', 'rsi_6', 'bb_width', 'vol_ratio']
+CROSS_SECTION_METHODS = ('rank', 'zscore')
+
 # ==========================================
-# 1. 技术指标计算函数 (纯 Pandas 实现)
+# 1. 主处理逻辑
 # ==========================================
 
-def cal_rsi(series, periods=14):
-    """相对强弱指标 (RSI)"""
-    delta = series.diff()
-    up = delta.clip(lower=0)
-    down = -1 * delta.clip(upper=0)
-    
-    # 使用 Wilder 的平滑移动平均 (alpha = 1/n)
-    ma_up = up.ewm(com=periods - 1, adjust=True, min_periods=periods).mean()
-    ma_down = down.ewm(com=periods - 1, adjust=True, min_periods=periods).mean()
+# 瘦身：只保留 date, code, target 和 特征列
+# 训练不需要 open/high/low/amount，除非你用它们做特征
+# 这里保留 close 方便后续回测计算收益
+FEATURE_COLUMNS = [
+    'code', 'date', 'close', 
+    'roc_5', 'roc_10', 'roc_20',
+    'bias_20',
+    'rsi_6', 'rsi_12', 'rsi_gap',
+    'dif', 'dea', 'macd_hist',
+    'kdj_k', 'kdj_d', 'kdj_j',
+    'bb_width', 'bb_zscore',
+    'vol_ratio',
+    'target',  # <--- 这是我们要预测的
+    'future_return' # <--- ✅ 必须加上这一行！
+]
+# 由 features_lib 注册表计算的特征列（其余为 K 线列 / 标签）
+INDICATORS = features_lib.registered(FEATURE_COLUMNS)
+
+_DEFINITION = {}
+
+def definition_hash():
+    """特征 + 标签定义的指纹：注册表依赖闭包（含函数源码）、标签代码、输出列与 FEATURE_VERSION。"""
+    if 'hash' not in _DEFINITION:
+        h = hashlib.sha1(f"v{FEATURE_VERSION}|{','.join(FEATURE_COLUMNS)}".encode())
+        h.update(features_lib.definition_hash(INDICATORS).encode())
+        h.update(inspect.getsource(add_labels).encode())
+        _DEFINITION['hash'] = h.hexdigest()
+    return _DEFINITION['hash']
+
+def build_code_features(code, incremental=INCREMENTAL, use_cache=USE_CACHE):
+    """
+    单只股票的特征 + 标签（FEATURE_COLUMNS，浮点列为 float32）；本地没有该股票返回 None。
+    use_cache=True 时先查特征缓存，未命中再计算并写回；
+    incremental=True 时指标走 feature_state（只算新增 K 线），结果与全量一致。
+    出错直接抛出，由调用方汇总（process_features / pipeline 逐只调用）。
+    """
+    key = feature_cache.entry_key(code, definition_hash()) if use_cache else ''
+    if key:
+        cached = feature_cache.get(code, key)
+        if cached is not None:
+            return cached
+    df = _compute_code_features(code, incremental)
+    if df is None:
+        return None
+    float_cols = df.select_dtypes(include=['float64']).columns
+    df[float_cols] = df[float_cols].astype('float32')
+    feature_cache.put(code, key, df)
+    return df
+
+def _compute_code_features(code, incremental):
+    if incremental:
+        df = feature_state.update_code(code, INDICATORS)
+        return None if df is None else add_labels(df, code)
+    if not raw_store.has_code(code):
+        return None
+
+    # --- A. 基础清洗 ---
+    # 只读需要的列（已按时间排序；缺失的列会被自动忽略）
+    cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'pctChg']
+    df = raw_store.read_bars(code, columns=cols)
+
+    # --- B. 构造特征 (Feature Engineering) ---
+    # 指标定义统一在 features_lib 注册表里，只算 INDICATORS 依赖到的节点
+    df = features_lib.compute(df, INDICATORS)
     
-    rsi = ma_up / (ma_up + ma_down) * 100
-    return rsi
-
-def cal_macd(close, fast_period=12, slow_period=26, signal_period=9):
-    """移动平均聚散指标 (MACD)"""
-    # 快速线 EMA
-    ema_fast = close.ewm(span=fast_period, adjust=False).mean()
-    # 慢速线 EMA
-    ema_slow = close.ewm(span=slow_period, adjust=False).mean()
-    # DIF
-    dif = ema_fast - ema_slow
-    # DEA (Signal Line)
-    dea = dif.ewm(span=signal_period, adjust=False).mean()
-    # MACD Histogram (柱状图) * 2 通常是为了放大显示，这里用原始值
-    macd_hist = (dif - dea)
-    return dif, dea, macd_hist
-
-def cal_kdj(high, low, close, n=9, m1=3, m2=3):
-    """随机指标 (KDJ)"""
-    # 这里的 min_periods=1 保证初期有数据，n天内的最低低点
-    low_list = low.rolling(window=n, min_periods=1).min()
-    # n天内的最高高点
-    high_list = high.rolling(window=n, min_periods=1).max()
+    return add_labels(df, code)
+
+def add_labels(df, code):
+    """在指标表上构造标签、去掉 NaN 行，返回 FEATURE_COLUMNS。"""
+    df = df.copy()
+    # --- C. 构造标签 (Label Generation) ---
+    # 目标: 预测未来 5 个交易日后的收益率
+    # shift(-5) 表示把 5 天后的 close 移到现在这一行
+    HOLDING_PERIOD = 5
+    TARGET_PCT = 0.05 # 5%
     
-    # RSV = (Close - Lowest_n) / (Highest_n - Lowest_n) * 100
-    rsv = (close - low_list) / (high_list - low_list) * 100
-    # 处理除以0的情况
-    rsv = rsv.fillna(0)
+    df['future_close'] = df['close'].shift(-HOLDING_PERIOD)
+    df['future_return'] = df['future_close'] / df['close'] - 1.0
     
-    # 计算 K, D, J
-    # K = 2/3 * Prev_K + 1/3 * RSV
-    # 迭代计算比较慢，使用 pandas 的 ewm 近似模拟 (alpha=1/3)
-    k = rsv.ewm(alpha=1/m1, adjust=False).mean()
-    d = k.ewm(alpha=1/m2, adjust=False).mean()
-    j = 3 * k - 2 * d
-    return k, d, j
-
-def cal_bollinger(close, window=20, num_std=2):
-    """布林带 (Bollinger Bands)"""
-    rolling_mean = close.rolling(window=window).mean()
-    rolling_std = close.rolling(window=window).std()
+    # Label = 1 如果未来涨幅 > 5%，否则 0
+    df['target'] = (df['future_return'] > TARGET_PCT).astype(int)
     
-    upper_band = rolling_mean + (rolling_std * num_std)
-    lower_band = rolling_mean - (rolling_std * num_std)
+    # --- D. 数据清洗 (Drop NaNs) ---
+    # 1. 去除前面计算指标产生的 NaN (比如 MA20 导致前19天为空)
+    # 2. 去除后面因为 shift(-10) 产生的 NaN (最后10天没有未来数据)
+    df = df.dropna()
     
-    # 布林带宽度 (Band Width) - 衡量波动率
-    # 处理分母为0的情况 (极少见)
-    bw = (upper_band - lower_band) / rolling_mean
-    return bw, (close - rolling_mean) / rolling_std # 同时也返回 Z-score
+    # 添加 code 列用于区分
+    df['code'] = code
+    return df[FEATURE_COLUMNS]
 
-# ==========================================
-# 2. 主处理逻辑
-# ==========================================
+def universe_codes(use_universe=USE_UNIVERSE):
+    """时点股票池中历史上入选过的代码；未启用或还没有 universe.npz 时返回 None。"""
+    if not use_universe:
+        return None
+    uni = universe.load_universe()
+    if uni is None:
+        print("💡 尚无时点股票池（universe.build_universe），训练集退回今天的 stock_pool.csv。")
+        return None
+    return uni.ever_members()
 
-def process_features():
-    # 1. 读取筛选后的股票池
-    pool_path = os.path.join(PROCESSED_DIR, 'stock_pool.csv')
-    if not os.path.exists(pool_path):
-        print("错误：未找到 stock_pool.csv，请先运行 selection.py")
-        return
+def process_features(with_fundamentals=USE_FUNDAMENTALS, use_universe=USE_UNIVERSE, workers=FEATURE_WORKERS):
+    # 1. 读取筛选后的股票池（时点股票池优先）
+    target_codes = universe_codes(use_universe)
+    if target_codes is None:
+        pool_path = os.path.join(PROCESSED_DIR, 'stock_pool.csv')
+        if not os.path.exists(pool_path):
+            print("错误：未找到 stock_pool.csv，请先运行 selection.py")
+            return
 
-    stock_pool = pd.read_csv(pool_path)
-    # 确保 code 是字符串
-    target_codes = stock_pool['code'].astype(str).tolist()
+        stock_pool = pd.read_csv(pool_path)
+        # 确保 code 是字符串
+        target_codes = stock_pool['code'].astype(str).tolist()
+    target_codes = data_quality.apply_policy(target_codes, DATA_QUALITY_POLICY)
     
     print(f"开始处理特征工程，目标股票数: {len(target_codes)}")
+
+    if workers > 1:
+        paths = build_feature_shards(target_codes, workers)
+        assemble_shards(paths, with_fundamentals, use_universe)
+        return
     
     all_data = []
+    errors = []
 
     # 2. 遍历每只股票
     for code in tqdm(target_codes, desc="构造特征"):
-        file_path = os.path.join(RAW_DATA_DIR, f"{code}.csv")
-        if not os.path.exists(file_path):
-            continue
-            
         try:
-            df = pd.read_csv(file_path)
-            
-            # 确保按时间排序
-            df = df.sort_values('date').reset_index(drop=True)
-            
-            # --- A. 基础清洗 ---
-            # 只要需要的列
-            cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'pctChg']
-            # 有时候 raw data 可能缺某些列，做个交集
-            cols = [c for c in cols if c in df.columns]
-            df = df[cols].copy()
-
-            # --- B. 构造特征 (Feature Engineering) ---
-            
-            # 1. 动量类 (Momentum)
-            df['roc_5'] = df['close'].pct_change(5)   # 5日涨跌幅
-            df['roc_10'] = df['close'].pct_change(10) # 10日涨跌幅
-            df['roc_20'] = df['close'].pct_change(20) # 20日涨跌幅
-            
-            # 2. 均线趋势 (MA Trend)
-            df['ma5'] = df['close'].rolling(5).mean()
-            df['ma10'] = df['close'].rolling(10).mean()
-            df['ma20'] = df['close'].rolling(20).mean()
-            # 均线乖离率 (Bias)
-            df['bias_20'] = (df['close'] - df['ma20']) / df['ma20']
-            
-            # 3. 情绪类 (Oscillators)
-            # RSI
-            df['rsi_6'] = cal_rsi(df['close'], 6)
-            df['rsi_12'] = cal_rsi(df['close'], 12)
-            df['rsi_gap'] = df['rsi_6'] - df['rsi_12'] # 短线情绪 - 长线情绪
-            
-            # MACD
-            df['dif'], df['dea'], df['macd_hist'] = cal_macd(df['close'])
-            
-            # KDJ
-            df['kdj_k'], df['kdj_d'], df['kdj_j'] = cal_kdj(df['high'], df['low'], df['close'])
-            
-            # 4. 波动率 (Volatility)
-            df['bb_width'], df['bb_zscore'] = cal_bollinger(df['close'])
-            
-            # 5. 量能 (Volume)
-            # 量比: 今日成交量 / 过去5日均量
-            df['vol_ma5'] = df['volume'].rolling(5).mean()
-            df['vol_ratio'] = df['volume'] / df['vol_ma5']
-            
-            # --- C. 构造标签 (Label Generation) ---
-            # 目标: 预测未来 5 个交易日后的收益率
-            # shift(-5) 表示把 5 天后的 close 移到现在这一行
-            HOLDING_PERIOD = 5
-            TARGET_PCT = 0.05 # 5%
-            
-            df['future_close'] = df['close'].shift(-HOLDING_PERIOD)
-            df['future_return'] = df['future_close'] / df['close'] - 1.0
-            
-            # Label = 1 如果未来涨幅 > 5%，否则 0
-            df['target'] = (df['future_return'] > TARGET_PCT).astype(int)
-            
-            # --- D. 数据清洗 (Drop NaNs) ---
-            # 1. 去除前面计算指标产生的 NaN (比如 MA20 导致前19天为空)
-            # 2. 去除后面因为 shift(-10) 产生的 NaN (最后10天没有未来数据)
-            df = df.dropna()
-            
-            # 添加 code 列用于区分
-            df['code'] = code
-            
-            # 瘦身：只保留 date, code, target 和 特征列
-            # 训练不需要 open/high/low/amount，除非你用它们做特征
-            # 这里保留 close 方便后续回测计算收益
-            feature_cols = [
-                'code', 'date', 'close', 
-                'roc_5', 'roc_10', 'roc_20',
-                'bias_20',
-                'rsi_6', 'rsi_12', 'rsi_gap',
-                'dif', 'dea', 'macd_hist',
-                'kdj_k', 'kdj_d', 'kdj_j',
-                'bb_width', 'bb_zscore',
-                'vol_ratio',
-                'target',  # <--- 这是我们要预测的
-                'future_return' # <--- ✅ 必须加上这一行！
-            ]
-            
-            all_data.append(df[feature_cols])
-            
+            df = build_code_features(code)
         except Exception as e:
-            # print(f"Error processing {code}: {e}")
+            errors.append((code, f"{type(e).__name__}: {e}"))
             continue
+        if df is not None:
+            all_data.append(df)
+
+    report_feature_errors(errors)
+    feature_cache.report(feature_cache.take_stats())
 
     # 3. 合并并保存
+    save_dataset(all_data, with_fundamentals, use_universe)
+
+def report_feature_errors(errors):
+    if errors:
+        print(f"⚠️ {len(errors)} 只股票特征计算失败（可运行 data_quality.scan_all() 排查），示例:")
+        for code, msg in errors[:5]:
+            print(f"   {code}: {msg}")
+
+def save_dataset(all_data, with_fundamentals=USE_FUNDAMENTALS, use_universe=USE_UNIVERSE):
+    """合并逐只特征表并写出 dataset_labeled.pkl（+ 前 1000 行 CSV 样例）；有时点股票池时只保留当日在池内的行。"""
     if all_data:
         print("正在合并数据集...")
         final_df = pd.concat(all_data, ignore_index=True)
-        
-        # 优化内存：转为 float32
-        float_cols = final_df.select_dtypes(include=['float64']).columns
-        final_df[float_cols] = final_df[float_cols].astype('float32')
-        
-        # 保存为 Pickle 格式 (比 CSV 快且保留类型)
-        output_path = os.path.join(PROCESSED_DIR, 'dataset_labeled.pkl')
-        final_df.to_pickle(output_path)
-        
-        # 另外存一份 CSV 方便你用 Excel 查看 (只存前 1000 行示例)
-        sample_path = os.path.join(PROCESSED_DIR, 'dataset_sample.csv')
-        final_df.head(1000).to_csv(sample_path, index=False)
-        
-        print("\n" + "="*30)
-        print(f"特征工程完成！")
-        print(f"总样本量: {len(final_df)} 行")
-        print(f"特征列: {len(feature_cols) - 3} 个") # 减去 code, date, target
-        print(f"正样本(上涨)比例: {final_df['target'].mean():.2%}")
-        print(f"数据已保存至: {output_path}")
-        print("="*30)
+
+        uni = universe.load_universe() if use_universe else None
+        if uni is not None:
+            in_pool = uni.is_member(final_df['code'].values, final_df['date'].values)
+            print(f"按时点股票池过滤: 保留 {in_pool.mean():.2%} 的样本")
+            final_df = final_df[in_pool].reset_index(drop=True)
+
+        _write_dataset(final_df, with_fundamentals)
     else:
         print("错误：未能生成任何数据，请检查原始数据。")
 
+def _write_dataset(final_df, with_fundamentals):
+    feature_cols = list(FEATURE_COLUMNS)
+
+    # 估值因子：整张面板一次 merge_asof，只取当日或之前最近的截面
+    if with_fundamentals:
+        final_df = fundamentals_store.asof_join(final_df)
+        feature_cols = feature_cols + fundamentals_store.FIELDS
+        print(f"已拼接估值因子 {fundamentals_store.FIELDS}，覆盖率: {final_df['PE'].notna().mean():.2%}")
+
+    # 截面标准化：按日期分段一次排序算完，不走 groupby('date').transform
+    if CROSS_SECTION_FEATURES:
+        final_df = cross_section.transform(final_df, CROSS_SECTION_FEATURES, CROSS_SECTION_METHODS)
+        cs_cols = cross_section.output_columns(CROSS_SECTION_FEATURES, CROSS_SECTION_METHODS)
+        feature_cols = feature_cols + cs_cols
+        print(f"已添加截面标准化特征 {len(cs_cols)} 列（{'/'.join(CROSS_SECTION_METHODS)}）")
+    
+    # 优化内存：转为 float32
+    float_cols = final_df.select_dtypes(include=['float64']).columns
+    if len(float_cols):
+        final_df[float_cols] = final_df[float_cols].astype('float32')
+    
+    # 保存为 Pickle 格式 (比 CSV 快且保留类型)
+    output_path = os.path.join(PROCESSED_DIR, 'dataset_labeled.pkl')
+    final_df.to_pickle(output_path)
+    
+    # 另外存一份 CSV 方便你用 Excel 查看 (只存前 1000 行示例)
+    sample_path = os.path.join(PROCESSED_DIR, 'dataset_sample.csv')
+    final_df.head(1000).to_csv(sample_path, index=False)
+    
+    print("\n" + "="*30)
+    print(f"特征工程完成！")
+    print(f"总样本量: {len(final_df)} 行")
+    print(f"特征列: {len(feature_cols) - 3} 个") # 减去 code, date, target
+    print(f"正样本(上涨)比例: {final_df['target'].mean():.2%}")
+    print(f"数据已保存至: {output_path}")
+    print("="*30)
+
+# ==========================================
+# 2. 并行分片模式
+# ==========================================
+
+def _shard_key(codes):
+    """分片名：代码列表 + 各自数据指纹 + 定义指纹的哈希；任一只数据更新或特征定义改动都会换一个新分片。"""
+    h = hashlib.sha1(definition_hash().encode())
+    for code in codes:
+        h.update(f"|{code}:{feature_cache.input_fingerprint(code)}".encode())
+    return h.hexdigest()[:20]
+
+def _build_shard(codes, path):
+    """worker：算一组股票的特征（逐只先查特征缓存），转 float32 后原子写出分片；返回 (出错列表, 缓存计数)。"""
+    frames, errors = [], []
+    for code in codes:
+        try:
+            df = build_code_features(code)
+        except Exception as e:
+            errors.append((code, f"{type(e).__name__}: {e}"))
+            continue
+        if df is not None:
+            frames.append(df)
+    shard = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=FEATURE_COLUMNS)
+    float_cols = shard.select_dtypes(include=['float64']).columns
+    shard[float_cols] = shard[float_cols].astype('float32')
+    tmp = path + '.tmp'
+    shard.to_pickle(tmp)
+    os.replace(tmp, path)  # 原子替换：崩溃时不会留下半个分片
+    return errors, feature_cache.take_stats()
+
+def build_feature_shards(codes, workers=FEATURE_WORKERS):
+    """按 SHARD_SIZE 分组并行计算，已存在的分片直接复用；返回按代码顺序排列的分片路径。"""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    raw_store.load_manifest()
+    groups = [codes[i:i + SHARD_SIZE] for i in range(0, len(codes), SHARD_SIZE)]
+    shards = [(group, os.path.join(SHARD_DIR, f"{_shard_key(group)}.pkl")) for group in groups]
+    todo = [(group, path) for group, path in shards if not os.path.exists(path)]
+    if len(todo) < len(shards):
+        print(f"续跑：{len(shards) - len(todo)}/{len(shards)} 个分片已完成，跳过。")
+
+    errors, stats = [], {}
+    if todo:
+        workers = max(1, min(int(workers), len(todo)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(),
+                                 initializer=raw_store.apply_config, initargs=(raw_store.get_config(),)) as pool:
+            futures = [pool.submit(_build_shard, group, path) for group, path in todo]
+            for fut in tqdm(as_completed(futures), total=len(futures), desc=f"构造特征(x{workers})"):
+                shard_errors, shard_stats = fut.result()
+                errors.extend(shard_errors)
+                feature_cache.merge_stats(stats, shard_stats)
+    report_feature_errors(errors)
+    feature_cache.report(stats)
+
+    # 本轮用不到的旧分片（数据已更新 / 股票池变化）清掉
+    keep = {os.path.basename(path) for _, path in shards}
+    for name in os.listdir(SHARD_DIR):
+        if name not in keep:
+            os.remove(os.path.join(SHARD_DIR, name))
+    return [path for _, path in shards]
+
+def assemble_shards(paths, with_fundamentals=USE_FUNDAMENTALS, use_universe=USE_UNIVERSE):
+    """
+    逐片拼装数据集：第一遍只算每片保留的行（时点股票池过滤），第二遍把浮点列直接写进预分配的
+    float32 二维块，内存峰值约为最终数据集加一个分片，而不是全部中间表 + concat 副本。
+    """
+    uni = universe.load_universe() if use_universe else None
+    keeps, n_all = [], 0
+    for path in paths:
+        shard = pd.read_pickle(path)
+        n_all += len(shard)
+        keeps.append(uni.is_member(shard['code'].values, shard['date'].values) if uni is not None
+                     else np.ones(len(shard), dtype=bool))
+    total = int(sum(k.sum() for k in keeps))
+    if total == 0:
+        print("错误：未能生成任何数据，请检查原始数据。")
+        return
+    if uni is not None:
+        print(f"按时点股票池过滤: 保留 {total / max(n_all, 1):.2%} 的样本")
+
+    print("正在逐片拼装数据集...")
+    other_cols = ['code', 'date', 'target']
+    float_cols = [c for c in FEATURE_COLUMNS if c not in other_cols]
+    block = np.empty((total, len(float_cols)), dtype=np.float32)
+    others = {c: [] for c in other_cols}
+    pos = 0
+    for path, keep in zip(paths, keeps):
+        shard = pd.read_pickle(path)[keep]
+        n = len(shard)
+        block[pos:pos + n] = shard[float_cols].to_numpy(dtype=np.float32)
+        for c in other_cols:
+            others[c].append(shard[c].to_numpy())
+        pos += n
+
+    final_df = pd.DataFrame(block, columns=float_cols, copy=False)
+    for c in other_cols:
+        final_df.insert(FEATURE_COLUMNS.index(c), c, np.concatenate(others[c]))
+    _write_dataset(final_df, with_fundamentals)
+
 if __name__ == "__main__":
     process_features()
\ No newline at end of file
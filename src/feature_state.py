@@ -0,0 +1,112 @@
+# src/feature_state.py
+"""
+增量特征：按代码持久化指标状态，周度 / 每日更新只对新增的 K 线计算指标。
+
+每只股票一个 data/processed/feature_state/{code}.pkl，包含：
+- features_lib 引擎的增量状态：EWM 节点（RSI 的 Wilder 平滑、MACD、KDJ 的 K / D）的累加器，
+  有限回看节点（MA20 / 布林带 / vol_ma5 / KDJ 高低点 / ROC）所需的末尾窗口；
+- 全部 K 线的未打标指标表（原始日线列 + 指标，指标存 float32）。
+增量结果与 features_lib 全量重算一致（滚动窗口求和顺序不同带来的 1e-15 级误差除外）。
+复权因子变化（前复权价整体改变）、历史 K 线被改写（末行对不上 / 行数对不上）、
+状态里没有所需的特征列、状态版本变化时自动全量重算。
+"""
+import os
+import sys
+import pandas as pd
+
+try:
+    from src import raw_store
+    from src import features_lib
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import features_lib
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+STATE_DIR = os.path.join(PROCESSED_DIR, 'feature_state')
+
+STATE_VERSION = 2  # 改动 features_lib 的特征定义时 +1，使旧状态失效
+BAR_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 'pctChg']
+
+
+# ==========================================
+# 按代码持久化
+# ==========================================
+def _state_path(code: str) -> str:
+    return os.path.join(STATE_DIR, f"{code}.pkl")
+
+
+def _to_frame(df: pd.DataFrame, columns) -> pd.DataFrame:
+    frame = df.reindex(columns=BAR_COLUMNS + list(columns)).reset_index(drop=True)
+    frame[columns] = frame[columns].astype('float32')
+    return frame
+
+
+def load_state(code: str):
+    path = _state_path(code)
+    if not os.path.exists(path):
+        return None
+    try:
+        saved = pd.read_pickle(path)
+    except Exception:
+        return None
+    return saved if saved.get('version') == STATE_VERSION else None
+
+
+def save_state(code: str, saved: dict) -> None:
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _state_path(code)
+    tmp = f"{path}.{os.getpid()}.tmp"  # 流水线里同一只可能被两个进程同时更新
+    pd.to_pickle(saved, tmp)
+    os.replace(tmp, path)
+
+
+def _new_bars(code: str, saved: dict, factor_hash: str, columns):
+    """状态仍可用时返回状态之后新增的 K 线（可能为空表）；需要全量重算返回 None。"""
+    if saved is None or saved['factor_hash'] != factor_hash or not set(columns) <= set(saved['state']['columns']):
+        return None
+    bars = raw_store.read_bars(code, columns=BAR_COLUMNS, start=saved['last_date'])
+    if bars.empty or bars['date'].iloc[0] != saved['last_date'] \
+            or float(bars['close'].iloc[0]) != saved['last_close']:
+        return None
+    new = bars.iloc[1:].reset_index(drop=True)
+    entry = raw_store.manifest_entry(code)
+    if entry is not None and int(entry['rows']) != saved['rows'] + len(new):
+        return None
+    return new
+
+
+def update_code(code: str, columns=None, persist: bool = True):
+    """
+    单只股票全部 K 线的未打标指标表（原始日线列 + columns，默认全部公开特征）；有可用状态时只计算新增的 K 线。
+    已有状态覆盖更多特征时沿用其全部特征列。本地没有数据返回 None。persist=True 时把新状态写回。
+    """
+    if not raw_store.has_code(code):
+        return None
+    columns = features_lib.public_features() if columns is None else list(columns)
+    factor_hash = raw_store.factor_checksum(code)
+    saved = load_state(code)
+    new = _new_bars(code, saved, factor_hash, columns)
+    if new is not None and new.empty:
+        return saved['frame']
+
+    if new is not None:
+        df, state = features_lib.extend(new, saved['state'])
+        frame = pd.concat([saved['frame'], _to_frame(df, state['columns'])], ignore_index=True)
+        rows = saved['rows'] + len(new)
+    else:
+        bars = raw_store.read_bars(code, columns=BAR_COLUMNS)
+        if bars.empty:
+            return None
+        df, state = features_lib.compute(bars, columns, return_state=True)
+        frame = _to_frame(df, columns)
+        rows = len(bars)
+
+    if persist:
+        save_state(code, {'version': STATE_VERSION, 'factor_hash': factor_hash, 'rows': rows,
+                          'last_date': frame['date'].iloc[-1], 'last_close': float(frame['close'].iloc[-1]),
+                          'state': state, 'frame': frame})
+    return frame
@@ -1,68 +1,350 @@
 # src/features_lib.py
-import pandas as pd
+"""
+公共特征库：声明式特征注册表 + 计算引擎，训练（feature_eng）和实盘（trader）只走这一套，防止口径不一致。
+
+- 每个特征用 @feature / ewm_feature 声明名称、输入（K 线列或其它特征）和直接回看的 K 线数，注册表构成一个 DAG；
+- compute(df, columns) 只计算 columns 依赖闭包内的节点（共享的差分 / 均线 / EWM 只算一次），
+  只把 columns 写进结果表，中间量不落表；
+- EWM 节点回看无界，单独声明平滑参数：增量模式（extend，feature_state 使用）为它们保存 pandas 同口径的累加器，
+  有限回看的节点在 “末尾窗口 + 新 K 线” 上重算，结果与全量一致。
+"""
+import hashlib
+import inspect
 import numpy as np
+import pandas as pd
+
+BAR_INPUTS = ('open', 'high', 'low', 'close', 'volume', 'amount', 'pctChg')
+RSI_PERIODS = (6, 12)
+
+
+# ==========================================
+# 1. 注册表
+# ==========================================
+class Feature:
+    """注册表节点：inputs 为 K 线列或其它节点名；lookback 为直接回看的 K 线数（EWM 节点为 None，无界）。"""
+
+    def __init__(self, name, inputs, fn=None, lookback=0, ewm=None, public=True):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.fn = fn
+        self.lookback = lookback
+        self.ewm = ewm
+        self.public = public
+
+
+REGISTRY = {}
+
+
+def _add(node: Feature) -> None:
+    if node.name in REGISTRY or node.name in BAR_INPUTS:
+        raise ValueError(f"特征重复注册: {node.name}")
+    missing = [i for i in node.inputs if i not in REGISTRY and i not in BAR_INPUTS]
+    if missing:
+        raise ValueError(f"特征 {node.name} 的输入未注册: {missing}")  # 只能引用已注册节点，DAG 天然无环
+    REGISTRY[node.name] = node
+
+
+def feature(name, inputs=('close',), lookback=0, public=True):
+    """装饰器：fn 按 inputs 顺序接收 Series，返回与之对齐的 Series。"""
+    def wrap(fn):
+        _add(Feature(name, inputs, fn=fn, lookback=lookback, public=public))
+        return fn
+    return wrap
+
+
+def ewm_feature(name, source, public=False, **ewm_kwargs):
+    """source.ewm(**ewm_kwargs).mean()；参数与 pandas 一致（com / span / alpha + adjust / min_periods）。"""
+    _add(Feature(name, (source,), lookback=None, ewm=ewm_kwargs, public=public))
+
+
+def public_features() -> list:
+    return [name for name, node in REGISTRY.items() if node.public]
+
+
+def registered(names) -> list:
+    """names 中由注册表计算的特征（去掉 K 线列、估值因子等）。"""
+    return [n for n in names if n in REGISTRY]
 
-def cal_rsi(series, periods=6): # 统一默认值
-    delta = series.diff()
-    up = delta.clip(lower=0)
-    down = -1 * delta.clip(upper=0)
-    ma_up = up.ewm(com=periods - 1, adjust=True, min_periods=periods).mean()
-    ma_down = down.ewm(com=periods - 1, adjust=True, min_periods=periods).mean()
+
+def resolve(columns) -> list:
+    """columns 的依赖闭包，按拓扑序（依赖在前）返回节点名。"""
+    order, seen = [], set()
+
+    def visit(name):
+        if name in seen or name in BAR_INPUTS:
+            return
+        if name not in REGISTRY:
+            raise KeyError(f"未注册的特征: {name}")
+        for dep in REGISTRY[name].inputs:
+            visit(dep)
+        seen.add(name)
+        order.append(name)
+
+    for name in columns:
+        visit(name)
+    return order
+
+
+def definition_hash(columns) -> str:
+    """
+    columns 依赖闭包的定义指纹：节点名、输入、回看、EWM 参数和函数源码，任一改动指纹即变化；
+    下游按定义缓存的结果（feature_cache）据此失效。
+    """
+    h = hashlib.sha1(repr(list(columns)).encode())
+    for name in resolve(columns):
+        node = REGISTRY[name]
+        h.update(repr((name, node.inputs, node.lookback, sorted((node.ewm or {}).items()))).encode())
+        if node.fn is not None:
+            try:
+                h.update(inspect.getsource(node.fn).encode())
+            except (OSError, TypeError):  # 交互式定义的函数没有源码，退回字节码
+                h.update(node.fn.__code__.co_code)
+    return h.hexdigest()
+
+
+# ==========================================
+# 2. 特征定义
+# ==========================================
+# --- 动量 ---
+@feature('roc_5', ['close'], lookback=5)
+def roc_5(close):
+    return close.pct_change(5)   # 5日涨跌幅
+
+@feature('roc_10', ['close'], lookback=10)
+def roc_10(close):
+    return close.pct_change(10)
+
+@feature('roc_20', ['close'], lookback=20)
+def roc_20(close):
+    return close.pct_change(20)
+
+# --- 均线 ---
+@feature('ma20', ['close'], lookback=19)
+def ma20(close):
+    return close.rolling(20).mean()
+
+@feature('bias_20', ['close', 'ma20'])
+def bias_20(close, ma):
+    return (close - ma) / ma   # 均线乖离率
+
+# --- RSI（Wilder 平滑，alpha = 1/n） ---
+@feature('delta', ['close'], lookback=1, public=False)
+def delta(close):
+    return close.diff()
+
+@feature('gain', ['delta'], public=False)
+def gain(d):
+    return d.clip(lower=0)
+
+@feature('loss', ['delta'], public=False)
+def loss(d):
+    return -1 * d.clip(upper=0)
+
+def _rsi(ma_up, ma_down):
     return ma_up / (ma_up + ma_down) * 100
 
-def cal_macd(close, fast=12, slow=26, signal=9):
-    ema_fast = close.ewm(span=fast, adjust=False).mean()
-    ema_slow = close.ewm(span=slow, adjust=False).mean()
-    dif = ema_fast - ema_slow
-    dea = dif.ewm(span=signal, adjust=False).mean()
-    macd_hist = (dif - dea)
-    return dif, dea, macd_hist
-
-def cal_kdj(high, low, close, n=9, m1=3, m2=3):
-    low_list = low.rolling(window=n, min_periods=1).min()
-    high_list = high.rolling(window=n, min_periods=1).max()
-    rsv = (close - low_list) / (high_list - low_list) * 100
-    rsv = rsv.fillna(0)
-    k = rsv.ewm(alpha=1/m1, adjust=False).mean()
-    d = k.ewm(alpha=1/m2, adjust=False).mean()
-    j = 3 * k - 2 * d
-    return k, d, j
-
-def cal_bollinger(close, window=20, num_std=2):
-    rolling_mean = close.rolling(window=window).mean()
-    rolling_std = close.rolling(window=window).std()
-    upper = rolling_mean + (rolling_std * num_std)
-    lower = rolling_mean - (rolling_std * num_std)
-    bw = (upper - lower) / rolling_mean
-    zscore = (close - rolling_mean) / rolling_std
-    return bw, zscore
+for _p in RSI_PERIODS:
+    ewm_feature(f'gain_ewm_{_p}', 'gain', com=_p - 1, adjust=True, min_periods=_p)
+    ewm_feature(f'loss_ewm_{_p}', 'loss', com=_p - 1, adjust=True, min_periods=_p)
+    feature(f'rsi_{_p}', [f'gain_ewm_{_p}', f'loss_ewm_{_p}'])(_rsi)
+del _p
+
+@feature('rsi_gap', ['rsi_6', 'rsi_12'])
+def rsi_gap(rsi_short, rsi_long):
+    return rsi_short - rsi_long   # 短线情绪 - 长线情绪
+
+# --- MACD ---
+ewm_feature('ema_12', 'close', span=12, adjust=False)
+ewm_feature('ema_26', 'close', span=26, adjust=False)
+
+@feature('dif', ['ema_12', 'ema_26'])
+def dif(fast, slow):
+    return fast - slow
+
+ewm_feature('dea', 'dif', public=True, span=9, adjust=False)
+
+@feature('macd_hist', ['dif', 'dea'])
+def macd_hist(d, signal):
+    return d - signal
+
+# --- KDJ（9 日 RSV，K / D 为 alpha=1/3 的递推） ---
+@feature('low_9', ['low'], lookback=8, public=False)
+def low_9(low):
+    return low.rolling(window=9, min_periods=1).min()
+
+@feature('high_9', ['high'], lookback=8, public=False)
+def high_9(high):
+    return high.rolling(window=9, min_periods=1).max()
+
+@feature('rsv', ['close', 'low_9', 'high_9'], public=False)
+def rsv(close, low_list, high_list):
+    return ((close - low_list) / (high_list - low_list) * 100).fillna(0)   # 除以 0 记 0
+
+ewm_feature('kdj_k', 'rsv', public=True, alpha=1 / 3, adjust=False)
+ewm_feature('kdj_d', 'kdj_k', public=True, alpha=1 / 3, adjust=False)
+
+@feature('kdj_j', ['kdj_k', 'kdj_d'])
+def kdj_j(k, d):
+    return 3 * k - 2 * d
+
+# --- 布林带 ---
+@feature('std20', ['close'], lookback=19, public=False)
+def std20(close):
+    return close.rolling(20).std()
+
+@feature('bb_width', ['ma20', 'std20'])
+def bb_width(ma, std):
+    upper = ma + (std * 2)
+    lower = ma - (std * 2)
+    return (upper - lower) / ma   # 布林带宽度，衡量波动率
+
+@feature('bb_zscore', ['close', 'ma20', 'std20'])
+def bb_zscore(close, ma, std):
+    return (close - ma) / std
+
+# --- 量能 ---
+@feature('vol_ma5', ['volume'], lookback=4)
+def vol_ma5(volume):
+    return volume.rolling(5).mean()
+
+@feature('vol_ratio', ['volume', 'vol_ma5'])
+def vol_ratio(volume, ma):
+    return volume / ma   # 量比: 今日成交量 / 过去5日均量
+
+
+# ==========================================
+# 3. 全量计算
+# ==========================================
+def evaluate(df, nodes) -> dict:
+    """按拓扑序计算 nodes；df 提供 K 线列（DataFrame，或 panel 的 {列: 二维数组}），返回 {节点: 结果}。"""
+    values = {}
+
+    def get(name):
+        return values[name] if name in values else df[name]
+
+    for name in nodes:
+        node = REGISTRY[name]
+        if node.ewm is not None:
+            values[name] = get(node.inputs[0]).ewm(**node.ewm).mean()
+        else:
+            values[name] = node.fn(*[get(i) for i in node.inputs])
+    return values
+
+
+def compute(df, columns=None, return_state=False):
+    """
+    在 K 线表上计算 columns（默认全部公开特征），返回 df 的副本 + 这些列；
+    return_state=True 时同时返回增量状态（见 extend）。
+    """
+    columns = public_features() if columns is None else list(columns)
+    nodes = resolve(columns)
+    values = evaluate(df, nodes)
+    out = df.copy()
+    for name in columns:
+        out[name] = values[name]
+    if return_state:
+        return out, _make_state(df, values, nodes, columns)
+    return out
+
 
 def compute_all_features(df):
     """
     统一的特征计算入口，训练和实盘只调用这一个函数！
     """
-    df = df.copy()
-    # 动量
-    df['roc_5'] = df['close'].pct_change(5)
-    df['roc_10'] = df['close'].pct_change(10)
-    df['roc_20'] = df['close'].pct_change(20)
-    
-    # 均线
-    df['ma20'] = df['close'].rolling(20).mean()
-    df['bias_20'] = (df['close'] - df['ma20']) / df['ma20']
-    
-    # 指标
-    df['rsi_6'] = cal_rsi(df['close'], 6)
-    df['rsi_12'] = cal_rsi(df['close'], 12)
-    df['rsi_gap'] = df['rsi_6'] - df['rsi_12']
-    
-    df['dif'], df['dea'], df['macd_hist'] = cal_macd(df['close'])
-    df['kdj_k'], df['kdj_d'], df['kdj_j'] = cal_kdj(df['high'], df['low'], df['close'])
-    
-    df['bb_width'], df['bb_zscore'] = cal_bollinger(df['close'])
-    
-    # 量能
-    df['vol_ma5'] = df['volume'].rolling(5).mean()
-    df['vol_ratio'] = df['volume'] / df['vol_ma5']
-    
-    return df
\ No newline at end of file
+    return compute(df)
+
+
+# ==========================================
+# 4. 增量计算
+# ==========================================
+def ewm_alpha(com=None, span=None, alpha=None, **_):
+    """与 pandas 相同的换算路径（先换成质心 com，再 alpha = 1/(1+com)），保证逐位一致。"""
+    if span is not None:
+        com = (span - 1) / 2
+    elif alpha is not None:
+        com = (1 - alpha) / alpha
+    return 1.0 / (1.0 + float(com))
+
+
+def _ewm_step(acc, values, spec):
+    """
+    ignore_na=False 的 EWM 均值递推，与 pandas 实现逐步一致。
+    acc = (加权均值, 累计旧权重, 观测数)；返回 (输出数组, 新的 acc)。
+    """
+    weighted, old_wt, nobs = acc
+    alpha = ewm_alpha(**spec)
+    adjust = spec.get('adjust', True)
+    minp = max(spec.get('min_periods', 0) or 0, 1)
+    factor, new_wt = 1.0 - alpha, (1.0 if adjust else alpha)
+    out = np.empty(len(values))
+    for i, cur in enumerate(values):
+        is_obs = cur == cur
+        nobs += int(is_obs)
+        if weighted == weighted:
+            old_wt *= factor  # 缺失值同样衰减
+            if is_obs:
+                if weighted != cur:
+                    weighted = old_wt * weighted + new_wt * cur
+                    weighted /= (old_wt + new_wt)
+                old_wt = old_wt + new_wt if adjust else 1.0
+        elif is_obs:
+            weighted = cur
+        out[i] = weighted if nobs >= minp else np.nan
+    return out, (weighted, old_wt, nobs)
+
+
+def _ewm_acc(source: pd.Series, output: pd.Series, spec: dict) -> tuple:
+    """从全量结果反推 _ewm_step 的累加器。"""
+    x = source.to_numpy(dtype=float)
+    obs = np.flatnonzero(~np.isnan(x))
+    if len(obs) == 0:
+        return (np.nan, 1.0, 0)
+    weighted = float(output.iloc[-1])
+    if weighted != weighted:  # 观测数不足 min_periods，输出被遮掉了
+        kwargs = {k: v for k, v in spec.items() if k != 'min_periods'}
+        weighted = float(source.ewm(**kwargs).mean().iloc[-1])
+    factor, last = 1.0 - ewm_alpha(**spec), len(x) - 1
+    if spec.get('adjust', True):
+        old_wt = float(np.sum(factor ** (last - obs)))
+    else:
+        old_wt = float(factor ** (last - obs[-1]))
+    return (weighted, old_wt, int(len(obs)))
+
+
+def _make_state(df, values, nodes, columns) -> dict:
+    """末尾窗口（所有输入列与节点的最后 tail 行）+ EWM 累加器。"""
+    tail = max([REGISTRY[n].lookback for n in nodes if REGISTRY[n].lookback is not None] + [1])
+    inputs = sorted({i for n in nodes for i in REGISTRY[n].inputs if i in BAR_INPUTS})
+    series = {name: df[name] for name in inputs}
+    series.update(values)
+    ewm = {name: _ewm_acc(series[REGISTRY[name].inputs[0]], values[name], REGISTRY[name].ewm)
+           for name in nodes if REGISTRY[name].ewm is not None}
+    tail_frame = pd.DataFrame({k: v.to_numpy(dtype=float) for k, v in series.items()}).tail(tail)
+    return {'columns': list(columns), 'nodes': nodes, 'inputs': inputs, 'tail_len': tail,
+            'tail': tail_frame.reset_index(drop=True), 'ewm': ewm}
+
+
+def extend(new_bars, state):
+    """
+    接着 state 只对 new_bars（状态末尾之后的 K 线）计算特征；返回 (new_bars 副本 + state 的特征列, 新状态)。
+    有限回看节点在 “末尾窗口 + 新 K 线” 上重算后只取新行，EWM 节点从累加器接着递推。
+    """
+    tail = state['tail']
+    n_tail = len(tail)
+    ext = {name: pd.Series(np.r_[tail[name].to_numpy(), new_bars[name].to_numpy(dtype=float)])
+           for name in state['inputs']}
+    ewm = dict(state['ewm'])
+    for name in state['nodes']:
+        node = REGISTRY[name]
+        if node.ewm is not None:
+            new_values, ewm[name] = _ewm_step(ewm[name], ext[node.inputs[0]].to_numpy()[n_tail:], node.ewm)
+        else:
+            new_values = node.fn(*[ext[i] for i in node.inputs]).to_numpy(dtype=float)[n_tail:]
+        ext[name] = pd.Series(np.r_[tail[name].to_numpy(), new_values])
+
+    out = new_bars.reset_index(drop=True).copy()
+    for name in state['columns']:
+        out[name] = ext[name].to_numpy()[n_tail:]
+    tail_frame = pd.DataFrame({k: v.to_numpy() for k, v in ext.items()}).tail(state['tail_len'])
+    new_state = dict(state, tail=tail_frame.reset_index(drop=True), ewm=ewm)
+    return out, new_state
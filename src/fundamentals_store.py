@@ -0,0 +1,118 @@
+# src/fundamentals_store.py
+"""
+时点基本面存储（data/raw_fundamental/{year}/{YYYY-MM-DD}.csv）。
+
+- 每次截面（PE / PB / 总市值）按其所属交易日写成一个日期分区，同一天重复抓取会覆盖，历史不再丢失；
+- asof_join 把基本面一次性 merge_asof 到 (code, date) 面板上：每行只取当日或之前最近一次截面，
+  不会用到未来数据；超过 MAX_STALENESS_DAYS 没有新截面的视为缺失。
+"""
+import os
+import sys
+import glob
+import datetime
+import numpy as np
+import pandas as pd
+
+try:
+    from src import trade_calendar
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import trade_calendar
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+FUNDAMENTAL_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw_fundamental')
+
+FIELDS = ['PE', 'PB', 'TotalMarketCap']
+MARKET_OPEN_TIME = datetime.time(9, 30)   # 开盘前抓到的截面仍是上一交易日收盘口径
+MAX_STALENESS_DAYS = 30                   # as-of 匹配允许的最大间隔（自然日）
+
+_CACHE = {'key': None, 'df': None}
+
+
+def _partition_path(date) -> str:
+    d = pd.Timestamp(date)
+    return os.path.join(FUNDAMENTAL_DATA_DIR, str(d.year), f"{d.strftime('%Y-%m-%d')}.csv")
+
+
+def snapshot_trade_date(now=None) -> pd.Timestamp:
+    """
+    截面所属交易日：非交易日抓到的是上一交易日收盘数据；交易日开盘前同理；
+    盘中 / 收盘后归属当天（盘中价格在当天收盘前已知，不构成未来数据）。
+    """
+    now = now or datetime.datetime.now()
+    day = trade_calendar.latest_trading_day(now.date())
+    if day.date() == now.date() and now.time() < MARKET_OPEN_TIME:
+        day = trade_calendar.shift_trading_days(day, -1)
+    return day
+
+
+def append_snapshot(df: pd.DataFrame, date=None) -> str:
+    """把一次截面（code + FIELDS）写入对应日期分区（原子替换），返回分区路径。"""
+    date = pd.Timestamp(date) if date is not None else snapshot_trade_date()
+    out = df[['code'] + FIELDS].drop_duplicates('code', keep='last').sort_values('code').copy()
+    out.insert(1, 'date', date.strftime('%Y-%m-%d'))
+    path = _partition_path(date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    out.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    return path
+
+
+def list_snapshot_dates() -> list:
+    paths = glob.glob(os.path.join(FUNDAMENTAL_DATA_DIR, '[0-9][0-9][0-9][0-9]', '*.csv'))
+    return sorted(pd.Timestamp(os.path.basename(p)[:-4]) for p in paths)
+
+
+def load_fundamentals(start=None, end=None, fields=None) -> pd.DataFrame:
+    """读取 [start, end] 内全部分区，返回长表 (code, date, fields...)，按文件列表 + mtime 做进程内缓存。"""
+    fields = list(fields or FIELDS)
+    paths = sorted(glob.glob(os.path.join(FUNDAMENTAL_DATA_DIR, '[0-9][0-9][0-9][0-9]', '*.csv')))
+    key = tuple((p, os.path.getmtime(p)) for p in paths)
+    if _CACHE['key'] != key:
+        frames = [pd.read_csv(p, dtype={'code': str}) for p in paths]
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['code', 'date'] + FIELDS)
+        df['date'] = pd.to_datetime(df['date'])
+        _CACHE.update(key=key, df=df)
+    df = _CACHE['df']
+    if start is not None:
+        df = df[df['date'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['date'] <= pd.Timestamp(end)]
+    return df[['code', 'date'] + fields]
+
+
+def asof_join(panel: pd.DataFrame, fields=None, fund: pd.DataFrame = None,
+              max_staleness_days: int = MAX_STALENESS_DAYS) -> pd.DataFrame:
+    """
+    向量化 as-of 连接：为 panel 的每个 (code, date) 行附加当日或之前最近一次截面的 fields。
+    一次 merge_asof 完成，返回与 panel 同序、同索引的新 DataFrame。
+    fund 可传入预先 load_fundamentals 的结果，避免重复读盘。
+    """
+    fields = list(fields or FIELDS)
+    if fund is None:
+        fund = load_fundamentals(end=pd.to_datetime(panel['date']).max(), fields=fields)
+    out = panel.drop(columns=[c for c in fields if c in panel.columns])
+    if fund.empty:
+        return out.assign(**{c: np.nan for c in fields})
+
+    left = pd.DataFrame({'code': out['code'].astype(str).values,
+                         'date': pd.to_datetime(out['date']).values.astype('datetime64[ns]'),
+                         '_row': np.arange(len(out))})
+    right = fund[['code', 'date'] + fields].copy()
+    right['code'] = right['code'].astype(str)
+    right['date'] = right['date'].values.astype('datetime64[ns]')
+    merged = pd.merge_asof(left.sort_values('date', kind='stable'), right.sort_values('date', kind='stable'),
+                           on='date', by='code', direction='backward',
+                           tolerance=pd.Timedelta(days=max_staleness_days))
+    merged = merged.sort_values('_row')
+    for col in fields:
+        out[col] = merged[col].values.astype('float32')
+    return out
+
+
+if __name__ == "__main__":
+    dates = list_snapshot_dates()
+    print(f"基本面截面: {len(dates)} 个分区" + (f"（{dates[0].date()} ~ {dates[-1].date()}）" if dates else ""))
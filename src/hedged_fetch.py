@@ -0,0 +1,237 @@
+# src/hedged_fetch.py
+"""
+对冲拉取层：给 data_loader 的逐只下载加上硬超时与多源对冲。
+
+- baostock 会话是进程级全局 socket，所有 baostock 调用都提交到本进程唯一的一个线程里串行执行；
+  超时被放弃的请求仍在该线程上跑完，后续请求排在它后面，不会与之交错读同一个 socket；
+- hedged_history：先发 baostock；超过其历史延迟的 HEDGE_PERCENTILE 分位仍未返回（或 baostock 线程
+  正被上一只的慢请求占着、或直接报错）时，再向 akshare（stock_zh_a_hist，不复权）发一份对冲请求，
+  先返回者胜出；
+- 每只股票有硬截止时间（CODE_DEADLINE），到点仍无结果抛 DeadlineExceeded，由调用方记为失败；
+- LatencyTracker 按数据源记录每次拉取耗时，summary() 给出 p50 / p95 / p99。
+"""
+import os
+import sys
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+
+# --- 对冲配置 ---
+ENABLE_HEDGE = True
+CODE_DEADLINE = 60.0          # 单只股票（行情 + 因子）的硬超时（秒）
+HEDGE_PERCENTILE = 95         # baostock 超过自身该分位延迟仍未返回才对冲
+HEDGE_MIN_DELAY = 1.0         # 对冲等待下限，避免样本偏快时过度对冲
+HEDGE_DEFAULT_DELAY = 5.0     # 样本不足 HEDGE_MIN_SAMPLES 时的等待时长
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 2000         # 每个数据源保留的最近样本数
+
+SOURCES = ('baostock', 'akshare')
+
+
+class DeadlineExceeded(TimeoutError):
+    """单只股票在截止时间内没有拿到任何数据源的结果。"""
+
+
+# ==========================================
+# 1. 延迟统计
+# ==========================================
+class LatencyTracker:
+    """按数据源记录拉取耗时（秒）：滚动窗口用于分位数，另存一份“新样本”供子进程回传主进程。"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = {s: deque(maxlen=window) for s in SOURCES}
+        self._new = []
+
+    def record(self, source: str, seconds: float) -> None:
+        with self._lock:
+            self._window.setdefault(source, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+            self._new.append((source, seconds))
+
+    def merge(self, samples) -> None:
+        """并入其他进程回传的样本（只进滚动窗口）。"""
+        with self._lock:
+            for source, seconds in samples:
+                self._window.setdefault(source, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def take_new(self) -> list:
+        with self._lock:
+            out, self._new = self._new, []
+        return out
+
+    def count(self, source: str) -> int:
+        return len(self._window.get(source, ()))
+
+    def percentile(self, source: str, q: float):
+        with self._lock:
+            values = list(self._window.get(source, ()))
+        return float(np.percentile(values, q)) if values else None
+
+    def summary(self) -> dict:
+        """{source: {'n', 'p50', 'p95', 'p99'}}，只含有样本的数据源。"""
+        with self._lock:
+            snap = {s: np.asarray(v, dtype=float) for s, v in self._window.items() if len(v)}
+        return {s: {'n': int(len(v)), 'p50': float(np.percentile(v, 50)),
+                    'p95': float(np.percentile(v, 95)), 'p99': float(np.percentile(v, 99))}
+                for s, v in snap.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            for v in self._window.values():
+                v.clear()
+            self._new = []
+
+
+TRACKER = LatencyTracker()
+
+
+def format_summary(summary: dict) -> str:
+    if not summary:
+        return "无样本"
+    return " | ".join(f"{s}: n={v['n']} p50={v['p50']:.2f}s p95={v['p95']:.2f}s p99={v['p99']:.2f}s"
+                      for s, v in summary.items())
+
+
+# ==========================================
+# 2. 执行线程（按进程惰性创建，fork 出来的 worker 各自重建）
+# ==========================================
+_POOLS = {'pid': None, 'baostock': None, 'akshare': None, 'bs_last': None}
+_POOLS_LOCK = threading.Lock()
+
+
+def _pool(source: str) -> ThreadPoolExecutor:
+    with _POOLS_LOCK:
+        if _POOLS['pid'] != os.getpid():
+            _POOLS.update(pid=os.getpid(), bs_last=None,
+                          baostock=ThreadPoolExecutor(max_workers=1, thread_name_prefix='bs-fetch'),
+                          akshare=ThreadPoolExecutor(max_workers=2, thread_name_prefix='ak-hedge'))
+        return _POOLS[source]
+
+
+def _baostock_busy() -> bool:
+    """上一只的 baostock 请求（可能已被放弃）是否还占着会话线程。"""
+    last = _POOLS['bs_last'] if _POOLS['pid'] == os.getpid() else None
+    return last is not None and not last.done()
+
+
+def _timed(source: str, fn):
+    t0 = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        TRACKER.record(source, time.perf_counter() - t0)
+
+
+def _submit(source: str, fn):
+    fut = _pool(source).submit(_timed, source, fn)
+    if source == 'baostock':
+        _POOLS['bs_last'] = fut
+    return fut
+
+
+def hedge_delay() -> float:
+    """对冲触发时长：baostock 历史延迟的 HEDGE_PERCENTILE 分位（样本不足用默认值），不低于下限。"""
+    if TRACKER.count('baostock') < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, TRACKER.percentile('baostock', HEDGE_PERCENTILE))
+
+
+def call_baostock(fn, deadline_at: float):
+    """在 baostock 会话线程上执行 fn，最多等到 deadline_at（perf_counter 时刻）。"""
+    fut = _submit('baostock', fn)
+    done, _ = wait([fut], timeout=max(0.0, deadline_at - time.perf_counter()))
+    if not done:
+        raise DeadlineExceeded("baostock 请求超过截止时间")
+    return fut.result()
+
+
+# ==========================================
+# 3. akshare 对冲源
+# ==========================================
+def fetch_akshare_history(code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """stock_zh_a_hist 不复权日线 -> 与 data_loader._fetch_history 相同的列（含 preclose）。"""
+    try:
+        from src import data_loader_akshare
+    except ImportError:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from src import data_loader_akshare
+    df_kline = data_loader_akshare.safe_request(
+        data_loader_akshare.ak.stock_zh_a_hist,
+        max_retries=2,
+        symbol=code.split('.')[-1],
+        period="daily",
+        start_date=pd.to_datetime(start_date).strftime('%Y%m%d'),
+        end_date=pd.to_datetime(end_date).strftime('%Y%m%d'),
+        adjust="",
+    )
+    if df_kline is None:
+        raise RuntimeError(f"akshare 拉取失败: {code}")
+    if df_kline.empty:
+        return pd.DataFrame()
+    bars = data_loader_akshare.hist_to_bars(df_kline, code)
+    bars['preclose'] = (pd.to_numeric(df_kline['收盘'], errors='coerce')
+                        - pd.to_numeric(df_kline['涨跌额'], errors='coerce')).values
+    bars['date'] = pd.to_datetime(bars['date'])
+    return bars.reset_index(drop=True)
+
+
+def _akshare_available() -> bool:
+    try:
+        import akshare  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# ==========================================
+# 4. 对冲拉取
+# ==========================================
+def hedged_history(primary, code: str, start_date: str, end_date: str, deadline_at: float,
+                   hedge: bool = ENABLE_HEDGE, stats: dict | None = None) -> pd.DataFrame:
+    """
+    primary 为 baostock 拉取函数（无参，返回 DataFrame）。返回最先成功的结果；
+    对冲源返回空表而 baostock 仍在途时继续等 baostock（空表可能只是该源没有数据）。
+    stats 累加 'hedged'（发出对冲次数）与 'hedge_wins'（对冲源胜出次数）。
+    """
+    hedge = hedge and _akshare_available()
+    # 会话线程还被上一只的慢请求占着：本次 baostock 要排队，直接对冲
+    busy = _baostock_busy()
+    pending = {_submit('baostock', primary): 'baostock'}
+    hedge_at = time.perf_counter() + (0.0 if busy else hedge_delay())
+    hedged, fallback, last_exc = False, None, None
+
+    while pending:
+        now = time.perf_counter()
+        if now >= deadline_at:
+            break
+        wake = deadline_at if (hedged or not hedge) else min(hedge_at, deadline_at)
+        done, _ = wait(list(pending), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+        for fut in done:
+            source = pending.pop(fut)
+            try:
+                df = fut.result()
+            except Exception as e:
+                last_exc = e
+                hedge_at = time.perf_counter()  # 主源报错：立即对冲
+                continue
+            if source == 'akshare' and df.empty and pending:
+                fallback = df
+                continue
+            if source == 'akshare' and stats is not None:
+                stats['hedge_wins'] = stats.get('hedge_wins', 0) + 1
+            return df
+        if hedge and not hedged and time.perf_counter() >= hedge_at:
+            hedged = True
+            if stats is not None:
+                stats['hedged'] = stats.get('hedged', 0) + 1
+            pending[_submit('akshare', lambda: fetch_akshare_history(code, start_date, end_date))] = 'akshare'
+
+    if fallback is not None:
+        return fallback
+    if last_exc is not None and not pending:
+        raise last_exc
+    raise DeadlineExceeded(f"{code} 超过 {CODE_DEADLINE:.0f}s 截止时间")
+
@@ -1,8 +1,14 @@
-import baostock as bs
 import pandas as pd
 import numpy as np
 import os
-import datetime
+import sys
+
+# --- 引入数据加载层（基准指数本地缓存） ---
+try:
+    from src import data_loader
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import data_loader
 
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -10,54 +16,21 @@ PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
 RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
 PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
 
+BENCHMARK_CODE = "sh.000905"  # 中证500
+
 # ==========================================
 # 1. 下载基准指数数据 (Benchmark)
 # ==========================================
 def download_benchmark_index(start_date="2014-01-01"): 
     """
-    下载中证500指数 (sh.000905) 作为基准
+    中证500指数 (sh.000905) 作为基准：本地缓存先增量更新（只拉缺的几天），返回 [date, close]。
     """
-    index_file = os.path.join(RAW_DATA_DIR, 'benchmark_sh000905.csv')
-    
-    # 强制重新下载：为了防止旧的时间不对的文件干扰，这里先尝试删除旧文件
-    if os.path.exists(index_file):
-        try:
-            # 读取旧文件检查一下日期，或者直接删了重下比较稳妥
-            os.remove(index_file)
-            print(f"已删除旧的指数文件，准备重新下载: {index_file}")
-        except Exception:
-            pass
-
-    print(f"正在下载中证500指数数据 ({start_date} 至今)...")
-    
-    # 登陆 Baostock
-    lg = bs.login()
-    if lg.error_code != '0':
-        print(f"Baostock 登陆失败: {lg.error_msg}")
-        return None
-    
-    end_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    
-    # 获取指数数据
-    rs = bs.query_history_k_data_plus("sh.000905",
-        "date,close",
-        start_date=start_date, end_date=end_date, frequency="d")
-    
-    data_list = []
-    while (rs.error_code == '0') & rs.next():
-        data_list.append(rs.get_row_data())
-        
-    bs.logout()
-    
-    if data_list:
-        df_index = pd.DataFrame(data_list, columns=['date', 'close'])
-        df_index['close'] = df_index['close'].astype(float)
-        # 保存下来
-        df_index.to_csv(index_file, index=False)
-        print("基准指数下载完成。")
-        return df_index
-    else:
+    df_index = data_loader.load_benchmark(BENCHMARK_CODE, start_date=start_date)
+    if df_index is None or df_index.empty:
         raise ValueError("无法下载指数数据，请检查网络！")
+    df_index = df_index[['date', 'close']].copy()
+    df_index['date'] = df_index['date'].dt.strftime('%Y-%m-%d')
+    return df_index
 
 # ==========================================
 # 2. 核心逻辑：重新打标签 (Relabeling)
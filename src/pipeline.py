@@ -0,0 +1,353 @@
+# src/pipeline.py
+"""
+流水线模式的周度任务：下载与「数据质量 → 特征 → 打分」重叠执行，收盘到出清单的耗时接近单纯下载耗时。
+
+- 下载线程（网络密集）调用 data_loader.download_all_stock_history，按流动性从高到低逐只更新，
+  每完成一只放入有界队列（DONE_QUEUE_SIZE）；
+- 主线程从队列取代码交给 CPU 进程池（CPU_WORKERS 个进程）：每只先做数据质量检查，
+  训练集覆盖的代码（时点股票池曾入选的，或股票池）构造训练特征（feature_eng.build_code_features），
+  股票池内的再取最新一行（trader.candidate_row），收尾时整张快照截面标准化后一次批量打分（trader.score_snapshot）；
+  在途任务不超过 MAX_INFLIGHT，进程池跟不上时队列写满，反压到下载结果回调；
+- 下载前按当前 manifest 取一个临时股票池（不卡近期交易、多留 POOL_MARGIN 余量），边下边算；
+  下载结束后照常 selection.filter_stock_pool() 定出正式股票池，只补算新进池的少数代码；
+- 证券主数据 / 指数在下载前刷新；收尾一次性写出数据质量报告、修复 error 代码并补算，
+  再写 dataset_labeled.pkl（+ 相对标签）与 buy_list，最后重建时点股票池（universe.npz）。
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import multiprocessing as mp
+import pandas as pd
+
+try:
+    from src import raw_store
+    from src import data_loader
+    from src import data_quality
+    from src import selection
+    from src import feature_eng
+    from src import label_maker
+    from src import trader
+    from src import security_master
+    from src import universe
+    from src import feature_cache
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import data_loader
+    from src import data_quality
+    from src import selection
+    from src import feature_eng
+    from src import label_maker
+    from src import trader
+    from src import security_master
+    from src import universe
+    from src import feature_cache
+
+# --- 流水线配置 ---
+CPU_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # 留一个核给下载进程的解析与主线程调度
+DONE_QUEUE_SIZE = 64        # 下载完成 -> 计算 之间的队列长度
+MAX_INFLIGHT = 16           # 提交给 CPU 进程池、尚未返回的代码数上限
+DATA_QUALITY_POLICY = "skip"  # error 代码：ignore / skip / repair（先本地修复，仍有错误的跳过）
+POOL_MARGIN = 1.2           # 临时股票池相对正式池的余量（覆盖下载后流动性排名的小幅变动）
+# 下载进程池在下载线程里创建，此时已有其他线程，不能直接 fork
+DOWNLOAD_START_METHOD = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+STOP_POLL = 0.5             # 队列存取超时（秒），期间检查停止标记
+
+_END = object()
+_STATE = {'scanner': None}
+
+
+# ==========================================
+# 1. CPU 阶段（进程池 worker）
+# ==========================================
+def _cpu_init(store_config: dict, scanner_ctx) -> None:
+    data_quality.init_checker(store_config)
+    _STATE['scanner'] = scanner_ctx
+
+
+def _process_code(args) -> dict:
+    """单只：数据质量检查；按需再算训练特征 / 实盘候选行（打分在收尾时整张快照批量做）。各步出错记入 errors，不中断其他步。"""
+    code, want_features, want_score = args
+    out = {'code': code, 'want_features': want_features, 'want_score': want_score, 'quality': None,
+           'features': None, 'pick': None, 'skipped': False, 'errors': [], 'cache': {}}
+    if not raw_store.has_code(code):
+        return out
+    rec = data_quality.check_code_safe(code)
+    if rec['severity'] == 'error' and DATA_QUALITY_POLICY == 'repair' and rec['repair'] == 'local':
+        if data_quality.repair_local(code):
+            rec = data_quality.check_code_safe(code)
+    out['quality'] = rec
+    if not (want_features or want_score):
+        return out
+    if rec['severity'] == 'error' and DATA_QUALITY_POLICY != 'ignore':
+        out['skipped'] = True
+        return out
+
+    if want_features:
+        try:
+            out['features'] = feature_eng.build_code_features(code)
+        except Exception as e:
+            out['errors'].append(('features', f"{type(e).__name__}: {e}"))
+        out['cache'] = feature_cache.take_stats()
+    if want_score and _STATE['scanner'] is not None:
+        try:
+            out['pick'] = trader.candidate_row(code, _STATE['scanner'])
+        except Exception as e:
+            out['errors'].append(('scan', f"{type(e).__name__}: {e}"))
+    return out
+
+
+# ==========================================
+# 2. 调度
+# ==========================================
+def _provisional_pool() -> list:
+    """下载前的临时股票池：同 selection 的门槛但不卡近期交易（本地数据可能还没更新），多取 POOL_MARGIN。"""
+    manifest = raw_store.load_manifest().reset_index()
+    if manifest.empty:
+        return []
+    criteria = dict(selection.CRITERIA, active_days=None)
+    ranked = selection.screen_manifest(manifest, criteria)
+    return ranked['code'].head(int(criteria['target_pool_size'] * POOL_MARGIN)).tolist()
+
+
+def _final_pool() -> list:
+    """下载结束后的正式股票池（写出 stock_pool.csv）。"""
+    selection.filter_stock_pool()
+    pool_path = os.path.join(selection.PROCESSED_DIR, 'stock_pool.csv')
+    if not os.path.exists(pool_path):
+        return []
+    return pd.read_csv(pool_path)['code'].astype(str).tolist()
+
+
+def _merge_result(old: dict, new: dict) -> dict:
+    """同一代码分两次提交（先只查质量 / 只算特征，正式股票池定下后补算）时合并结果。"""
+    out = dict(old, errors=old['errors'] + new['errors'], skipped=old['skipped'] or new['skipped'])
+    if new['quality'] is not None:
+        out['quality'] = new['quality']
+    if new['want_features']:
+        out.update(want_features=True, features=new['features'])
+    if new['want_score']:
+        out.update(want_score=True, pick=new['pick'])
+    return out
+
+
+class _Stopped(Exception):
+    """主线程已停止消费队列（出错 / Ctrl-C），下载线程借此中止下载。"""
+
+
+def _download_stage(done_q: queue.Queue, result: dict, stop: threading.Event, **kwargs) -> None:
+    """下载线程：每完成一只入队；无论成败最后放入结束标记。stop 置位后不再等待队列空位，中止下载。"""
+    def _put(item):
+        # 带超时入队：主线程不再取队列时不会永远卡在满队列上
+        while not stop.is_set():
+            try:
+                done_q.put(item, timeout=STOP_POLL)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    try:
+        result['download'] = data_loader.download_all_stock_history(
+            on_code_done=lambda code, ok: _put((code, ok)), **kwargs)
+    except _Stopped:
+        pass
+    except Exception as e:
+        result['download_error'] = e
+    finally:
+        try:
+            _put(_END)
+        except _Stopped:
+            pass
+
+
+def _run_stages(provisional: list, train_codes, scanner_ctx, cpu_workers: int, download_kwargs: dict) -> dict:
+    """
+    下载线程 + 有界队列 + CPU 进程池。train_codes 为训练集代码（None 表示跟随股票池）。
+    下载结束后定出正式股票池，补算新进池的代码。
+    返回 {'results', 'pool', 'train_codes', 'download', 'download_elapsed', 'download_done_at'}。
+    """
+    score_set = set(provisional)
+    feature_set = set(provisional if train_codes is None else train_codes)
+    done_q = queue.Queue(maxsize=DONE_QUEUE_SIZE)
+    slots = threading.BoundedSemaphore(MAX_INFLIGHT)
+    results, lock = [], threading.Lock()
+    state = {}
+
+    def _collect(res):
+        with lock:
+            results.append(res)
+        slots.release()
+
+    def _failed(exc):
+        # _process_code 自身已兜底，这里只会是进程级异常（如结果无法回传）；单进程模式下也记在这里，不中断整轮
+        print(f"⚠️ 计算进程异常: {type(exc).__name__}: {exc}")
+        slots.release()
+
+    # 主进程也初始化一份（单进程模式与收尾补算用）；CPU 进程池先于下载线程创建，worker 在单线程状态下 fork。
+    # 下载进程池由下载线程创建（那时主线程仍在运行），按 DOWNLOAD_START_METHOD 启动，不走 fork
+    _cpu_init(raw_store.get_config(), scanner_ctx)
+    workers = mp.Pool(processes=cpu_workers, initializer=_cpu_init,
+                      initargs=(raw_store.get_config(), scanner_ctx)) if cpu_workers > 1 else None
+
+    def _submit(code, want_features, want_score):
+        slots.acquire()
+        args = (code, want_features, want_score)
+        if workers is None:
+            try:
+                res = _process_code(args)
+            except Exception as e:
+                _failed(e)
+            else:
+                _collect(res)
+        else:
+            workers.apply_async(_process_code, (args,), callback=_collect, error_callback=_failed)
+
+    t0 = time.perf_counter()
+    stop = threading.Event()
+    downloader = threading.Thread(target=_download_stage, args=(done_q, state, stop), kwargs=download_kwargs,
+                                  name='pipeline-download', daemon=True)
+    downloader.start()
+    seen, featured, scored = set(), set(), set()
+    item = None
+    try:
+        while True:
+            item = done_q.get()
+            if item is _END:
+                break
+            code, _ = item
+            if code not in seen:
+                seen.add(code)
+                _submit(code, code in feature_set, code in score_set)
+                if code in feature_set:
+                    featured.add(code)
+                if code in score_set:
+                    scored.add(code)
+        state['download_done_at'] = time.perf_counter()
+        state['download_elapsed'] = state['download_done_at'] - t0
+        # 正式股票池：临时池之外新进池的、或下载列表没覆盖到的（登录失败等，照常用本地数据），补算
+        state['pool'] = _final_pool()
+        state['train_codes'] = state['pool'] if train_codes is None else list(train_codes)
+        final_features, final_scores = set(state['train_codes']), set(state['pool'])
+        extra = [code for code in dict.fromkeys(state['train_codes'] + state['pool'])
+                 if (code in final_features and code not in featured) or (code in final_scores and code not in scored)]
+        if extra:
+            print(f"正式股票池 / 训练集新增 {len(extra)} 只未预先计算，补算中...")
+        for code in extra:
+            _submit(code, code in final_features and code not in featured, code in final_scores and code not in scored)
+        if workers is not None:
+            workers.close()
+            workers.join()
+    finally:
+        stop.set()
+        if workers is not None:
+            workers.terminate()
+        # 正常结束时 _END 已取到；异常退出时取空队列，直到下载线程放入结束标记或中止退出
+        while item is not _END and downloader.is_alive():
+            try:
+                item = done_q.get(timeout=STOP_POLL)
+            except queue.Empty:
+                continue
+        downloader.join()
+    state['results'] = results
+    return state
+
+
+# ==========================================
+# 3. 主流程
+# ==========================================
+def run_pipelined(start_date: str = "2014-01-01", download_workers: int = data_loader.DEFAULT_WORKERS,
+                  cpu_workers: int = CPU_WORKERS, time_budget: float | None = None) -> dict:
+    """
+    流水线周度任务：输出与顺序模式相同（数据质量报告、dataset_labeled.pkl、buy_list_{日期}.csv）。
+    返回 {'download_elapsed', 'elapsed', 'tail', 'codes', 'pool', 'picks', 'errors', 'buy_list'}（秒）。
+    """
+    t0 = time.perf_counter()
+
+    # --- 前置：证券主数据 / 指数 / 股票池 / 模型（各一两次请求，不占下载时间） ---
+    try:
+        security_master.refresh_security_master()
+    except Exception as e:
+        print(f"⚠️ 证券主数据刷新失败: {e}")
+    try:
+        data_loader.update_benchmarks()
+    except Exception as e:
+        print(f"⚠️ 指数下载失败: {e}")
+    provisional = _provisional_pool()
+    train_codes = feature_eng.universe_codes()
+    scanner_ctx = trader.load_scanner_context()
+    if scanner_ctx is None:
+        print("⚠️ 没有模型，本次只更新数据与训练集，不输出买入清单。")
+    raw_store.load_manifest()  # 必要时先在主进程重建一次索引
+
+    # --- 下载 与 数据质量 / 特征 / 打分 重叠 ---
+    print(f"流水线启动：下载并发 {download_workers} | 计算进程 {cpu_workers} | 临时股票池 {len(provisional)} 只")
+    state = _run_stages(provisional, train_codes, scanner_ctx, cpu_workers,
+                        dict(start_date=start_date, workers=download_workers, time_budget=time_budget,
+                             start_method=DOWNLOAD_START_METHOD))
+    if 'download_error' in state:
+        print(f"⚠️ 个股数据下载出现警告: {state['download_error']}")
+    pool_codes = state.get('pool', [])
+    pool_set = set(pool_codes)
+    train_codes = state.get('train_codes', [])
+    train_set = set(train_codes)
+    by_code, cache_stats = {}, {}
+    for res in state['results']:
+        code = res['code']
+        by_code[code] = _merge_result(by_code[code], res) if code in by_code else res
+        feature_cache.merge_stats(cache_stats, res['cache'])
+
+    # --- 数据质量：写报告，修复 error 代码后补算池内被跳过的 ---
+    records = [res['quality'] for res in by_code.values() if res['quality'] is not None]
+    if records:
+        report = data_quality.save_records(records)
+        counts = report.loc[report['code'].isin(by_code), 'severity'].value_counts()
+        print(f"数据质量: ok {counts.get('ok', 0)} | warn {counts.get('warn', 0)} | error {counts.get('error', 0)}"
+              f"（报告: {data_quality.REPORT_PATH}）")
+        if counts.get('error', 0) and DATA_QUALITY_POLICY != 'ignore':
+            try:
+                data_quality.repair()
+            except Exception as e:
+                print(f"⚠️ 数据质量修复失败: {e}")
+            still_bad = data_quality.flagged_codes('error')
+            redo = [code for code, res in by_code.items()
+                    if res['skipped'] and (code in pool_set or code in train_set) and code not in still_bad]
+            for code in redo:
+                by_code[code] = _process_code((code, code in train_set, code in pool_set))
+                feature_cache.merge_stats(cache_stats, by_code[code]['cache'])
+
+    # --- 训练集（按训练代码顺序合并，结果与顺序模式一致；有时点股票池时按行过滤） ---
+    errors = [(code, f"[{stage}] {msg}") for code, res in by_code.items() if code in pool_set or code in train_set
+              for stage, msg in res['errors']]
+    feature_eng.report_feature_errors(errors)
+    feature_cache.report(cache_stats)
+    frames = [by_code[code]['features'] for code in train_codes
+              if code in by_code and by_code[code]['features'] is not None]
+    feature_eng.save_dataset(frames)
+    if frames:
+        label_maker.make_relative_labels()
+
+    # --- 实盘清单 ---
+    rows = [by_code[code]['pick'] for code in sorted(pool_set) if code in by_code]
+    picks = trader.score_snapshot(rows, scanner_ctx) if scanner_ctx is not None else []
+    buy_list = trader.write_buy_list(picks) if scanner_ctx is not None else None
+
+    # --- 时点股票池：清单已出，不占收盘到出清单的时间；供下次训练 / 回测 ---
+    try:
+        universe.build_universe()
+    except Exception as e:
+        print(f"⚠️ 时点股票池构建失败: {e}")
+
+    elapsed = time.perf_counter() - t0
+    download_elapsed = state.get('download_elapsed', 0.0)
+    tail = time.perf_counter() - state.get('download_done_at', t0)
+    print(f"流水线完成：总耗时 {elapsed / 60:.1f} 分钟，其中下载阶段 {download_elapsed / 60:.1f} 分钟，"
+          f"下载结束后收尾 {tail:.0f} 秒")
+    return {'download_elapsed': download_elapsed, 'elapsed': elapsed, 'tail': tail, 'codes': len(by_code),
+            'pool': len(pool_codes), 'picks': len(picks), 'errors': len(errors), 'buy_list': buy_list}
+
+
+if __name__ == "__main__":
+    run_pipelined()
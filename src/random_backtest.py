@@ -5,10 +5,20 @@ import os
 import joblib
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import baostock as bs
-import datetime
+import sys
 import random
 
+# --- 引入交易日历 & 证券主数据 & 面板 ---
+try:
+    from src import trade_calendar
+    from src import security_master
+    from src import panel
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import trade_calendar
+    from src import security_master
+    from src import panel
+
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
@@ -19,23 +29,6 @@ PLOTS_DIR = os.path.join(PROJECT_ROOT, 'plots')
 # ==========================================
 # 0. 复用辅助函数
 # ==========================================
-def get_stock_names_map():
-    print("正在联网获取股票名称表 (Baostock)...")
-    bs.login()
-    name_map = {}
-    for i in range(5):
-        date_chk = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime("%Y-%m-%d")
-        rs = bs.query_all_stock(day=date_chk)
-        data_list = []
-        while rs.error_code == '0' and rs.next():
-            data_list.append(rs.get_row_data())
-        if data_list:
-            df = pd.DataFrame(data_list, columns=rs.fields)
-            name_map = dict(zip(df['code'], df['code_name']))
-            break
-    bs.logout()
-    return name_map
-
 def is_valid_candidate_backtest(row, stock_name=""):
     if stock_name:
         upper_name = stock_name.upper()
@@ -73,35 +66,46 @@ def run_random_backtest(num_simulations=20, min_duration_weeks=52):
     df['date'] = pd.to_datetime(df['date'])
     df = df.sort_values('date').reset_index(drop=True)
     
-    # 算历史涨跌幅 (用于风控)
-    df['prev_close'] = df.groupby('code')['close'].shift(1)
-    df['pctChg'] = (df['close'] / df['prev_close'] - 1) * 100
-    df['pctChg'] = df['pctChg'].fillna(0)
-
     # ⚠️ 关键修改：不再切分验证集，使用全量数据 (df)
     full_df = df.copy()
-    
-    # 算真实收益 (T+5)
-    full_df['close_t5'] = full_df.groupby('code')['close'].shift(-5)
-    full_df['real_weekly_return'] = full_df['close_t5'] / full_df['close'] - 1.0
+
+    # 收盘价面板（日期 × 代码）：从 raw_store 读完整日线，不用数据集里的 close。
+    # 数据集只保留当日在股票池内的行，拿它算涨跌幅 / 平仓价会漏掉入池当天的涨跌停、丢掉出池或停牌的持仓
+    close_panel = panel.load_panel(full_df['code'].unique(), fields=['close'], dtype=np.float64)
+    if close_panel is None:
+        print("错误：本地没有行情数据！")
+        return
+
+    # 算真实收益：调仓日 = 每周最后一个交易日，持有到下一调仓日收盘（当天停牌 / 已退市取此前最后收盘价）
+    rebalance_dates = trade_calendar.rebalance_dates(full_df['date'].min(), full_df['date'].max())
+    full_df = full_df[full_df['date'].isin(rebalance_dates)].copy()
+    full_df['next_date'] = full_df['date'].map(trade_calendar.next_rebalance_map(rebalance_dates))
+    full_df['close_now'] = close_panel.lookup(close_panel['close'], full_df['code'], full_df['date'])
+    # 算历史涨跌幅 (用于风控)
+    full_df['prev_close'] = close_panel.lookup(close_panel.shift('close', 1), full_df['code'], full_df['date'])
+    full_df['pctChg'] = (full_df['close_now'] / full_df['prev_close'] - 1) * 100
+    full_df['pctChg'] = full_df['pctChg'].fillna(0)
+    full_df['close_next'] = close_panel.lookup(close_panel.ffill('close'), full_df['code'], full_df['next_date'])
+    full_df['real_weekly_return'] = full_df['close_next'] / full_df['close_now'] - 1.0
     full_df = full_df.dropna(subset=['real_weekly_return'])
 
     print(f"全历史数据范围: {full_df['date'].min().date()} 到 {full_df['date'].max().date()}")
 
     # 模型推理 (全量)
-    print("正在对 10 年数据进行全量推理 (可能需要一点时间)...")
+    print("正在对 10 年调仓日数据进行全量推理 (可能需要一点时间)...")
     model = xgb.XGBClassifier()
     model.load_model(model_path)
     feature_names = joblib.load(feat_path)
     X_test = full_df[feature_names]
     full_df['pred_proba'] = model.predict_proba(X_test)[:, 1]
 
-    # 获取名称表
-    name_map = get_stock_names_map()
+    # 时点名称 (用于过滤 ST)：取每个调仓日当时的名称，纯本地查询
+    if security_master.load_master()['history'].empty:
+        print("⚠️ 警告：本地没有证券主数据，ST 过滤失效！请先运行 security_master 刷新。")
+    full_df['stock_name'] = security_master.lookup_flags(full_df['code'], full_df['date'])['name'].values
 
     # --- B. 准备日期序列 ---
-    all_dates = sorted(full_df['date'].unique())
-    all_rebalance_dates = all_dates[::5] # 每周调仓点
+    all_rebalance_dates = sorted(full_df['date'].unique()) # 每周调仓点（交易日历）
     total_weeks = len(all_rebalance_dates)
     
     print(f"可用调仓周期: {total_weeks} 周")
@@ -152,8 +156,7 @@ def run_random_backtest(num_simulations=20, min_duration_weeks=52):
             
             for _, row in sorted_candidates.iterrows():
                 if len(picks_list) >= 3: break
-                code = row['code']
-                name = name_map.get(code, "")
+                name = row['stock_name']
                 if is_valid_candidate_backtest(row, name):
                     picks_list.append(row)
             
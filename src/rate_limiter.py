@@ -0,0 +1,131 @@
+# src/rate_limiter.py
+"""
+全局限流器：令牌桶 + AIMD（加性增、乘性减）。
+
+- 每次请求前 acquire() 取一个令牌，按当前 requests/s 预算匀速放行；
+- 请求成功 on_success()：速率加性上调 increase，直到 max_rate；
+- 遇到连接重置 / “请稍后再试”等限流信号 on_throttle()：速率乘以 decrease，并清空令牌。
+
+shared=True 时状态放在 multiprocessing 共享内存中，可经进程池 initializer 传给 worker，
+多个进程、多个线程共用同一个速率预算。
+"""
+import re
+import time
+import threading
+import multiprocessing as mp
+
+# 视为“服务端在限流/踢连接”的错误关键字
+THROTTLE_KEYWORDS = [
+    'Connection reset', 'Connection aborted', 'RemoteDisconnected',
+    'Max retries exceeded', 'Too Many Requests',
+    '远程主机强迫关闭', '接收数据异常', '请稍后再试', '访问过于频繁',
+]
+# 状态码 / 错误码按边界匹配：异常文本常带请求 URL，其中的股票代码（如 002429、600429）不能当成限流
+THROTTLE_PATTERN = re.compile(r'\b429\b|(?:WinError|Errno|errno)\s*1005[34]\b')
+THROTTLE_STATUS = {429}
+THROTTLE_ERRNOS = {10053, 10054}
+
+# 各数据源的默认预算（requests/s）
+DEFAULT_LIMITS = {
+    'baostock': dict(rate=8.0, min_rate=0.5, max_rate=40.0, burst=4.0, increase=0.05, decrease=0.5),
+    'akshare': dict(rate=2.0, min_rate=0.2, max_rate=10.0, burst=2.0, increase=0.02, decrease=0.5),
+}
+
+_RATE, _TOKENS, _LAST = 0, 1, 2
+
+
+def is_throttle_error(exc: Exception) -> bool:
+    status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status in THROTTLE_STATUS:
+        return True
+    if getattr(exc, 'winerror', None) in THROTTLE_ERRNOS or getattr(exc, 'errno', None) in THROTTLE_ERRNOS:
+        return True
+    msg = f"{type(exc).__name__}: {exc}"
+    return any(k in msg for k in THROTTLE_KEYWORDS) or THROTTLE_PATTERN.search(msg) is not None
+
+
+class AIMDRateLimiter:
+    def __init__(self, rate: float = 5.0, min_rate: float = 0.5, max_rate: float = 20.0,
+                 burst: float = 2.0, increase: float = 0.05, decrease: float = 0.5,
+                 shared: bool = False, ctx=None):
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = max(float(burst), 1.0)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        # time.monotonic 在同一台机器的各进程间可比（系统级单调时钟）
+        init = [min(max(float(rate), self.min_rate), self.max_rate), self.burst, time.monotonic()]
+        if shared:
+            self._state = (ctx or mp).Array('d', init)
+            self._lock = self._state.get_lock()
+        else:
+            self._state = init
+            self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        with self._lock:
+            return self._state[_RATE]
+
+    def _refill(self, now: float) -> None:
+        st = self._state
+        st[_TOKENS] = min(self.burst, st[_TOKENS] + (now - st[_LAST]) * st[_RATE])
+        st[_LAST] = now
+
+    def acquire(self) -> None:
+        """阻塞直到拿到一个令牌（等待在锁外进行）。"""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                st = self._state
+                if st[_TOKENS] >= 1.0:
+                    st[_TOKENS] -= 1.0
+                    return
+                wait = (1.0 - st[_TOKENS]) / st[_RATE]
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            st = self._state
+            st[_RATE] = min(self.max_rate, st[_RATE] + self.increase)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            st = self._state
+            st[_RATE] = max(self.min_rate, st[_RATE] * self.decrease)
+            st[_TOKENS] = min(st[_TOKENS], 0.0)
+
+
+# ==========================================
+# 进程内注册表：同一数据源共用一个限流器
+# ==========================================
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_limiter(name: str) -> AIMDRateLimiter:
+    with _REGISTRY_LOCK:
+        if name not in _REGISTRY:
+            _REGISTRY[name] = AIMDRateLimiter(**DEFAULT_LIMITS.get(name, {}))
+        return _REGISTRY[name]
+
+
+def set_limiter(name: str, limiter: AIMDRateLimiter) -> None:
+    with _REGISTRY_LOCK:
+        _REGISTRY[name] = limiter
+
+
+def make_shared_limiter(name: str, ctx=None) -> AIMDRateLimiter:
+    """
+    创建跨进程共享的限流器并注册到当前进程，继承当前速率。
+    返回值需经 Pool(initializer=..., initargs=(limiter,)) 传给子进程后再 set_limiter；
+    ctx 为进程池的 multiprocessing 上下文（共享内存的锁须与进程池同一种启动方式），None 为默认。
+    """
+    cfg = dict(DEFAULT_LIMITS.get(name, {}))
+    with _REGISTRY_LOCK:
+        if name in _REGISTRY:
+            cfg['rate'] = _REGISTRY[name].rate
+    limiter = AIMDRateLimiter(shared=True, ctx=ctx, **cfg)
+    set_limiter(name, limiter)
+    return limiter
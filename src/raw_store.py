@@ -0,0 +1,699 @@
+# src/raw_store.py
+"""
+原始日线存储层（data/raw）。
+
+两种后端：
+- csv：旧格式，每只股票一个 data/raw/{code}.csv，整文件读写；
+- parquet：列式压缩存储 data/raw_parquet/{code}/{year}.parquet，按代码 + 年份分区，
+  增量更新只重写受影响的年份分区（通常只有当年），读取支持列裁剪与按年份裁剪。
+
+BACKEND="auto" 时：装有 pyarrow 且已执行过迁移（存在 parquet 目录）则用 parquet，否则 csv。
+所有读写都经过本模块，下游（selection / feature_eng / trader / audit_trades）不再关心文件格式。
+
+每个后端根目录下维护一份 _manifest.csv（每只股票一行：首末日期、行数、最新收盘、
+近20日平均成交额、文件校验和、更新时间、价格口径），随每次写入在文件锁内原子更新，
+增量更新 / 选股 / 新鲜度检查直接查索引，无需逐个打开数据文件。
+
+价格口径（price_mode）：
+- raw：存不复权价格，复权因子单独存于后端根目录 _factors/{code}.csv（date, fore, back），
+  读取时按因子向量化复权；除权除息只需重写因子文件，历史日线不必重新下载；
+- qfq：旧数据（直接存前复权价格、没有因子文件），原样返回，下次全量下载时转为 raw。
+"""
+import os
+import time
+import shutil
+import hashlib
+import datetime
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAVE_PYARROW = True
+except ImportError:  # pyarrow 为可选依赖，缺失时只能使用 csv 后端
+    pa = None
+    pq = None
+    HAVE_PYARROW = False
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
+PARQUET_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw_parquet')
+
+BACKEND = "auto"           # auto / csv / parquet
+PARQUET_COMPRESSION = "zstd"
+
+BAR_COLUMNS = ['date', 'code', 'open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg']
+NUMERIC_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount', 'turn', 'pctChg']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']   # 复权只作用于价格列，成交量/额保持原值
+VALID_PREFIXES = ('sh.', 'sz.', 'bj.')
+
+FACTOR_DIR_NAME = '_factors'
+FACTOR_COLUMNS = ['date', 'fore', 'back']          # 除权除息日、前复权因子、后复权因子
+PRECLOSE_TOLERANCE = 0.006                         # 昨收与本地收盘差超过该值（元）视为除权除息
+
+MANIFEST_NAME = '_manifest.csv'
+MANIFEST_COLUMNS = ['code', 'first_date', 'last_date', 'rows', 'last_close',
+                    'avg_amount_20', 'checksum', 'updated_at', 'price_mode']
+MANIFEST_LOCK_TIMEOUT = 30  # 秒；超过该时长的锁视为崩溃遗留
+
+
+def get_config() -> dict:
+    """当前存储配置（可 pickle），用于传给子进程。"""
+    return {'RAW_DATA_DIR': RAW_DATA_DIR, 'PARQUET_DIR': PARQUET_DIR, 'BACKEND': BACKEND}
+
+
+def apply_config(config: dict) -> None:
+    """覆盖存储配置（子进程初始化 / 离线基准测试指向临时目录）。"""
+    global RAW_DATA_DIR, PARQUET_DIR, BACKEND
+    RAW_DATA_DIR = config.get('RAW_DATA_DIR', RAW_DATA_DIR)
+    PARQUET_DIR = config.get('PARQUET_DIR', PARQUET_DIR)
+    BACKEND = config.get('BACKEND', BACKEND)
+    _MANIFEST_CACHE.update(path=None, mtime=None, df=None)
+
+
+def active_backend() -> str:
+    if BACKEND != "auto":
+        return BACKEND
+    if HAVE_PYARROW and os.path.isdir(PARQUET_DIR):
+        return "parquet"
+    return "csv"
+
+
+# ==========================================
+# 1. 通用工具
+# ==========================================
+def _atomic_write_csv(df: pd.DataFrame, file_path: str) -> None:
+    tmp_path = file_path + ".tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, file_path)  # 原子替换，避免中途失败损坏文件
+
+
+def _atomic_write_parquet(table, file_path: str) -> None:
+    tmp_path = file_path + ".tmp"
+    pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION)
+    os.replace(tmp_path, file_path)
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """统一类型：date -> datetime64，数值列 -> float64，按日期去重排序。"""
+    df = df.copy()
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df = df.dropna(subset=['date']).drop_duplicates(subset=['date'], keep='last').sort_values('date')
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    if 'code' in df.columns:
+        df['code'] = df['code'].astype(str)
+    return df.reset_index(drop=True)
+
+
+def _filter_range(df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    if start is not None:
+        df = df[df['date'] >= pd.to_datetime(start)]
+    if end is not None:
+        df = df[df['date'] <= pd.to_datetime(end)]
+    return df
+
+
+def _csv_path(code: str) -> str:
+    return os.path.join(RAW_DATA_DIR, f"{code}.csv")
+
+
+def _code_dir(code: str) -> str:
+    return os.path.join(PARQUET_DIR, code)
+
+
+def _year_path(code: str, year: int) -> str:
+    return os.path.join(_code_dir(code), f"{int(year)}.parquet")
+
+
+def _years(code: str) -> list:
+    d = _code_dir(code)
+    if not os.path.isdir(d):
+        return []
+    return sorted(int(fn[:-8]) for fn in os.listdir(d) if fn.endswith('.parquet') and fn[:-8].isdigit())
+
+
+def _read_csv(code: str, cols=None):
+    path = _csv_path(code)
+    if not os.path.exists(path):
+        return None
+    usecols = (lambda c: c in cols) if cols else None
+    df = pd.read_csv(path, usecols=usecols)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    return df.dropna(subset=['date'])
+
+
+def _to_table(df: pd.DataFrame):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if 'date' in table.column_names:
+        idx = table.column_names.index('date')
+        table = table.set_column(idx, 'date', table.column('date').cast(pa.date32()))
+    return table
+
+
+def _read_year(code: str, year: int, columns=None) -> pd.DataFrame:
+    table = pq.read_table(_year_path(code, year), columns=columns)
+    return table.to_pandas(date_as_object=False)
+
+
+# ==========================================
+# 2. 对外接口
+# ==========================================
+def list_codes() -> list:
+    """本地已有数据的股票代码（按当前后端）。"""
+    if active_backend() == "parquet":
+        root = PARQUET_DIR
+        names = os.listdir(root) if os.path.isdir(root) else []
+        codes = [n for n in names if os.path.isdir(os.path.join(root, n))]
+    else:
+        root = RAW_DATA_DIR
+        names = os.listdir(root) if os.path.isdir(root) else []
+        codes = [os.path.splitext(n)[0] for n in names if n.endswith('.csv')]
+    return sorted(set(c for c in codes if c.startswith(VALID_PREFIXES)))
+
+
+def has_code(code: str) -> bool:
+    if active_backend() == "parquet":
+        return bool(_years(code))
+    path = _csv_path(code)
+    return os.path.exists(path) and os.path.getsize(path) > 100
+
+
+def read_bars(code: str, columns=None, start=None, end=None, adjust: str = "qfq") -> pd.DataFrame:
+    """
+    读取单只股票日线，按日期升序；date 为 datetime64。
+    :param columns: 列裁剪（date 总会被读入以便排序/区间过滤）
+    :param start/end: 日期区间过滤；parquet 后端会跳过区间外的年份分区
+    :param adjust: qfq（前复权，以最新因子为基准）/ hfq（后复权）/ none（存储原值）。
+                   旧的 qfq 口径数据没有因子，任何 adjust 都原样返回
+    """
+    cols = None
+    if columns is not None:
+        cols = ['date'] + [c for c in columns if c != 'date']
+
+    if active_backend() == "parquet":
+        years = _years(code)
+        if start is not None:
+            years = [y for y in years if y >= pd.to_datetime(start).year]
+        if end is not None:
+            years = [y for y in years if y <= pd.to_datetime(end).year]
+        if not years:
+            return pd.DataFrame(columns=cols or BAR_COLUMNS)
+        available = pq.read_schema(_year_path(code, years[-1])).names
+        read_cols = [c for c in cols if c in available] if cols else None
+        df = pd.concat([_read_year(code, y, read_cols) for y in years], ignore_index=True)
+        df['date'] = pd.to_datetime(df['date'])
+    else:
+        df = _read_csv(code, cols)
+        if df is None:
+            return pd.DataFrame(columns=cols or BAR_COLUMNS)
+
+    df = _filter_range(df, start, end).sort_values('date').reset_index(drop=True)
+    df['date'] = df['date'].astype('datetime64[ns]')
+    if cols:
+        df = df[[c for c in cols if c in df.columns]]
+    if adjust != "none" and len(df):
+        factors = read_factors(code)
+        if factors is not None:
+            df = adjust_prices(df, factors, adjust)
+    return df
+
+
+def adjust_prices(df: pd.DataFrame, factors: pd.DataFrame, how: str = "qfq") -> pd.DataFrame:
+    """
+    向量化复权：searchsorted 找到每行适用的后复权因子（首个除权日之前为 1.0），
+    hfq = 原价 × back(t)；qfq = 原价 × back(t) / back(最新)，与 baostock 前复权口径一致。
+    """
+    if factors is None or factors.empty or how == "none":
+        return df
+    if how not in ("qfq", "hfq"):
+        raise ValueError(f"未知复权方式: {how}")
+    f_dates = factors['date'].values.astype('datetime64[ns]')
+    back = factors['back'].values.astype('float64')
+    idx = np.searchsorted(f_dates, df['date'].values.astype('datetime64[ns]'), side='right') - 1
+    mult = np.where(idx >= 0, back[np.maximum(idx, 0)], 1.0)
+    if how == "qfq":
+        mult = mult / back[-1]
+    df = df.copy()
+    for col in PRICE_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('float64') * mult
+    return df
+
+
+# --- 复权因子 ---
+def _factor_path(code: str) -> str:
+    root = PARQUET_DIR if active_backend() == "parquet" else RAW_DATA_DIR
+    return os.path.join(root, FACTOR_DIR_NAME, f"{code}.csv")
+
+
+def price_mode(code: str) -> str:
+    """raw：不复权 + 因子；qfq：旧的前复权数据（没有因子文件）。"""
+    return "raw" if os.path.exists(_factor_path(code)) else "qfq"
+
+
+def read_factors(code: str):
+    """复权因子表（date 升序）；qfq 口径的股票返回 None。无除权记录的 raw 股票返回空表。"""
+    path = _factor_path(code)
+    if not os.path.exists(path):
+        return None
+    df = pd.read_csv(path)
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    for col in ['fore', 'back']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df.dropna().sort_values('date').reset_index(drop=True)[FACTOR_COLUMNS]
+
+
+def _write_factors(code: str, factors: pd.DataFrame) -> None:
+    path = _factor_path(code)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = factors[FACTOR_COLUMNS].copy()
+    out['date'] = pd.to_datetime(out['date']).dt.strftime('%Y-%m-%d')
+    _atomic_write_csv(out.drop_duplicates('date', keep='last').sort_values('date'), path)
+
+
+def preclose_mismatch(code: str, new_df: pd.DataFrame) -> bool:
+    """
+    判断新拉到的不复权行情（需含 preclose 列）与本地是否出现除权除息：
+    逐行比较 preclose 与前一根收盘（首行对比本地最后收盘），差异超过 PRECLOSE_TOLERANCE 即为 True。
+    """
+    if new_df.empty or 'preclose' not in new_df.columns:
+        return False
+    df = new_df.sort_values('date')
+    pre = pd.to_numeric(df['preclose'], errors='coerce').values.astype('float64')
+    close = pd.to_numeric(df['close'], errors='coerce').values.astype('float64')
+    entry = manifest_entry(code)
+    last_close = float(entry['last_close']) if entry is not None else float('nan')
+    if np.isnan(last_close):
+        tail = read_bars(code, columns=['close'], adjust="none").tail(1)
+        last_close = float(tail['close'].iloc[0]) if len(tail) else float('nan')
+    prev = np.concatenate([[last_close], close[:-1]])
+    valid = np.isfinite(pre) & np.isfinite(prev) & (pre > 0)
+    return bool(np.any(np.abs(pre[valid] - prev[valid]) > PRECLOSE_TOLERANCE))
+
+
+def read_stored(code: str) -> pd.DataFrame:
+    """按存储原样读取全部行（不排序、不去重、不复权、不做类型转换），供数据质量检查。无数据返回 None。"""
+    if active_backend() == "parquet":
+        years = _years(code)
+        if not years:
+            return None
+        return pd.concat([_read_year(code, y) for y in years], ignore_index=True)
+    path = _csv_path(code)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
+
+
+def data_files(code: str) -> list:
+    """该股票当前后端下的全部数据文件路径。"""
+    return _data_files(code)
+
+
+def last_date(code: str):
+    """
+    最后一个交易日（pd.Timestamp）；无数据返回 None。
+    优先查 manifest；索引缺失时 parquet 后端只读最新年份的 date 列。
+    """
+    entry = manifest_entry(code)
+    if entry is not None and not pd.isna(entry['last_date']):
+        return pd.Timestamp(entry['last_date'])
+    if active_backend() == "parquet":
+        years = _years(code)
+        if not years:
+            return None
+        dates = _read_year(code, years[-1], ['date'])['date']
+    else:
+        if not has_code(code):
+            return None
+        dates = pd.to_datetime(pd.read_csv(_csv_path(code), usecols=['date'])['date'], errors='coerce')
+    last = pd.to_datetime(dates).max()
+    return None if pd.isna(last) else last
+
+
+def _write_unindexed(code: str, df: pd.DataFrame) -> dict:
+    df = _normalize(df)
+    if active_backend() == "parquet":
+        os.makedirs(_code_dir(code), exist_ok=True)
+        years = df['date'].dt.year
+        written = set()
+        for year, part in df.groupby(years):
+            _atomic_write_parquet(_to_table(part.reset_index(drop=True)), _year_path(code, year))
+            written.add(int(year))
+        # 清理旧数据里多出来的年份分区
+        for y in _years(code):
+            if y not in written:
+                os.remove(_year_path(code, y))
+    else:
+        os.makedirs(RAW_DATA_DIR, exist_ok=True)
+        out = df.copy()
+        out['date'] = out['date'].dt.strftime('%Y-%m-%d')
+        _atomic_write_csv(out, _csv_path(code))
+    return _entry_from_frame(code, df, _checksum(code))
+
+
+def _append_unindexed(code: str, new_df: pd.DataFrame):
+    new_df = _normalize(new_df)
+    if new_df.empty:
+        return None
+    if active_backend() == "parquet":
+        os.makedirs(_code_dir(code), exist_ok=True)
+        existing_years = set(_years(code))
+        for year, part in new_df.groupby(new_df['date'].dt.year):
+            if int(year) in existing_years:
+                old = _read_year(code, year)
+                part = _normalize(pd.concat([old, part], ignore_index=True))
+            _atomic_write_parquet(_to_table(part.reset_index(drop=True)), _year_path(code, year))
+        return _entry_from_parquet(code)
+    merged = pd.concat([read_bars(code, adjust="none"), new_df], ignore_index=True)
+    return _write_unindexed(code, merged)
+
+
+def write_bars(code: str, df: pd.DataFrame, factors: pd.DataFrame = None) -> int:
+    """
+    全量覆盖写入（新股首次下载 / 迁移）。返回写入行数。
+    factors 不为空表示 df 是不复权价格（raw 口径）：先写日线再写因子文件——因子文件即 raw 标记，
+    中途失败只会留下“qfq 口径 + 不复权价格”，下次按旧数据整只重下；factors=None 表示 df 已是前复权。
+    """
+    entry = _write_unindexed(code, df)
+    if factors is not None:
+        _write_factors(code, factors)
+    elif os.path.exists(_factor_path(code)):
+        os.remove(_factor_path(code))
+    entry['price_mode'] = price_mode(code)
+    _update_manifest([entry])
+    return entry['rows']
+
+
+def append_bars(code: str, new_df: pd.DataFrame, factors: pd.DataFrame = None) -> int:
+    """
+    增量追加：同日期以新数据为准，new_df 须与该股票当前的 price_mode 同口径。
+    parquet 后端只读写新数据所在的年份分区；csv 后端沿用整文件合并重写。
+    factors 不为空（期间发生除权除息）时先整份替换因子文件再追加，历史日线无需重写。
+    """
+    if factors is not None:
+        _write_factors(code, factors)
+    entry = _append_unindexed(code, new_df)
+    if entry is None:
+        return 0
+    _update_manifest([entry])
+    return len(new_df)
+
+
+def append_many(frames: dict) -> int:
+    """
+    批量增量追加 {code: new_df}：逐只写数据，最后一次性更新 manifest
+    （截面快照一次追加几千只时，避免几千次索引读写）。返回成功写入的股票数。
+    """
+    entries = []
+    for code, new_df in tqdm(frames.items(), desc="写入快照"):
+        try:
+            entry = _append_unindexed(code, new_df)
+        except Exception:
+            continue
+        if entry is not None:
+            entries.append(entry)
+    if entries:
+        _update_manifest(entries)
+    return len(entries)
+
+
+# ==========================================
+# 3. Manifest 索引
+# ==========================================
+_MANIFEST_CACHE = {'path': None, 'mtime': None, 'df': None}
+
+
+def _manifest_path() -> str:
+    root = PARQUET_DIR if active_backend() == "parquet" else RAW_DATA_DIR
+    return os.path.join(root, MANIFEST_NAME)
+
+
+def _data_files(code: str) -> list:
+    if active_backend() == "parquet":
+        return [_year_path(code, y) for y in _years(code)]
+    path = _csv_path(code)
+    return [path] if os.path.exists(path) else []
+
+
+def _checksum(code: str) -> str:
+    h = hashlib.sha1()
+    for path in _data_files(code):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+def _entry_from_frame(code: str, df: pd.DataFrame, checksum: str) -> dict:
+    tail = df.tail(20)
+    return {
+        'code': code,
+        'first_date': df['date'].iloc[0] if len(df) else pd.NaT,
+        'last_date': df['date'].iloc[-1] if len(df) else pd.NaT,
+        'rows': int(len(df)),
+        'last_close': float(tail['close'].iloc[-1]) if len(tail) and 'close' in tail else float('nan'),
+        'avg_amount_20': float(tail['amount'].mean()) if 'amount' in tail else float('nan'),
+        'checksum': checksum,
+        'updated_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'price_mode': price_mode(code),
+    }
+
+
+def _entry_from_parquet(code: str) -> dict:
+    """只读 parquet 元数据 + 首年 date 列 + 末尾两年的 close/amount，拼出索引行。"""
+    years = _years(code)
+    rows = sum(pq.ParquetFile(_year_path(code, y)).metadata.num_rows for y in years)
+    first_date = pd.to_datetime(_read_year(code, years[0], ['date'])['date']).min()
+    tail = pd.concat([_read_year(code, y, ['date', 'close', 'amount']) for y in years[-2:]],
+                     ignore_index=True).sort_values('date').tail(20)
+    tail['date'] = pd.to_datetime(tail['date'])
+    entry = _entry_from_frame(code, tail, _checksum(code))
+    entry.update(first_date=first_date, rows=int(rows))
+    return entry
+
+
+@contextmanager
+def _manifest_lock():
+    """跨进程文件锁：O_EXCL 创建锁文件；超时未释放的锁视为崩溃遗留并清理。"""
+    lock_path = _manifest_path() + '.lock'
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > MANIFEST_LOCK_TIMEOUT:
+                    os.remove(lock_path)
+            except OSError:
+                pass
+            time.sleep(0.005)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def _read_manifest_file(path: str) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS).set_index('code')
+    df = pd.read_csv(path, dtype={'code': str, 'checksum': str})
+    for col in ['first_date', 'last_date']:
+        df[col] = pd.to_datetime(df[col], errors='coerce')
+    # 旧版索引没有 price_mode 列：都是前复权数据
+    df = df.reindex(columns=MANIFEST_COLUMNS)
+    df['price_mode'] = df['price_mode'].fillna('qfq')
+    return df.set_index('code')
+
+
+def _write_manifest_file(df: pd.DataFrame, path: str) -> None:
+    out = df.reset_index().reindex(columns=MANIFEST_COLUMNS).sort_values('code').copy()
+    for col in ['first_date', 'last_date']:
+        out[col] = pd.to_datetime(out[col]).dt.strftime('%Y-%m-%d')
+    _atomic_write_csv(out, path)
+
+
+def _update_manifest(entries: list) -> None:
+    """在文件锁内读-改-写 manifest（数据文件已先落盘，索引只会落后、不会超前）。"""
+    path = _manifest_path()
+    if not os.path.exists(path):
+        # 存量数据还没有索引：先全量建一次，避免索引只包含本次写入的股票
+        rebuild_manifest()
+    with _manifest_lock():
+        df = _read_manifest_file(path)
+        new = pd.DataFrame(entries).set_index('code')
+        df = pd.concat([df[~df.index.isin(new.index)], new])
+        _write_manifest_file(df, path)
+
+
+def load_manifest() -> pd.DataFrame:
+    """
+    读取 manifest（index=code）。按文件 mtime 做进程内缓存；
+    存量数据首次使用时若没有索引，会自动全量重建一次。
+    """
+    path = _manifest_path()
+    if not os.path.exists(path):
+        rebuild_manifest()
+    mtime = os.path.getmtime(path)
+    cache = _MANIFEST_CACHE
+    if cache['path'] != path or cache['mtime'] != mtime:
+        cache.update(path=path, mtime=mtime, df=_read_manifest_file(path))
+    return cache['df']
+
+
+def manifest_entry(code: str):
+    """单只股票的索引行（pd.Series）；不存在返回 None。"""
+    path = _manifest_path()
+    if not os.path.exists(path):
+        return None
+    df = load_manifest()
+    if code not in df.index:
+        return None
+    return df.loc[code]
+
+
+def factor_checksum(code: str) -> str:
+    """复权因子文件内容的 sha1；没有因子文件（qfq 口径）返回空串。"""
+    path = _factor_path(code)
+    if not os.path.exists(path):
+        return ''
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def fingerprint(code: str) -> str:
+    """
+    单只股票的数据内容指纹：行情文件校验和（优先取 manifest）+ 复权因子文件内容。
+    任一变化指纹即变化，下游按代码缓存的中间结果据此判断是否失效；没有数据返回空串。
+    """
+    entry = manifest_entry(code)
+    checksum = entry['checksum'] if entry is not None and isinstance(entry['checksum'], str) else ''
+    if not checksum:
+        if not _data_files(code):
+            return ''
+        checksum = _checksum(code)
+    h = hashlib.sha1(checksum.encode())
+    path = _factor_path(code)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def file_stats(code: str) -> list:
+    """单只股票数据文件的 [(文件名, 大小, mtime_ns)]；文件在 raw_store 之外被改写时 manifest 校验和不会变，这里能看出来。"""
+    out = []
+    for path in _data_files(code):
+        st = os.stat(path)
+        out.append((os.path.basename(path), st.st_size, st.st_mtime_ns))
+    return out
+
+
+def rebuild_manifest() -> pd.DataFrame:
+    """全量扫描当前后端，重建 manifest。"""
+    codes = list_codes()
+    entries = []
+    for code in tqdm(codes, desc="重建索引"):
+        try:
+            if active_backend() == "parquet":
+                entries.append(_entry_from_parquet(code))
+            else:
+                entries.append(_entry_from_frame(code, _normalize(_read_csv(code)), _checksum(code)))
+        except Exception:
+            continue
+    path = _manifest_path()
+    with _manifest_lock():
+        df = pd.DataFrame(entries, columns=MANIFEST_COLUMNS).set_index('code')
+        _write_manifest_file(df, path)
+    print(f"索引已重建: {len(entries)} 只 -> {path}")
+    return df
+
+
+# ==========================================
+# 4. 一次性迁移：CSV -> Parquet
+# ==========================================
+def migrate_csv_to_parquet(remove_csv: bool = False) -> None:
+    """
+    把 data/raw/*.csv 全部转换为按年份分区的 parquet，并逐只校验行数。
+    迁移完成后 BACKEND="auto" 会自动切换到 parquet；默认保留 CSV 作为备份。
+    """
+    if not HAVE_PYARROW:
+        print("❌ 未安装 pyarrow，无法迁移到 parquet。请先 pip install pyarrow")
+        return
+
+    csv_codes = [os.path.splitext(n)[0] for n in os.listdir(RAW_DATA_DIR)
+                 if n.endswith('.csv') and n.startswith(VALID_PREFIXES)] if os.path.isdir(RAW_DATA_DIR) else []
+    if not csv_codes:
+        print("未发现需要迁移的 CSV。")
+        return
+
+    print(f"开始迁移 {len(csv_codes)} 只股票: {RAW_DATA_DIR} -> {PARQUET_DIR}")
+    tmp_root = PARQUET_DIR + ".migrating"
+    if os.path.isdir(tmp_root):
+        shutil.rmtree(tmp_root)
+
+    ok, failed = 0, []
+    for code in tqdm(sorted(csv_codes), desc="迁移进度"):
+        try:
+            df = _normalize(_read_csv(code))
+            _write_into(tmp_root, code, df)
+            if _count_rows(tmp_root, code) != len(df):
+                raise ValueError("行数校验失败")
+            ok += 1
+        except Exception as e:
+            failed.append((code, str(e)))
+
+    if failed:
+        print(f"❌ {len(failed)} 只迁移失败，未切换后端（临时目录保留在 {tmp_root}）:")
+        for code, msg in failed[:10]:
+            print(f"   {code}: {msg}")
+        return
+
+    # 复权因子随后端根目录一起迁移
+    factor_dir = os.path.join(RAW_DATA_DIR, FACTOR_DIR_NAME)
+    if os.path.isdir(factor_dir):
+        shutil.copytree(factor_dir, os.path.join(tmp_root, FACTOR_DIR_NAME))
+
+    # 整体原子切换：临时目录完整后再改名
+    if os.path.isdir(PARQUET_DIR):
+        shutil.rmtree(PARQUET_DIR)
+    os.replace(tmp_root, PARQUET_DIR)
+    if remove_csv:
+        for code in csv_codes:
+            os.remove(_csv_path(code))
+    rebuild_manifest()
+
+    print("\n" + "=" * 30)
+    print("迁移完成！")
+    print(f"成功: {ok} 只 | 后端: {active_backend()}")
+    print(f"存储位置: {PARQUET_DIR}")
+    print("=" * 30)
+
+
+def _write_into(root: str, code: str, df: pd.DataFrame) -> None:
+    code_dir = os.path.join(root, code)
+    os.makedirs(code_dir, exist_ok=True)
+    for year, part in df.groupby(df['date'].dt.year):
+        _atomic_write_parquet(_to_table(part.reset_index(drop=True)), os.path.join(code_dir, f"{int(year)}.parquet"))
+
+
+def _count_rows(root: str, code: str) -> int:
+    code_dir = os.path.join(root, code)
+    return sum(pq.ParquetFile(os.path.join(code_dir, fn)).metadata.num_rows
+               for fn in os.listdir(code_dir) if fn.endswith('.parquet'))
+
+
+if __name__ == "__main__":
+    migrate_csv_to_parquet()
@@ -0,0 +1,242 @@
+# src/security_master.py
+"""
+证券主数据（data/security_master）：名称 / ST / 退市的时点（point-in-time）历史。
+
+- name_history.csv：(code, name, start_date, end_date) 区间表，
+  由每周调仓日的 query_all_stock 截面压缩而来——同一代码相邻采样名称不变就延长区间；
+- stock_basic.csv：query_stock_basic 的上市 / 退市日期；
+- sampled_dates.csv：已采样的日期，增量刷新只补采之后的调仓日与最近交易日。
+
+回测与实盘扫描只读本地文件（无联网）；lookup_flags 对 (codes × dates) 做一次 merge_asof，
+返回当时的名称与 ST / 退市标记，历史日期不再套用今天的名称。
+"""
+import os
+import sys
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+try:
+    from src import data_loader
+    from src import trade_calendar
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import data_loader
+    from src import trade_calendar
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+MASTER_DIR = os.path.join(PROJECT_ROOT, 'data', 'security_master')
+HISTORY_PATH = os.path.join(MASTER_DIR, 'name_history.csv')
+BASIC_PATH = os.path.join(MASTER_DIR, 'stock_basic.csv')
+SAMPLED_PATH = os.path.join(MASTER_DIR, 'sampled_dates.csv')
+
+MASTER_START = "2014-01-01"     # 与历史行情起点一致
+HISTORY_COLUMNS = ['code', 'name', 'start_date', 'end_date']
+BASIC_COLUMNS = ['code', 'name', 'ipo_date', 'out_date', 'type', 'status']
+
+_CACHE = {'key': None, 'data': None}
+
+
+# ==========================================
+# 1. 本地文件读写
+# ==========================================
+def _atomic_write_csv(df: pd.DataFrame, path: str, date_cols=()) -> None:
+    out = df.copy()
+    for col in date_cols:
+        out[col] = pd.to_datetime(out[col]).dt.strftime('%Y-%m-%d')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    out.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _read_csv(path: str, columns: list, date_cols=()) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    for col in date_cols:
+        df[col] = pd.to_datetime(df[col].replace('', None), errors='coerce')
+    return df[columns]
+
+
+def load_master() -> dict:
+    """读取三张表（按文件 mtime 做进程内缓存）。缺失时返回空表。"""
+    paths = (HISTORY_PATH, BASIC_PATH, SAMPLED_PATH)
+    key = tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in paths)
+    if _CACHE['key'] != key:
+        history = _read_csv(HISTORY_PATH, HISTORY_COLUMNS, ('start_date', 'end_date'))
+        basic = _read_csv(BASIC_PATH, BASIC_COLUMNS, ('ipo_date', 'out_date'))
+        sampled = _read_csv(SAMPLED_PATH, ['date'], ('date',))['date']
+        _CACHE.update(key=key, data={
+            'history': history.sort_values(['code', 'start_date']).reset_index(drop=True),
+            'basic': basic.set_index('code'),
+            'sampled': pd.DatetimeIndex(sampled).sort_values(),
+        })
+    return _CACHE['data']
+
+
+# ==========================================
+# 2. 增量刷新（联网）
+# ==========================================
+def _query_rows(call, op_name: str):
+    rs = data_loader._with_retry(call, op_name=op_name)
+    rows = []
+    while rs.error_code == '0' and rs.next():
+        rows.append(rs.get_row_data())
+    return rows, rs.fields
+
+
+def _snapshot(day: str) -> dict:
+    """某交易日的全市场 {code: name}。"""
+    bs = data_loader.bs
+    rows, fields = _query_rows(lambda: bs.query_all_stock(day=day), "query_all_stock(master)")
+    if not rows:
+        return {}
+    df = pd.DataFrame(rows, columns=fields)
+    return dict(zip(df['code'].astype(str), df['code_name'].astype(str)))
+
+
+def _refresh_basic() -> None:
+    bs = data_loader.bs
+    rows, fields = _query_rows(lambda: bs.query_stock_basic(), "query_stock_basic")
+    if not rows:
+        return
+    df = pd.DataFrame(rows, columns=fields).rename(columns={
+        'code_name': 'name', 'ipoDate': 'ipo_date', 'outDate': 'out_date'})
+    _atomic_write_csv(df[BASIC_COLUMNS], BASIC_PATH)
+
+
+def _pending_dates(sampled: pd.DatetimeIndex) -> list:
+    """待采样日期：每周调仓日 + 最近交易日，只取已采样最后一天之后的。"""
+    latest = trade_calendar.latest_trading_day()
+    dates = trade_calendar.rebalance_dates(MASTER_START, latest)
+    if len(sampled):
+        dates = dates[dates > sampled.max()]
+    return list(dates)
+
+
+def refresh_security_master(login: bool = True) -> int:
+    """
+    增量刷新：补采缺失的调仓日截面并合并进区间表，同时重拉一次上市/退市信息。
+    首次运行会从 MASTER_START 起逐周回填（约每年 52 次请求）。返回新采样的日期数。
+    """
+    bs = data_loader.bs
+    done = 0
+    if login:
+        lg = bs.login()
+        if lg.error_code != '0':
+            print(f"登陆失败: {lg.error_msg}")
+            return 0
+    try:
+        trade_calendar.refresh_calendar(api=bs, login=False)
+        master = load_master()
+        pending = _pending_dates(master['sampled'])
+        if pending:
+            print(f"证券主数据: 需补采 {len(pending)} 个交易日截面...")
+        # 区间表转成列表原地延长；open_iv 记录“截至上一次采样仍在延续”的区间
+        rows = master['history'][HISTORY_COLUMNS].values.tolist()
+        sampled = list(master['sampled'])
+        last = sampled[-1] if sampled else None
+        open_iv = {r[0]: i for i, r in enumerate(rows) if last is not None and r[3] == last}
+        for day in tqdm(pending, desc="证券主数据", disable=len(pending) < 5):
+            try:
+                snap = _snapshot(day.strftime('%Y-%m-%d'))
+            except Exception as e:
+                print(f"⚠️ {day.date()} 截面获取失败，下次再补: {e}")
+                break
+            if not snap:
+                if day == pending[-1]:
+                    # 最近交易日数据源还没有截面（如入库前），留到下次
+                    break
+                continue
+            new_open = {}
+            for code, name in snap.items():
+                idx = open_iv.get(code)
+                if idx is not None and rows[idx][1] == name:
+                    rows[idx][3] = day
+                else:
+                    rows.append([code, name, day, day])
+                    idx = len(rows) - 1
+                new_open[code] = idx
+            open_iv = new_open
+            sampled.append(day)
+            done += 1
+        if done:
+            history = pd.DataFrame(rows, columns=HISTORY_COLUMNS).sort_values(['code', 'start_date'])
+            # 先写区间表再写采样日期：中途中断只会导致下次重复采样，不会漏采
+            _atomic_write_csv(history, HISTORY_PATH, ('start_date', 'end_date'))
+            _atomic_write_csv(pd.DataFrame({'date': sampled}), SAMPLED_PATH, ('date',))
+        try:
+            _refresh_basic()
+        except Exception as e:
+            print(f"⚠️ 上市/退市信息刷新失败: {e}")
+    finally:
+        if login:
+            bs.logout()
+    print(f"证券主数据已更新：新增采样 {done} 天 -> {MASTER_DIR}")
+    return done
+
+
+# ==========================================
+# 3. 查询接口（纯本地）
+# ==========================================
+def lookup_flags(codes, dates) -> pd.DataFrame:
+    """
+    向量化时点查询：第 i 行为 codes[i] 在 dates[i] 当时的状态（与输入等长、同序）。
+    列：name（当时名称，未知为 ""）、is_st、is_delisting（名称含“退”）、listed（当时是否在市）。
+    """
+    master = load_master()
+    q = pd.DataFrame({'code': np.asarray(codes, dtype=object).astype(str),
+                      'date': pd.to_datetime(np.asarray(dates)).astype('datetime64[ns]')})
+    q['_order'] = np.arange(len(q))
+    hist = master['history']
+    if hist.empty:
+        out = q.assign(name="", is_st=False, is_delisting=False, listed=True)
+        return out.drop(columns=['_order', 'code', 'date']).reset_index(drop=True)
+
+    hist = hist.assign(start_date=hist['start_date'].astype('datetime64[ns]'))
+    # 区间结束后的下一次采样日起视为不再在列表中（退市 / 终止上市）
+    sampled = master['sampled'].values.astype('datetime64[ns]')
+    pos = np.searchsorted(sampled, hist['end_date'].values.astype('datetime64[ns]'), side='right')
+    expire = np.full(len(hist), np.datetime64('NaT'), dtype='datetime64[ns]')
+    has_next = pos < len(sampled)
+    expire[has_next] = sampled[pos[has_next]]
+    hist = hist.assign(expire=expire)
+
+    m = pd.merge_asof(q.sort_values('date'), hist.sort_values('start_date'),
+                      left_on='date', right_on='start_date', by='code', direction='backward')
+    m = m.sort_values('_order').reset_index(drop=True)
+    name = m['name'].fillna("").astype(str)
+    upper = name.str.upper()
+    listed = m['start_date'].notna() & (m['expire'].isna() | (m['date'] < m['expire']))
+
+    basic = master['basic']
+    if not basic.empty:
+        ipo = m['code'].map(basic['ipo_date'])
+        out = m['code'].map(basic['out_date'])
+        listed &= ~(ipo.notna() & (m['date'] < ipo))
+        listed &= ~(out.notna() & (m['date'] >= out))
+
+    return pd.DataFrame({
+        'name': name,
+        'is_st': upper.str.contains('ST', regex=False),
+        'is_delisting': name.str.contains('退', regex=False),
+        'listed': listed,
+    })
+
+
+def latest_names() -> dict:
+    """最近一次采样的 {code: name}（实盘扫描用）。"""
+    master = load_master()
+    hist = master['history']
+    if hist.empty or not len(master['sampled']):
+        return {}
+    last = master['sampled'].max()
+    cur = hist[hist['end_date'] == last]
+    return dict(zip(cur['code'], cur['name']))
+
+
+if __name__ == "__main__":
+    refresh_security_master()
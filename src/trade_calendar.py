@@ -0,0 +1,296 @@
+# src/trade_calendar.py
+"""
+交易日历服务（data/calendar/trade_calendar.csv）。
+
+- 数据来自 baostock query_trade_dates，本地缓存一份，只增量补齐缓存末尾之后的日期；
+- 加载后预先展开成“自然日 -> 最近交易日序号”的查找表，
+  最近交易日 / 前后 N 个交易日 / 区间交易日数 / 调仓日 都是 O(1) 数组下标，不再联网；
+- 缓存缺失且无法联网时，退化为周一到周五的近似日历（会打印警告，不写盘）。
+"""
+import os
+import sys
+import datetime
+import numpy as np
+import pandas as pd
+
+try:
+    from src.rate_limiter import get_limiter, is_throttle_error
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src.rate_limiter import get_limiter, is_throttle_error
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+CALENDAR_DIR = os.path.join(PROJECT_ROOT, 'data', 'calendar')
+CALENDAR_PATH = os.path.join(CALENDAR_DIR, 'trade_calendar.csv')
+
+CALENDAR_START = "2005-01-01"   # 缓存起始日期（覆盖全部历史数据）
+DATA_READY_HOUR = 18            # baostock 当日日线约 17:30 入库，此前“最新交易日”按上一交易日算
+APPROX_HORIZON_DAYS = 400       # 缓存覆盖不到的未来日期，用工作日近似补齐的长度
+
+_CAL_CACHE = {'mtime': None, 'cal': None, 'refresh_tried': False}
+
+
+# ==========================================
+# 1. 缓存读写 & 增量刷新
+# ==========================================
+def _read_calendar_file() -> pd.DataFrame:
+    df = pd.read_csv(CALENDAR_PATH, dtype={'is_trading_day': int})
+    df['calendar_date'] = pd.to_datetime(df['calendar_date'])
+    return df
+
+
+def _query_trade_dates(api, start_date: str, end_date: str) -> pd.DataFrame:
+    limiter = get_limiter('baostock')
+    last_exc = None
+    for _ in range(3):
+        limiter.acquire()
+        try:
+            rs = api.query_trade_dates(start_date=start_date, end_date=end_date)
+            if rs.error_code != '0':
+                raise RuntimeError(f"query_trade_dates: {rs.error_msg}")
+            rows = []
+            while rs.next():
+                rows.append(rs.get_row_data())
+            limiter.on_success()
+            df = pd.DataFrame(rows, columns=rs.fields)
+            df['calendar_date'] = pd.to_datetime(df['calendar_date'])
+            df['is_trading_day'] = df['is_trading_day'].astype(int)
+            return df[['calendar_date', 'is_trading_day']]
+        except Exception as e:
+            last_exc = e
+            if is_throttle_error(e):
+                limiter.on_throttle()
+    raise last_exc
+
+
+def refresh_calendar(api=None, force: bool = False, login: bool = True) -> bool:
+    """
+    增量刷新本地日历：只请求缓存末尾之后到今年年底的日期（force=True 时全量重拉）。
+    api 默认为 baostock 模块；调用方已登录时传 login=False，避免打断现有会话。
+    返回是否成功（失败不影响已有缓存）。
+    """
+    if api is None:
+        import baostock as api
+    today = pd.Timestamp(datetime.date.today())
+    end = pd.Timestamp(year=today.year, month=12, day=31)
+
+    cached = None
+    start = pd.Timestamp(CALENDAR_START)
+    if os.path.exists(CALENDAR_PATH) and not force:
+        cached = _read_calendar_file()
+        last = cached['calendar_date'].max()
+        if last >= today:
+            return True
+        start = last + pd.Timedelta(days=1)
+
+    try:
+        if login:
+            api.login()
+        new = _query_trade_dates(api, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+    except Exception as e:
+        print(f"⚠️ 交易日历刷新失败: {e}")
+        return False
+    finally:
+        if login:
+            try:
+                api.logout()
+            except Exception:
+                pass
+    if new.empty:
+        return False
+
+    df = new if cached is None else pd.concat([cached, new], ignore_index=True)
+    df = df.drop_duplicates('calendar_date', keep='last').sort_values('calendar_date')
+    os.makedirs(CALENDAR_DIR, exist_ok=True)
+    out = df.copy()
+    out['calendar_date'] = out['calendar_date'].dt.strftime('%Y-%m-%d')
+    tmp = CALENDAR_PATH + '.tmp'
+    out.to_csv(tmp, index=False)
+    os.replace(tmp, CALENDAR_PATH)
+    print(f"交易日历已更新至 {df['calendar_date'].max().date()}（新增 {len(new)} 天）")
+    return True
+
+
+# ==========================================
+# 2. 查找表
+# ==========================================
+def _build(open_days: np.ndarray, first_day: np.datetime64, last_day: np.datetime64,
+           approx_from=None) -> dict:
+    """
+    open_days：升序交易日（datetime64[D]）；[first_day, last_day] 为日历覆盖的自然日区间。
+    prev_idx[k]：第 k 个自然日当天或之前最近一个交易日在 open_days 中的序号（之前没有则为 -1）。
+    """
+    n = int((last_day - first_day).astype(int)) + 1
+    offsets = (open_days - first_day).astype(np.int64)
+    is_open = np.zeros(n, dtype=bool)
+    is_open[offsets] = True
+    prev_idx = np.cumsum(is_open) - 1
+    return {'days': open_days, 'first': first_day, 'last': last_day,
+            'is_open': is_open, 'prev_idx': prev_idx, 'approx_from': approx_from,
+            'rebalance': {}}
+
+
+def _weekdays(start: np.datetime64, end: np.datetime64) -> np.ndarray:
+    days = np.arange(start, end + np.timedelta64(1, 'D'), dtype='datetime64[D]')
+    return days[np.is_busday(days)]
+
+
+def load_calendar(auto_refresh: bool = True) -> dict:
+    """
+    加载（必要时增量刷新）日历并构建查找表，按文件 mtime 做进程内缓存。
+    缓存未覆盖到的未来日期用工作日近似补齐，保证任意日期都可查。
+    """
+    if auto_refresh and not _CAL_CACHE['refresh_tried']:
+        stale = not os.path.exists(CALENDAR_PATH)
+        if not stale:
+            cache = _CAL_CACHE
+            if cache['cal'] is not None and cache['mtime'] == os.path.getmtime(CALENDAR_PATH):
+                stale = cache['cal']['approx_from'] is not None and \
+                    cache['cal']['approx_from'] <= np.datetime64(datetime.date.today(), 'D')
+            else:
+                stale = _read_calendar_file()['calendar_date'].max() < pd.Timestamp(datetime.date.today())
+        if stale:
+            # 每个进程最多自动联网一次，离线时不会在每次查询上反复重试
+            _CAL_CACHE['refresh_tried'] = True
+            refresh_calendar()
+
+    mtime = os.path.getmtime(CALENDAR_PATH) if os.path.exists(CALENDAR_PATH) else None
+    cache = _CAL_CACHE
+    if cache['cal'] is not None and cache['mtime'] == mtime:
+        return cache['cal']
+
+    horizon = np.datetime64(datetime.date.today(), 'D') + np.timedelta64(APPROX_HORIZON_DAYS, 'D')
+    if mtime is None:
+        print("⚠️ 无本地交易日历且无法联网，暂按周一至周五近似（节假日会被当作交易日）。")
+        first = np.datetime64(CALENDAR_START, 'D')
+        cal = _build(_weekdays(first, horizon), first, horizon, approx_from=first)
+    else:
+        df = _read_calendar_file()
+        first = np.datetime64(df['calendar_date'].min().date(), 'D')
+        last = np.datetime64(df['calendar_date'].max().date(), 'D')
+        days = df.loc[df['is_trading_day'] == 1, 'calendar_date'].values.astype('datetime64[D]')
+        approx_from = None
+        if last < horizon:
+            approx_from = last + np.timedelta64(1, 'D')
+            days = np.concatenate([days, _weekdays(approx_from, horizon)])
+            last = horizon
+        cal = _build(np.sort(days), first, last, approx_from=approx_from)
+    cache.update(mtime=mtime, cal=cal)
+    return cal
+
+
+def _offsets(cal: dict, dates) -> np.ndarray:
+    d = np.asarray(pd.to_datetime(dates).values, dtype='datetime64[D]')
+    off = (d - cal['first']).astype(np.int64)
+    if np.any(off < 0) or np.any(off >= len(cal['is_open'])):
+        raise ValueError(f"日期超出交易日历范围 [{cal['first']}, {cal['last']}]")
+    return off
+
+
+def _ts(cal: dict, idx: int) -> pd.Timestamp:
+    if idx < 0 or idx >= len(cal['days']):
+        raise ValueError("目标交易日超出交易日历范围")
+    return pd.Timestamp(cal['days'][idx])
+
+
+# ==========================================
+# 3. 查询接口
+# ==========================================
+def is_trading_day(date) -> bool:
+    cal = load_calendar()
+    return bool(cal['is_open'][_offsets(cal, [date])[0]])
+
+
+def trading_day_index(dates) -> np.ndarray:
+    """向量化：每个日期当天或之前最近交易日的序号。两日期序号之差即相隔的交易日数。"""
+    cal = load_calendar()
+    return cal['prev_idx'][_offsets(cal, dates)]
+
+
+def latest_trading_day(asof=None) -> pd.Timestamp:
+    """
+    asof 当天或之前的最近交易日。
+    asof 缺省为现在：若今天是交易日但还没到数据入库时间（DATA_READY_HOUR），返回上一交易日。
+    """
+    cal = load_calendar()
+    if asof is None:
+        now = datetime.datetime.now()
+        asof = now.date() if now.hour >= DATA_READY_HOUR else now.date() - datetime.timedelta(days=1)
+    return _ts(cal, int(cal['prev_idx'][_offsets(cal, [asof])[0]]))
+
+
+def shift_trading_days(date, n: int) -> pd.Timestamp:
+    """
+    date 之后第 n 个交易日（n<0 为之前）。
+    date 本身非交易日时：n>0 从之前最近交易日起算，n<0 从之后最近交易日起算，
+    即“周六之后 1 个交易日”为下周一，“周六之前 1 个交易日”为周五。
+    """
+    cal = load_calendar()
+    off = _offsets(cal, [date])[0]
+    idx = int(cal['prev_idx'][off])
+    if n < 0 and not cal['is_open'][off]:
+        idx += 1
+    return _ts(cal, idx + int(n))
+
+
+def trading_days_between(start, end):
+    """(start, end] 内的交易日个数；start 可为数组（向量化），end 为单个日期。"""
+    cal = load_calendar()
+    end_idx = cal['prev_idx'][_offsets(cal, [end])[0]]
+    if np.ndim(start) == 0:
+        return int(end_idx - cal['prev_idx'][_offsets(cal, [start])[0]])
+    return end_idx - cal['prev_idx'][_offsets(cal, start)]
+
+
+def trading_days(start, end) -> pd.DatetimeIndex:
+    """[start, end] 内的全部交易日。"""
+    cal = load_calendar()
+    lo, hi = _offsets(cal, [start, end])
+    i0 = int(cal['prev_idx'][lo]) + (0 if cal['is_open'][lo] else 1)
+    i1 = int(cal['prev_idx'][hi])
+    return pd.DatetimeIndex(cal['days'][i0:i1 + 1].astype('datetime64[ns]'))
+
+
+def rebalance_dates(start=None, end=None, freq: str = "W") -> pd.DatetimeIndex:
+    """
+    调仓日：每周（freq="W"）或每月（freq="M"）最后一个交易日，限定在 [start, end]。
+    区间末尾不完整的一周/一月取 end 之前最后一个交易日。
+    """
+    cal = load_calendar()
+    if freq not in cal['rebalance']:
+        days = cal['days']
+        if freq == "W":
+            # 1970-01-01 是周四，+3 后按 7 整除即以周一为一周起点
+            key = (days.astype(np.int64) + 3) // 7
+        elif freq == "M":
+            key = days.astype('datetime64[M]').astype(np.int64)
+        else:
+            raise ValueError(f"不支持的调仓频率: {freq}")
+        is_last = np.append(key[1:] != key[:-1], True)
+        cal['rebalance'][freq] = np.flatnonzero(is_last)
+    pos = cal['rebalance'][freq]
+    out = cal['days'][pos]
+    if start is not None:
+        out = out[out >= np.datetime64(pd.Timestamp(start).date(), 'D')]
+    if end is not None:
+        end_d = np.datetime64(pd.Timestamp(end).date(), 'D')
+        out = out[out <= end_d]
+        tail = latest_trading_day(end)
+        if (not len(out) or out[-1] < np.datetime64(tail.date(), 'D')) \
+                and (start is None or tail >= pd.Timestamp(start)):
+            out = np.append(out, np.datetime64(tail.date(), 'D'))
+    return pd.DatetimeIndex(out.astype('datetime64[ns]'))
+
+
+def next_rebalance_map(dates: pd.DatetimeIndex) -> dict:
+    """调仓日 -> 下一调仓日，用于计算持有到下一次调仓的收益。"""
+    dates = pd.DatetimeIndex(dates)
+    return dict(zip(dates[:-1], dates[1:]))
+
+
+if __name__ == "__main__":
+    refresh_calendar()
+    print(f"最近交易日: {latest_trading_day().date()}")
+    print(f"最近 4 个周调仓日: {[d.date() for d in rebalance_dates(end=latest_trading_day())[-4:]]}")
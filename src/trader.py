@@ -6,14 +6,27 @@ import joblib
 import datetime
 from tqdm import tqdm
 import sys
-import baostock as bs  # 引入 baostock 获取名称
 
-# --- 引入公共特征库 ---
+# --- 引入公共特征库（注册表）& 原始数据存储层 & 交易日历 & 证券主数据 & 基本面存储 & 截面标准化 ---
 try:
-    from src.features_lib import compute_all_features
+    from src import features_lib
+    from src import raw_store
+    from src import trade_calendar
+    from src import security_master
+    from src import fundamentals_store
+    from src import data_quality
+    from src import feature_state
+    from src import cross_section
 except ImportError:
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-    from src.features_lib import compute_all_features
+    from src import features_lib
+    from src import raw_store
+    from src import trade_calendar
+    from src import security_master
+    from src import fundamentals_store
+    from src import data_quality
+    from src import feature_state
+    from src import cross_section
 
 # --- 路径配置 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,46 +35,20 @@ RAW_DATA_DIR = os.path.join(PROJECT_ROOT, 'data', 'raw')
 PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
 MODELS_DIR = os.path.join(PROJECT_ROOT, 'models')
 
-# ==========================================
-# 0. 获取全市场股票名称 (用于识别 ST)
-# ==========================================
-def get_stock_names_map():
-    """
-    登录 Baostock，获取所有股票的最新名称
-    返回字典: {'sh.600000': '浦发银行', ...}
-    """
-    print("正在联网获取最新股票名称表...")
-    bs.login()
-    
-    name_map = {}
-    
-    # 尝试查询最近 5 天，只要查到数据就停止
-    for i in range(5):
-        date_chk = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime("%Y-%m-%d")
-        rs = bs.query_all_stock(day=date_chk)
-        
-        data_list = []
-        while rs.error_code == '0' and rs.next():
-            data_list.append(rs.get_row_data())
-            
-        if data_list:
-            df = pd.DataFrame(data_list, columns=rs.fields)
-            name_map = dict(zip(df['code'], df['code_name']))
-            print(f"成功获取名称表 (日期: {date_chk})，共 {len(name_map)} 只。")
-            break
-            
-    bs.logout()
-    return name_map
-
 # ==========================================
 # 1. 辅助检查函数
 # ==========================================
+FRESHNESS_MAX_LAG = 1  # 允许落后最近交易日的交易日数
+DATA_QUALITY_POLICY = "skip"  # 数据质量报告中 error 代码：ignore / skip / repair
+INCREMENTAL = True  # 指标走 feature_state：只对上次之后新增的 K 线计算
+
 def check_data_freshness(date_val):
-    data_date = pd.to_datetime(date_val).date()
-    today = datetime.datetime.now().date()
-    delta = (today - data_date).days
-    if delta > 3:
-        return False, f"数据过期 ({data_date})"
+    data_date = pd.to_datetime(date_val).normalize()
+    if pd.isna(data_date):
+        return False, "数据缺失"
+    lag = trade_calendar.trading_days_between(data_date, trade_calendar.latest_trading_day())
+    if lag > FRESHNESS_MAX_LAG:
+        return False, f"数据过期 ({data_date.date()}，落后 {lag} 个交易日)"
     return True, "最新"
 
 def is_valid_candidate(latest_row, stock_name=""):
@@ -97,73 +84,136 @@ def is_valid_candidate(latest_row, stock_name=""):
 # ==========================================
 # 2. 核心扫描逻辑
 # ==========================================
-def run_scanner():
-    print("🚀 启动实盘选股扫描器 (ST 防御版)...")
-    
-    # 1. 准备工作
+def load_scanner_context():
+    """模型 + 特征名 + 估值截面 + 名称表；没有模型文件返回 None。可随进程池 initializer 下发。"""
     model_path = os.path.join(MODELS_DIR, 'xgb_alpha_model.json')
     feat_path = os.path.join(MODELS_DIR, 'feature_names.pkl')
     
     if not os.path.exists(model_path):
         print("错误：未找到模型文件！")
-        return
+        return None
 
     model = xgb.XGBClassifier()
     model.load_model(model_path)
     feature_names = joblib.load(feat_path)
+    # 模型若用到截面标准化列（{特征}_cs_rank 等），先算出原始特征，打分时在整张快照上变换
+    cs_features, cs_methods = cross_section.parse_columns(feature_names)
+    needed = list(feature_names) + cs_features
+    
+    # 模型若用到估值因子，预先读一次基本面截面，逐只 as-of 拼接
+    fund_fields = [c for c in fundamentals_store.FIELDS if c in needed]
+    fund = fundamentals_store.load_fundamentals(fields=fund_fields) if fund_fields else None
     
-    # 获取名称表
-    name_map = get_stock_names_map()
+    # 获取名称表（本地证券主数据，最近一次采样的名称）
+    name_map = security_master.latest_names()
     if not name_map:
-        print("⚠️ 警告：无法获取股票名称，ST 过滤可能失效！")
+        print("⚠️ 警告：本地没有证券主数据，ST 过滤可能失效！请先运行 security_master 刷新。")
+
+    # 只算模型用到的特征（+ 清单里展示的 bb_width），依赖闭包由注册表解析
+    columns = features_lib.registered(list(dict.fromkeys(needed + ['bb_width'])))
+
+    return {'model': model, 'feature_names': feature_names, 'fund_fields': fund_fields,
+            'fund': fund, 'name_map': name_map, 'columns': columns,
+            'cross_section': (cs_features, cs_methods)}
+
+def candidate_row(code, ctx):
+    """
+    单只股票的最新一行特征（1 行 DataFrame，附 code / name / valid 列）；数据太短 / 过期返回 None，出错直接抛出。
+    ST / 涨跌停等不合格的也返回（valid=False）：它们仍属于当日截面，参与截面标准化后再剔除。
+    """
+    df = feature_state.update_code(code, ctx['columns']) if INCREMENTAL else raw_store.read_bars(code)
+    if df is None or len(df) < 30:
+        return None
+    fresh, _ = check_data_freshness(df['date'].iloc[-1])
+    if not fresh:
+        return None
+    
+    # 计算特征（增量模式下 feature_state 已算好）
+    if not INCREMENTAL:
+        df = features_lib.compute(df, ctx['columns'])
+    latest_row = df.iloc[[-1]].copy()
+    if ctx['fund_fields']:
+        latest_row = fundamentals_store.asof_join(latest_row.assign(code=code), ctx['fund_fields'], ctx['fund'])
+    
+    # 过滤器
+    stock_name = ctx['name_map'].get(code, "")
+    valid, reason = is_valid_candidate(latest_row.iloc[0], stock_name)
+    return latest_row.assign(code=code, name=stock_name, valid=valid)
+
+def score_snapshot(rows, ctx):
+    """
+    当日快照批量打分：各只最新一行拼成一张表，按模型需要补截面标准化列（整张快照为一个截面），
+    剔除不合格 / 特征缺失的，一次 predict_proba 给出上涨概率；返回清单记录列表。
+    """
+    rows = [r for r in rows if r is not None]
+    if not rows:
+        return []
+    snap = pd.concat(rows, ignore_index=True)
+    cs_features, cs_methods = ctx['cross_section']
+    if cs_features:
+        cross_section.transform(snap, cs_features, cs_methods, by=None)
+
+    feature_names = ctx['feature_names']
+    snap = snap[snap['valid'].astype(bool) & snap[feature_names].notna().all(axis=1)]
+    if snap.empty:
+        return []
+    probs = ctx['model'].predict_proba(snap[feature_names])[:, 1]
+
+    dates = pd.to_datetime(snap['date']).dt.strftime('%Y-%m-%d')
+    return [
+        {'code': code, 'name': name, 'date': date, 'close': close, 'pctChg': pct,
+         'probability': prob, 'bb_width': bw}
+        for code, name, date, close, pct, prob, bw in zip(
+            snap['code'].values, snap['name'].values, dates.values, snap['close'].values,
+            snap['pctChg'].values, probs, snap['bb_width'].values)
+    ]
+
+def run_scanner():
+    print("🚀 启动实盘选股扫描器 (ST 防御版)...")
+    
+    # 1. 准备工作
+    ctx = load_scanner_context()
+    if ctx is None:
+        return
 
     # 2. 读取股票池
     pool_path = os.path.join(PROCESSED_DIR, 'stock_pool.csv')
     stock_pool = pd.read_csv(pool_path)
     target_codes = stock_pool['code'].astype(str).tolist()
     
-    scan_results = []
+    # 新鲜度预检：直接查 manifest 索引，跳过停牌/未更新的股票，不必逐个打开文件
+    manifest = raw_store.load_manifest()
+    fresh_codes = []
+    for code in target_codes:
+        if code not in manifest.index:
+            continue
+        fresh, _ = check_data_freshness(manifest.at[code, 'last_date'])
+        if fresh:
+            fresh_codes.append(code)
+    if len(fresh_codes) < len(target_codes):
+        print(f"⚠️ 数据过期或缺失 {len(target_codes) - len(fresh_codes)} 只，已跳过。")
+    target_codes = data_quality.apply_policy(fresh_codes, DATA_QUALITY_POLICY)
     
     print(f"正在扫描 {len(target_codes)} 只股票...")
+    errors = []
+    rows = []
     
     for code in tqdm(target_codes):
-        file_path = os.path.join(RAW_DATA_DIR, f"{code}.csv")
-        if not os.path.exists(file_path):
-            continue
-            
         try:
-            df = pd.read_csv(file_path)
-            if len(df) < 30: continue
-            
-            # 计算特征
-            df = compute_all_features(df)
-            latest_row = df.iloc[[-1]].copy()
-            
-            # 过滤器
-            stock_name = name_map.get(code, "")
-            valid, reason = is_valid_candidate(latest_row.iloc[0], stock_name)
-            if not valid:
-                continue
-
-            if latest_row[feature_names].isnull().any().any():
-                continue
-                
-            prob = model.predict_proba(latest_row[feature_names])[0, 1]
-            
-            scan_results.append({
-                'code': code,
-                'name': stock_name,
-                'date': latest_row['date'].values[0],
-                'close': latest_row['close'].values[0],
-                'pctChg': latest_row['pctChg'].values[0],
-                'probability': prob,
-                'bb_width': latest_row['bb_width'].values[0]
-            })
-            
-        except Exception:
-            continue
+            rows.append(candidate_row(code, ctx))
+        except Exception as e:
+            errors.append((code, f"{type(e).__name__}: {e}"))
+
+    # 截面标准化 + 一次批量推理
+    scan_results = score_snapshot(rows, ctx)
+
+    if errors:
+        print(f"⚠️ {len(errors)} 只股票扫描出错，示例: " + "; ".join(f"{c}: {m}" for c, m in errors[:3]))
+
+    write_buy_list(scan_results)
 
-    # 3. 输出 Top 3
+def write_buy_list(scan_results):
+    """3. 输出 Top 3 并写出 buy_list_{日期}.csv；返回文件路径（无有效数据返回 None）。"""
     if scan_results:
         res_df = pd.DataFrame(scan_results)
         
@@ -193,9 +243,11 @@ def run_scanner():
         print(f"✅ 包含 ST 过滤的清单已生成: {save_path}")
         print("💡 最后一步：请务必在交易软件中再次确认 K 线形态！")
         print("-"*60)
+        return save_path
         
     else:
         print("未扫描到有效数据。")
+        return None
 
 if __name__ == "__main__":
     run_scanner()
\ No newline at end of file
@@ -0,0 +1,226 @@
+# src/universe.py
+"""
+时点股票池（universe）：对每个历史交易日重放 selection 的筛选规则，得到 日期 × 代码 的成员矩阵。
+
+- 规则与 selection.CRITERIA 一致：当日（未复权）收盘价 3-25 元、上市满 min_history 根 K 线、
+  最近 active_days 个交易日内有交易、排除科创板 / 北交所，再按最近 20 根 K 线平均成交额取前 target_pool_size；
+  每个日期只用当日及之前的数据，不再用“今天的股票池”回看历史（幸存者偏差 / 未来函数）；
+- 逐只读取在进程池里做（每只一次，按交易日轴向量化），跨截面排名对整张面板一次 np.partition；
+- 结果按位压缩（np.packbits）存为 data/processed/universe.npz：约 3000 天 × 5000 只 ≈ 2MB；
+- 查询全在本地：members(date) 取某日成员，is_member(codes, dates) 对 (代码, 日期) 对向量化查表。
+成交额并列恰好落在第 target_pool_size 名时会一并入选，个别日期可能略多于目标数量。
+"""
+import os
+import sys
+import json
+import datetime
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+try:
+    from src import raw_store
+    from src import trade_calendar
+    from src import selection
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from src import raw_store
+    from src import trade_calendar
+    from src import selection
+
+# --- 路径配置 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(CURRENT_DIR)
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, 'data', 'processed')
+UNIVERSE_PATH = os.path.join(PROCESSED_DIR, 'universe.npz')
+
+UNIVERSE_START = "2014-01-01"   # 与历史行情起点一致
+AMOUNT_WINDOW = 20              # 与 manifest 的 avg_amount_20 一致（最近 20 根 K 线）
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+EXCLUDED_PREFIXES = ('sh.688', 'bj', 'sz.8', 'sz.4')
+
+_WORKER = {'days': None, 'start_pos': 0, 'criteria': None}
+_CACHE = {'key': None, 'data': None}
+
+
+# ==========================================
+# 1. 成员矩阵
+# ==========================================
+class Universe:
+    """按位压缩的 日期 × 代码 成员矩阵（bits 每行 ceil(N/8) 字节，np.packbits 大端位序）。"""
+
+    def __init__(self, dates, codes, bits, criteria=None):
+        self.dates = pd.DatetimeIndex(dates)
+        self.codes = pd.Index(codes, dtype=object)
+        self.bits = np.asarray(bits, dtype=np.uint8)
+        self.criteria = criteria or {}
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _rows(self, dates) -> np.ndarray:
+        """日期 -> 行号：取当日或之前最近的一行（非交易日 / 晚于矩阵末尾按最近一行），早于起点为 -1。"""
+        d = pd.to_datetime(np.asarray(dates)).values.astype('datetime64[ns]')
+        return np.searchsorted(self.dates.values, d, side='right') - 1
+
+    def row(self, date) -> np.ndarray:
+        """某日成员布尔向量（与 self.codes 对齐）。"""
+        r = int(self._rows([date])[0])
+        if r < 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        return np.unpackbits(self.bits[r], count=len(self.codes)).astype(bool)
+
+    def members(self, date) -> list:
+        return self.codes[self.row(date)].tolist()
+
+    def is_member(self, codes, dates) -> np.ndarray:
+        """向量化查表：第 i 个元素为 codes[i] 在 dates[i] 当时是否在股票池内（未知代码 / 早于起点为 False）。"""
+        rows = self._rows(dates)
+        cols = self.codes.get_indexer(np.asarray(codes, dtype=object).astype(str))
+        ok = (rows >= 0) & (cols >= 0)
+        out = np.zeros(len(rows), dtype=bool)
+        r, c = rows[ok], cols[ok]
+        out[ok] = ((self.bits[r, c >> 3] >> (7 - (c & 7))) & 1) == 1
+        return out
+
+    def ever_members(self) -> list:
+        """区间内任一交易日入选过的代码（训练集需要覆盖的全部股票）。"""
+        any_row = np.bitwise_or.reduce(self.bits, axis=0)
+        return self.codes[np.unpackbits(any_row, count=len(self.codes)).astype(bool)].tolist()
+
+    def counts(self) -> pd.Series:
+        """每日成员数。"""
+        table = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+        return pd.Series(table[self.bits].sum(axis=1), index=self.dates)
+
+
+# ==========================================
+# 2. 逐只时间序列（进程池 worker）
+# ==========================================
+def _worker_init(store_config: dict, days: np.ndarray, start_pos: int, criteria: dict) -> None:
+    raw_store.apply_config(store_config)
+    _WORKER.update(days=days, start_pos=start_pos, criteria=criteria)
+
+
+def _code_series(code: str):
+    """
+    单只在交易日轴 [start, latest] 上的 (是否满足个股门槛, 20 根 K 线平均成交额)。
+    每个交易日取当日或之前最近一根 K 线的状态，与 manifest 在该日的取值口径一致。
+    """
+    days, start_pos, criteria = _WORKER['days'], _WORKER['start_pos'], _WORKER['criteria']
+    try:
+        df = raw_store.read_bars(code, columns=['date', 'close', 'amount'], adjust='none')
+    except Exception:
+        return code, None, None
+    if df.empty:
+        return code, None, None
+
+    bar_days = df['date'].values.astype('datetime64[D]')
+    close = pd.to_numeric(df['close'], errors='coerce').to_numpy(dtype=float)
+    amount20 = pd.to_numeric(df['amount'], errors='coerce').rolling(AMOUNT_WINDOW, min_periods=1).mean() \
+        .to_numpy(dtype=float) if 'amount' in df else np.full(len(df), np.nan)
+    bar_pos = np.searchsorted(days, bar_days)  # K 线所在交易日序号（非交易日的 K 线归到之后的交易日）
+
+    out_days = days[start_pos:]
+    last_bar = np.searchsorted(bar_days, out_days, side='right') - 1
+    has_bar = last_bar >= 0
+    j = np.clip(last_bar, 0, None)
+    lag = np.arange(start_pos, len(days)) - bar_pos[j]
+    passed = (has_bar
+              & (j + 1 >= criteria['min_history'])
+              & (lag <= criteria['active_days'])
+              & (close[j] >= criteria['min_price']) & (close[j] <= criteria['max_price']))
+    amount = np.where(passed, amount20[j], np.nan).astype(np.float32)
+    return code, passed, amount
+
+
+def _calendar_axis(start: str):
+    latest = trade_calendar.latest_trading_day()
+    days = trade_calendar.trading_days(trade_calendar.CALENDAR_START, latest).values.astype('datetime64[D]')
+    start_pos = int(np.searchsorted(days, np.datetime64(pd.Timestamp(start).date(), 'D')))
+    return days, start_pos
+
+
+# ==========================================
+# 3. 构建 / 读写
+# ==========================================
+def _top_k(passed: np.ndarray, amount: np.ndarray, k: int) -> np.ndarray:
+    """逐日在满足门槛的代码中按成交额取前 k（缺成交额的排最后）；整张面板一次 partition。"""
+    score = np.where(passed, np.nan_to_num(amount, nan=-1.0), -np.inf).astype(np.float32)
+    if score.shape[1] <= k:
+        return passed
+    kth = -np.partition(-score, k - 1, axis=1)[:, k - 1]
+    return passed & (score >= kth[:, None])
+
+
+def build_universe(start: str = UNIVERSE_START, criteria=None, workers: int = DEFAULT_WORKERS,
+                   write: bool = True) -> Universe | None:
+    """对 [start, 最近交易日] 每个交易日重放选股规则，返回（并写出）成员矩阵。"""
+    criteria = dict(criteria or selection.CRITERIA)
+    codes = [c for c in raw_store.list_codes() if not c.startswith(EXCLUDED_PREFIXES)]
+    if not codes:
+        print("本地没有行情数据，无法构建时点股票池。")
+        return None
+    days, start_pos = _calendar_axis(start)
+    n_days = len(days) - start_pos
+    raw_store.load_manifest()
+    workers = max(1, min(int(workers or 1), len(codes)))
+    initargs = (raw_store.get_config(), days, start_pos, criteria)
+
+    passed = np.zeros((n_days, len(codes)), dtype=bool)
+    amount = np.full((n_days, len(codes)), np.nan, dtype=np.float32)
+    col = {code: i for i, code in enumerate(codes)}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(), initializer=_worker_init,
+                                 initargs=initargs) as pool:
+            results = tqdm(pool.map(_code_series, codes, chunksize=32), total=len(codes),
+                           desc=f"时点股票池(x{workers})")
+            for code, p, a in results:
+                if p is not None:
+                    passed[:, col[code]], amount[:, col[code]] = p, a
+    else:
+        _worker_init(*initargs)
+        for code in tqdm(codes, desc="时点股票池"):
+            _, p, a = _code_series(code)
+            if p is not None:
+                passed[:, col[code]], amount[:, col[code]] = p, a
+
+    member = _top_k(passed, amount, int(criteria['target_pool_size']))
+    uni = Universe(days[start_pos:], codes, np.packbits(member, axis=1), criteria)
+    counts = uni.counts()
+    print(f"时点股票池: {len(uni)} 个交易日 × {len(codes)} 只，每日成员 {counts.min()}-{counts.max()}"
+          f"（最近 {counts.iloc[-1] if len(counts) else 0}），曾入选 {len(uni.ever_members())} 只")
+    if write:
+        save_universe(uni)
+    return uni
+
+
+def save_universe(uni: Universe, path: str = UNIVERSE_PATH) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    meta = {'criteria': uni.criteria, 'built_at': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+    with open(tmp, 'wb') as f:  # 传文件对象，避免 np.savez 自动追加 .npz 后缀
+        np.savez_compressed(f, bits=uni.bits, dates=uni.dates.values.astype('datetime64[D]'),
+                            codes=np.asarray(uni.codes, dtype=str), meta=json.dumps(meta, ensure_ascii=False))
+    os.replace(tmp, path)
+    print(f"已保存: {path}（{os.path.getsize(path) / 1024:.0f} KB）")
+
+
+def load_universe(path: str = UNIVERSE_PATH) -> Universe | None:
+    """读取成员矩阵（按文件修改时间缓存）；没有返回 None。"""
+    if not os.path.exists(path):
+        return None
+    key = (path, os.path.getmtime(path))
+    if _CACHE['key'] != key:
+        with np.load(path, allow_pickle=False) as z:
+            meta = json.loads(str(z['meta']))
+            uni = Universe(z['dates'].astype('datetime64[ns]'), z['codes'].astype(object), z['bits'],
+                           meta.get('criteria'))
+        _CACHE.update(key=key, data=uni)
+    return _CACHE['data']
+
+
+if __name__ == "__main__":
+    build_universe()
@@ -14,6 +14,10 @@ try:
     import feature_eng
     import label_maker
     import trader
+    import security_master
+    import data_quality
+    import pipeline
+    import universe
 except ImportError as e:
     print(f"❌ 导入模块失败: {e}")
     print("请确保 data_loader.py, selection.py, feature_eng.py 等都在 src 目录下")
@@ -24,30 +28,53 @@ def print_step(step_name):
     print(f"🚀 {step_name}")
     print("="*50)
 
-def run_weekly_routine():
+# 运行模式：pipelined（下载与特征 / 打分重叠，见 pipeline.py）/ sequential（逐步顺序执行）
+RUN_MODE = "pipelined"
+
+def run_weekly_routine(mode=RUN_MODE):
     start_time = time.time()
     today = datetime.datetime.now().strftime("%Y-%m-%d")
-    print(f"开始执行周度更新任务 | 日期: {today}")
+    print(f"开始执行周度更新任务 | 日期: {today} | 模式: {mode}")
+
+    if mode == "pipelined":
+        print_step("流水线: 下载 → 数据质量 / 特征 / 实盘打分 重叠执行")
+        pipeline.run_pipelined(start_date="2014-01-01", download_workers=data_loader.DEFAULT_WORKERS)
+        print_summary(start_time)
+        return
 
     # ==========================================
     # 第一步：全量数据更新
     # ==========================================
     print_step("Step 1: 更新全市场数据 & 指数")
     try:
-        data_loader.download_all_stock_history(start_date="2014-01-01")
+        data_loader.download_all_stock_history(start_date="2014-01-01", workers=data_loader.DEFAULT_WORKERS)
     except Exception as e:
         print(f"⚠️ 个股数据下载出现警告: {e}")
 
     try:
-        label_maker.download_benchmark_index(start_date="2014-01-01")
+        security_master.refresh_security_master()
+    except Exception as e:
+        print(f"⚠️ 证券主数据刷新失败: {e}")
+
+    try:
+        data_loader.update_benchmarks()
     except Exception as e:
         print(f"⚠️ 指数下载失败: {e}")
 
+    # 数据质量扫描：能本地修好的先修，其余重新下载；报告供特征工程 / 实盘扫描跳过问题股票
+    try:
+        data_quality.scan_all()
+        data_quality.repair()
+    except Exception as e:
+        print(f"⚠️ 数据质量扫描失败: {e}")
+
     # ==========================================
     # 第二步：动态优选股票池
     # ==========================================
     print_step("Step 2: 重新筛选股票池 (Top 1000)")
     selection.filter_stock_pool()
+    # 历史每个交易日的时点股票池（训练集 / 回测用，避免幸存者偏差）
+    universe.build_universe()
 
     # ==========================================
     # 第三步：更新特征库 (历史训练集)
@@ -62,9 +89,9 @@ def run_weekly_routine():
     print_step("Step 4: 执行实盘选股扫描")
     trader.run_scanner()
 
-    # ==========================================
-    # 总结
-    # ==========================================
+    print_summary(start_time)
+
+def print_summary(start_time):
     elapsed = (time.time() - start_time) / 60
     today_str = datetime.datetime.now().strftime("%Y-%m-%d") # 获取今日日期字符串
     